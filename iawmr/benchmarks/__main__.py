@@ -0,0 +1,151 @@
+from typing import Optional, Tuple
+import os
+import sys
+import tempfile
+
+import click
+
+from iawmr.benchmarks.ann import AnnBenchmark
+from iawmr.benchmarks.corpus import CorpusGenerator, CorpusSpec
+from iawmr.benchmarks.harness import Benchmark, BenchmarkReport
+from iawmr.deep_code.ann import ForestOptions
+from iawmr.deep_code.embeddings import EmbeddingStore
+from iawmr.deep_code.parsing.state import ParsingEngine, ParsingOptions
+
+
+@click.group()
+def benchmarks():
+  pass
+
+
+@benchmarks.command()
+@click.option("--root-path", type=click.Path(exists=True, file_okay=False), default=None, help="Benchmark this tree instead of a synthetic corpus.")
+@click.option("--ignore", "ignores", multiple=True, default=["venv", ".git"], help="gitignore style pattern of paths not to parse (repeatable).")
+@click.option("--modules", type=int, default=CorpusSpec().modules)
+@click.option("--depth", type=int, default=CorpusSpec().depth, help="How deep blocks nest in function bodies.")
+@click.option("--expression-size", type=int, default=CorpusSpec().expression_size, help="Terms per expression.")
+@click.option("--statements-per-block", type=int, default=CorpusSpec().statements_per_block)
+@click.option("--imports", type=int, default=CorpusSpec().imports_per_module, help="Imports per module.")
+@click.option("--seed", type=int, default=CorpusSpec().seed)
+@click.option("--repeats", type=click.IntRange(min=1), default=3)
+@click.option("--engine", type=click.Choice([engine.value for engine in ParsingEngine]), default=ParsingEngine.Recursive.value)
+@click.option("--lazy-bodies", is_flag=True, default=False)
+@click.option("--validate-nodes", is_flag=True, default=False)
+@click.option("--skip-validation", is_flag=True, default=False, help="Skip the validate_tree stage (fast mode).")
+@click.option("--no-json", is_flag=True, default=False, help="Skip the write_json stage.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the report here.")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), default=None, help="Compare against this report.")
+@click.option("--tolerance", type=float, default=0.1, help="Flag stages that got slower than this (0.1 = 10%).")
+def run(
+  root_path: Optional[str],
+  ignores: Tuple[str, ...],
+  modules: int,
+  depth: int,
+  expression_size: int,
+  statements_per_block: int,
+  imports: int,
+  seed: int,
+  repeats: int,
+  engine: str,
+  lazy_bodies: bool,
+  validate_nodes: bool,
+  skip_validation: bool,
+  no_json: bool,
+  output: Optional[str],
+  baseline: Optional[str],
+  tolerance: float,
+):
+  options = ParsingOptions(engine=ParsingEngine(engine), validate_nodes=validate_nodes, lazy_bodies=lazy_bodies, validate_tree=not skip_validation)
+  with tempfile.TemporaryDirectory(prefix="iawmr-corpus-") as corpus_directory:
+    corpus = None
+    if root_path is None:
+      corpus = CorpusSpec(
+        modules=modules,
+        depth=depth,
+        expression_size=expression_size,
+        statements_per_block=statements_per_block,
+        imports_per_module=imports,
+        seed=seed,
+      )
+      CorpusGenerator.generate(spec=corpus, root_path=corpus_directory)
+      root_path = corpus_directory
+    report = Benchmark.run(
+      root_path=root_path,
+      repeats=repeats,
+      options=options,
+      ignores=list(ignores),
+      write_jsons=not no_json,
+      corpus=corpus,
+    )
+  print(report.summary())
+  if output is not None:
+    report.save(output)
+  if baseline is not None:
+    sys.exit(report_comparison(BenchmarkReport.load(baseline), report, tolerance))
+
+
+@benchmarks.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option("--tolerance", type=float, default=0.1, help="Flag stages that got slower than this (0.1 = 10%).")
+def compare(baseline: str, current: str, tolerance: float):
+  sys.exit(report_comparison(BenchmarkReport.load(baseline), BenchmarkReport.load(current), tolerance))
+
+
+@benchmarks.command()
+@click.option("--embeddings", type=click.Path(exists=True, dir_okay=False), default=None, help="Benchmark this EmbeddingStore instead of synthetic vectors.")
+@click.option("--rows", type=int, default=200000, help="Synthetic vectors.")
+@click.option("--dimensions", type=int, default=64, help="Of the synthetic vectors.")
+@click.option("--trees", type=int, default=ForestOptions().trees)
+@click.option("--leaf-size", type=int, default=ForestOptions().leaf_size)
+@click.option("--seed", type=int, default=ForestOptions().seed)
+@click.option("--k", type=int, default=10, help="Neighbors per query.")
+@click.option("--queries", type=int, default=200)
+@click.option("--search-k", "search_ks", type=int, multiple=True, default=[256, 1024, 4096], help="Candidates per query (repeatable).")
+@click.option("--node-type", type=str, default=None, help="Only look for nodes of this type (e.g. Function).")
+@click.option("--forest", type=click.Path(dir_okay=False), default=None, help="Keep the built forest here.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the report here.")
+def ann(
+  embeddings: Optional[str],
+  rows: int,
+  dimensions: int,
+  trees: int,
+  leaf_size: int,
+  seed: int,
+  k: int,
+  queries: int,
+  search_ks: Tuple[int, ...],
+  node_type: Optional[str],
+  forest: Optional[str],
+  output: Optional[str],
+):
+  """Recall against latency of the approximate nearest neighbors (see ProjectionForest), against exact search."""
+  options = ForestOptions(trees=trees, leaf_size=leaf_size, seed=seed)
+  with tempfile.TemporaryDirectory(prefix="iawmr-ann-") as scratch:
+    if embeddings is None:
+      store = AnnBenchmark.synthetic_store(os.path.join(scratch, "synthetic" + EmbeddingStore.SUFFIX), rows=rows, dimensions=dimensions, seed=seed)
+    else:
+      store = EmbeddingStore.open(embeddings)
+    report = AnnBenchmark.run(
+      store=store,
+      options=options,
+      k=k,
+      queries=queries,
+      search_ks=list(search_ks),
+      node_type=node_type,
+      embeddings=embeddings,
+      forest_path=forest,
+    )
+  print(report.summary())
+  if output is not None:
+    report.save(output)
+
+
+def report_comparison(baseline: BenchmarkReport, current: BenchmarkReport, tolerance: float) -> int:
+  regressions = Benchmark.compare(baseline=baseline, current=current, tolerance=tolerance)
+  print(Benchmark.comparison_table(baseline=baseline, current=current, regressions=regressions))
+  return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+  benchmarks()
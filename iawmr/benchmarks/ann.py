@@ -0,0 +1,135 @@
+from typing import List, Optional, Tuple
+import json
+import platform
+import statistics
+import time
+
+import numpy as np
+
+import iawmr.deep_code.model as model
+from iawmr.deep_code.ann import ForestOptions, ProjectionForest
+from iawmr.deep_code.embeddings import EmbeddingStore
+
+
+class SearchTiming(model.BaseModel):
+  # 0 for the exact search
+  search_k: int
+  # Of the exact top k, the share found
+  recall: float
+  mean_ms: float
+  p95_ms: float
+
+
+class AnnReport(model.BaseModel):
+  python: str
+  machine: str
+  # None for a synthetic store
+  embeddings: Optional[str] = None
+  rows: int
+  dimensions: int
+  forest: ForestOptions
+  build_seconds: float
+  forest_bytes: int
+  k: int
+  queries: int
+  node_type: Optional[str] = None
+  exact: SearchTiming
+  searches: List[SearchTiming]
+
+  def summary(self) -> str:
+    lines = [
+      f"{self.rows} rows x {self.dimensions}, {self.forest.trees} trees of leaves of {self.forest.leaf_size}: built in {self.build_seconds:.2f}s, {self.forest_bytes / 1e6:.1f}MB",
+      f"top {self.k} of {self.queries} queries" + ("" if self.node_type is None else f", {self.node_type} only"),
+      f"  {'exact':<16} recall {self.exact.recall:.3f}  mean {self.exact.mean_ms:8.3f}ms  p95 {self.exact.p95_ms:8.3f}ms",
+    ]
+    for search in self.searches:
+      lines.append(f"  search_k {search.search_k:<7} recall {search.recall:.3f}  mean {search.mean_ms:8.3f}ms  p95 {search.p95_ms:8.3f}ms")
+    return "\n".join(lines)
+
+  def save(self, path: str) -> None:
+    with open(path, "w") as f:
+      json.dump(json.loads(self.model_dump_json()), f, indent=2)
+
+
+class AnnBenchmark:
+  """
+  Recall against latency of ProjectionForest.similar, for a few search_k, next to the exact search
+  (EmbeddingStore.similar) it is measured against. The queries are rows of the store, one at a time.
+  """
+  NODE_TYPES = ["Module", "Class", "Function"]
+
+  @classmethod
+  def synthetic_store(cls, path: str, rows: int = 200000, dimensions: int = 64, clusters: int = 2000, seed: int = 0) -> EmbeddingStore:
+    """Rows around clusters random centers (embeddings have neighborhoods, uniform noise doesn't), with random NODE_TYPES."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + 0.35 * rng.standard_normal((rows, dimensions)).astype(np.float32)
+    node_types = rng.integers(0, len(cls.NODE_TYPES), rows).astype(np.int8)
+    return EmbeddingStore.write(path, ids=np.arange(rows), vectors=vectors, node_types=node_types, node_type_names=cls.NODE_TYPES)
+
+  @classmethod
+  def timed(cls, search, ids: List[int], k: int, node_type: Optional[str]) -> Tuple[List[List[int]], List[float]]:
+    found = []
+    seconds = []
+    for id in ids:
+      start = time.perf_counter()
+      result, _ = search([id], k=k, node_type=node_type)
+      seconds.append(time.perf_counter() - start)
+      found.append([found_id for found_id in result[0].tolist() if found_id >= 0])
+    return found, seconds
+
+  @classmethod
+  def timing(cls, search_k: int, found: List[List[int]], exact: List[List[int]], seconds: List[float]) -> SearchTiming:
+    hits = sum(len(set(ids) & set(expected)) for ids, expected in zip(found, exact))
+    total = sum(len(expected) for expected in exact)
+    milliseconds = sorted(second * 1e3 for second in seconds)
+    return SearchTiming(
+      search_k=search_k,
+      recall=hits / total if total else 1.0,
+      mean_ms=statistics.mean(milliseconds),
+      p95_ms=milliseconds[min(len(milliseconds) - 1, int(len(milliseconds) * 0.95))],
+    )
+
+  @classmethod
+  def run(
+    cls,
+    store: EmbeddingStore,
+    options: Optional[ForestOptions] = None,
+    k: int = 10,
+    queries: int = 200,
+    search_ks: Optional[List[int]] = None,
+    node_type: Optional[str] = None,
+    embeddings: Optional[str] = None,
+    forest_path: Optional[str] = None,
+  ) -> AnnReport:
+    options = options or ForestOptions()
+    start = time.perf_counter()
+    forest = ProjectionForest.build(store, options)
+    build_seconds = time.perf_counter() - start
+    if forest_path is not None:
+      forest.write(forest_path)
+    rng = np.random.default_rng(options.seed)
+    ids = store.ids[rng.choice(len(store), min(queries, len(store)), replace=False)].tolist()
+
+    exact, seconds = cls.timed(store.similar, ids, k, node_type)
+    searches = []
+    for search_k in search_ks or [256, 1024, 4096]:
+      def search(query_ids, k, node_type):
+        return forest.similar(query_ids, k=k, node_type=node_type, search_k=search_k)
+      found, search_seconds = cls.timed(search, ids, k, node_type)
+      searches.append(cls.timing(search_k, found, exact, search_seconds))
+    return AnnReport(
+      python=platform.python_version(),
+      machine=platform.machine(),
+      embeddings=embeddings,
+      rows=len(store),
+      dimensions=store.dimensions,
+      forest=options,
+      build_seconds=build_seconds,
+      forest_bytes=forest.nbytes(),
+      k=k,
+      queries=len(ids),
+      node_type=node_type,
+      exact=cls.timing(0, exact, exact, seconds),
+      searches=searches,
+    )
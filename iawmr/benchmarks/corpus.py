@@ -0,0 +1,105 @@
+from typing import List
+import os
+import random
+
+import iawmr.deep_code.model as model
+
+
+class CorpusSpec(model.BaseModel):
+  """
+  The shape of a synthetic source tree.
+
+  Every module gets classes_per_module classes with methods_per_class methods, plus the same number of
+  top level functions. Function bodies nest ifs/fors depth deep, with statements_per_block assignments
+  per block, each expression_size terms long. Every module imports imports_per_module functions from
+  other modules and calls them, so there is something to resolve.
+  """
+  modules: int = 100
+  modules_per_package: int = 20
+  classes_per_module: int = 3
+  methods_per_class: int = 4
+  depth: int = 2
+  statements_per_block: int = 3
+  expression_size: int = 4
+  imports_per_module: int = 5
+  seed: int = 0
+  package_name: str = "corpus"
+
+  def module_name(self, index: int) -> str:
+    return f"{self.package_name}.package_{index // self.modules_per_package}.module_{index}"
+
+  def relative_path(self, index: int) -> str:
+    return os.path.join(*self.module_name(index).split(".")) + ".py"
+
+
+class CorpusGenerator:
+  @classmethod
+  def expression(cls, spec: CorpusSpec, rng: random.Random, names: List[str]) -> str:
+    terms = []
+    for _ in range(spec.expression_size):
+      kind = rng.random()
+      if kind < 0.4:
+        terms.append(rng.choice(names))
+      elif kind < 0.7:
+        terms.append(str(rng.randint(0, 100)))
+      else:
+        terms.append(f"len({rng.choice(names)}.items)")
+    return rng.choice([" + ", " * ", " - "]).join(terms)
+
+  @classmethod
+  def block(cls, spec: CorpusSpec, rng: random.Random, names: List[str], calls: List[str], depth: int, indent: str) -> List[str]:
+    lines = []
+    for i in range(spec.statements_per_block):
+      variable = f"value_{depth}_{i}"
+      lines.append(f"{indent}{variable} = {cls.expression(spec=spec, rng=rng, names=names)}")
+      names = names + [variable]
+    if calls:
+      lines.append(f"{indent}{rng.choice(calls)}({names[-1]})")
+    if depth > 0:
+      if rng.random() < 0.5:
+        lines.append(f"{indent}if {names[-1]} > {rng.randint(0, 100)}:")
+        inner_names = names
+      else:
+        lines.append(f"{indent}for item_{depth} in range({names[-1]}):")
+        inner_names = names + [f"item_{depth}"]
+      lines.extend(cls.block(spec=spec, rng=rng, names=inner_names, calls=calls, depth=depth - 1, indent=indent + "  "))
+    lines.append(f"{indent}return {names[-1]}")
+    return lines
+
+  @classmethod
+  def module_source(cls, spec: CorpusSpec, index: int) -> str:
+    rng = random.Random(spec.seed * 1_000_003 + index)
+    lines = ["import os", ""]
+    calls = []
+    others = [other for other in range(spec.modules) if other != index]
+    for other in rng.sample(others, min(spec.imports_per_module, len(others))):
+      function = f"function_{other}_0"
+      lines.append(f"from {spec.module_name(other)} import {function}")
+      calls.append(function)
+    lines.append("")
+    for c in range(spec.classes_per_module):
+      lines.append(f"class Class_{index}_{c}:")
+      lines.append(f"  items = []")
+      for m in range(spec.methods_per_class):
+        lines.append(f"  def method_{m}(self, argument):")
+        method_calls = calls + [f"self.method_{other}" for other in range(m)]
+        lines.extend(cls.block(spec=spec, rng=rng, names=["argument", "self"], calls=method_calls, depth=spec.depth, indent="    "))
+      lines.append("")
+    for f in range(spec.classes_per_module):
+      lines.append(f"def function_{index}_{f}(argument):")
+      lines.append(f"  instance = Class_{index}_{f}()")
+      lines.extend(cls.block(spec=spec, rng=rng, names=["argument", "instance"], calls=calls, depth=spec.depth, indent="  "))
+      lines.append("")
+    return "\n".join(lines) + "\n"
+
+  @classmethod
+  def generate(cls, spec: CorpusSpec, root_path: str) -> List[str]:
+    """Writes the corpus under root_path, returns the file paths."""
+    file_paths = []
+    for index in range(spec.modules):
+      file_path = os.path.join(root_path, spec.relative_path(index))
+      os.makedirs(os.path.dirname(file_path), exist_ok=True)
+      with open(file_path, "w") as f:
+        f.write(cls.module_source(spec=spec, index=index))
+      file_paths.append(file_path)
+    return file_paths
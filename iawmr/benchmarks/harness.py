@@ -0,0 +1,272 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import ast
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import iawmr.deep_code.model as model
+import iawmr.deep_code.project as project
+from iawmr.benchmarks.corpus import CorpusSpec
+from iawmr.deep_code.parsing.parser import Parsers
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.state import ParsingEngine, ParsingOptions, ParsingState
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+from iawmr.deep_code.validation import TreeValidationError, TreeValidator
+
+
+class StageTiming(model.BaseModel):
+  name: str
+  # One per repeat
+  seconds: List[float]
+  best: float
+  median: float
+
+  @classmethod
+  def create(cls, name: str, seconds: List[float]) -> "StageTiming":
+    return cls(name=name, seconds=seconds, best=min(seconds), median=statistics.median(seconds))
+
+
+class BenchmarkReport(model.BaseModel):
+  python: str
+  machine: str
+  root_path: str
+  corpus: Optional[CorpusSpec] = None
+  options: ParsingOptions
+  repeats: int
+  files: int
+  source_bytes: int
+  nodes: int
+  references: int
+  stages: List[StageTiming]
+
+  def stage(self, name: str) -> Optional[StageTiming]:
+    for stage in self.stages:
+      if stage.name == name:
+        return stage
+    return None
+
+  def save(self, path: str) -> None:
+    with open(path, "w") as f:
+      json.dump(json.loads(self.model_dump_json()), f, indent=2)
+
+  @classmethod
+  def load(cls, path: str) -> "BenchmarkReport":
+    with open(path, "r") as f:
+      return cls.model_validate(json.load(f))
+
+  def summary(self) -> str:
+    lines = [f"{self.files} files, {self.source_bytes} bytes, {self.nodes} nodes, {self.references} references"]
+    for stage in self.stages:
+      per_node = "" if not self.nodes else f"  ({stage.best / self.nodes * 1e6:.2f} us/node)"
+      lines.append(f"  {stage.name:<24} best {stage.best:9.4f}s  median {stage.median:9.4f}s{per_node}")
+    return "\n".join(lines)
+
+
+class Regression(model.BaseModel):
+  stage: str
+  baseline: float
+  current: float
+
+  @property
+  def ratio(self) -> float:
+    return self.current / self.baseline if self.baseline else float("inf")
+
+
+class Stopwatch:
+  """Accumulates the time spent in each stage over one repeat."""
+  totals: Dict[str, float]
+
+  def __init__(self):
+    self.totals = {}
+
+  @contextmanager
+  def stage(self, name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+
+class Benchmark:
+  """
+  Runs the pipeline one stage at a time, over every file, so each stage can be timed on its own:
+
+    discovery, read, ast.parse, parse_module, validate_tree, write_json, resolve_references
+
+  write_json writes its output relative to the working directory, so the stages are run from a scratch
+  directory. resolve_references is timed without a report (see reports.ReportSink), as production runs it.
+  """
+  STAGES = [
+    "discovery",
+    "read",
+    "ast_parse",
+    "parse_module",
+    "validate_tree",
+    "write_json",
+    "resolve_references",
+  ]
+
+  @classmethod
+  def run_once(
+    cls,
+    root_path: str,
+    parsing_strategy: ParsingStrategy,
+    ignores: List[str],
+    options: ParsingOptions,
+    write_jsons: bool,
+  ) -> Tuple[Dict[str, float], project.Project, int]:
+    stopwatch = Stopwatch()
+    with stopwatch.stage("discovery"):
+      file_paths = Parsing.find_source_files(root_path=root_path, ignores=ignores)
+
+    sources: List[Tuple[str, str]] = []
+    with stopwatch.stage("read"):
+      for file_path in file_paths:
+        with open(file_path, "r") as f:
+          sources.append((os.path.relpath(file_path, start=root_path), f.read()))
+
+    trees = []
+    with stopwatch.stage("ast_parse"):
+      for _, source in sources:
+        trees.append(ast.parse(source))
+
+    modules: Dict[str, model.Module] = {}
+    with stopwatch.stage("parse_module"):
+      for (relative_path, source), tree in zip(sources, trees):
+        module_path = Parsing.fs_path_to_py_path(relative_path)
+        state = ParsingState.create(module_path=module_path, parsing_strategy=parsing_strategy, options=options, source=source)
+        parsers = Parsers.create(state=state)
+        if options.engine == ParsingEngine.Iterative:
+          module = Parsing.parse_module_iteratively(parsers=parsers, node=tree)
+        else:
+          module = Parsing.parse_module(parsers=parsers, node=tree)
+        assert module
+        modules[module_path] = module
+
+    if options.validate_tree:
+      with stopwatch.stage("validate_tree"):
+        validator = TreeValidator()
+        for module in modules.values():
+          validator.add_module(module)
+        # Always look for duplicates (so they are timed), real code has some so only raise with unique_paths.
+        violations = validator.violations(unique_paths=True)
+        if not options.unique_paths:
+          violations = validator.descendants_of_themselves
+        if violations:
+          raise TreeValidationError(violations)
+
+    if write_jsons:
+      with stopwatch.stage("write_json"):
+        for relative_path, _ in sources:
+          Parsing.write_json(relative_path=relative_path, module=modules[Parsing.fs_path_to_py_path(relative_path)])
+
+    spec = project.ProjectSpec(
+      name="benchmark",
+      sources=[root_path],
+      venv=None,
+      ignores=ignores,
+      parsing_strategy=parsing_strategy,
+    )
+    result = project.Project(
+      spec=spec,
+      sources=[project.SourceDirectory(root_path=root_path, package_type=project.SourceDirectoryType.Application, modules=modules)],
+    )
+    with stopwatch.stage("resolve_references"):
+      result.resolve_references()
+    return stopwatch.totals, result, sum(len(source) for _, source in sources)
+
+  @classmethod
+  def run(
+    cls,
+    root_path: str,
+    repeats: int = 3,
+    options: Optional[ParsingOptions] = None,
+    ignores: Optional[List[str]] = None,
+    write_jsons: bool = True,
+    corpus: Optional[CorpusSpec] = None,
+  ) -> BenchmarkReport:
+    if repeats < 1:
+      raise ValueError(f"repeats has to be at least 1, got {repeats}")
+    options = options or ParsingOptions()
+    ignores = ["venv", ".git"] if ignores is None else ignores
+    parsing_strategy = ParsingStrategy.create()
+    root_path = os.path.abspath(root_path)
+    timings: Dict[str, List[float]] = {}
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="iawmr-benchmark-") as scratch:
+      os.makedirs(os.path.join(scratch, "output.dir"))
+      os.chdir(scratch)
+      try:
+        for _ in range(repeats):
+          totals, result, source_bytes = cls.run_once(
+            root_path=root_path,
+            parsing_strategy=parsing_strategy,
+            ignores=ignores,
+            options=options,
+            write_jsons=write_jsons,
+          )
+          for name, seconds in totals.items():
+            timings.setdefault(name, []).append(seconds)
+      finally:
+        os.chdir(previous_directory)
+    nodes = 0
+    references = 0
+    for module in result.modules():
+      for node, _ in module.all_nodes():
+        nodes += 1
+        references += len(node.references)
+    return BenchmarkReport(
+      python=platform.python_version(),
+      machine=platform.platform(),
+      root_path=root_path,
+      corpus=corpus,
+      options=options,
+      repeats=repeats,
+      files=len(list(result.modules())),
+      source_bytes=source_bytes,
+      nodes=nodes,
+      references=references,
+      stages=[StageTiming.create(name=name, seconds=timings[name]) for name in cls.STAGES if name in timings],
+    )
+
+  @classmethod
+  def compare(
+    cls,
+    baseline: BenchmarkReport,
+    current: BenchmarkReport,
+    tolerance: float = 0.1,
+    min_seconds: float = 0.005,
+  ) -> List[Regression]:
+    """
+    Stages that got more than tolerance slower (best of the repeats against best of the repeats).
+    Differences under min_seconds are noise.
+    """
+    regressions = []
+    for stage in current.stages:
+      before = baseline.stage(stage.name)
+      if before is None:
+        continue
+      if stage.best - before.best > min_seconds and stage.best > before.best * (1 + tolerance):
+        regressions.append(Regression(stage=stage.name, baseline=before.best, current=stage.best))
+    return regressions
+
+  @classmethod
+  def comparison_table(cls, baseline: BenchmarkReport, current: BenchmarkReport, regressions: List[Regression]) -> str:
+    regressed = {regression.stage for regression in regressions}
+    lines = [f"  {'stage':<24} {'baseline':>10} {'current':>10} {'ratio':>7}"]
+    for stage in current.stages:
+      before = baseline.stage(stage.name)
+      if before is None:
+        lines.append(f"  {stage.name:<24} {'-':>10} {stage.best:10.4f}")
+        continue
+      ratio = stage.best / before.best if before.best else float("inf")
+      flag = "  REGRESSION" if stage.name in regressed else ""
+      lines.append(f"  {stage.name:<24} {before.best:10.4f} {stage.best:10.4f} {ratio:7.2f}{flag}")
+    if baseline.files != current.files or baseline.nodes != current.nodes:
+      lines.append(f"  (different inputs: {baseline.files} files/{baseline.nodes} nodes vs {current.files} files/{current.nodes} nodes)")
+    return "\n".join(lines)
@@ -0,0 +1,251 @@
+from typing import List, Optional, Sequence, Tuple, Union
+import heapq
+import mmap
+
+import numpy as np
+
+import iawmr.deep_code.model as model
+from iawmr.deep_code.embeddings import EmbeddingStore, normalize_rows, read_section_file, write_section_file
+
+
+class ForestOptions(model.BaseModel):
+  # More trees: better recall for the same search_k, more memory and build time
+  trees: int = 16
+  # Rows per leaf, at most (unless they are all the same vector)
+  leaf_size: int = 64
+  seed: int = 0
+
+
+class ProjectionForest:
+  """
+  Approximate nearest neighbors (by cosine) over an EmbeddingStore's rows, for "nodes like this one"
+  queries that don't scan every row (see EmbeddingStore.top_k for the exact ones).
+
+  Each tree splits the rows in two, again and again until the leaves are small, with the hyperplane
+  halfway between two random rows of the ones being split (like Annoy). A query goes down every tree at
+  once, best side first, and then to the other sides that were closest to the split (a priority queue
+  on the distance to the hyperplanes), until its leaves have search_k candidates. Only the candidates
+  are scored exactly: search_k trades latency for recall.
+
+  The trees are flat arrays, with the node i of every tree in the same ones:
+
+    normals[i], thresholds[i]: the split, a row goes left when normal . row < threshold
+    children[i]: left, right, as node indexes, or ~leaf for leaves
+    leaf_rows[leaf_offsets[leaf]:leaf_offsets[leaf + 1]]: the store rows in a leaf
+    roots[tree]: the top of each tree (~leaf if it's all one leaf)
+
+  Saved like the EmbeddingStore (see write), and opened read only through mmap.
+  """
+  MAGIC = b"IAWMRANN"
+  VERSION = 1
+  SUFFIX = ".forest"
+  SECTIONS = ["normals", "thresholds", "children", "leaf_offsets", "leaf_rows", "roots"]
+
+  store: EmbeddingStore
+  options: ForestOptions
+  normals: np.ndarray
+  thresholds: np.ndarray
+  children: np.ndarray
+  leaf_offsets: np.ndarray
+  leaf_rows: np.ndarray
+  roots: np.ndarray
+  # When opened from a file
+  map: Optional[mmap.mmap]
+  # children and thresholds as lists, see candidates
+  child_lists: Optional[List[List[int]]]
+  threshold_list: Optional[List[float]]
+
+  def __init__(self, store: EmbeddingStore, options: ForestOptions, **sections: np.ndarray):
+    self.store = store
+    self.options = options
+    self.map = None
+    self.child_lists = None
+    self.threshold_list = None
+    for name in self.SECTIONS:
+      setattr(self, name, sections[name])
+
+  @classmethod
+  def build(cls, store: EmbeddingStore, options: Optional[ForestOptions] = None) -> "ProjectionForest":
+    options = options or ForestOptions()
+    rng = np.random.default_rng(options.seed)
+    unit = store.vectors if store.normalized else normalize_rows(store.vectors)
+    normals: List[np.ndarray] = []
+    thresholds: List[float] = []
+    children: List[List[int]] = []
+    leaves: List[np.ndarray] = []
+    roots: List[int] = []
+    for _ in range(options.trees):
+      # (rows, the node whose child they'll be, which child), the root's isn't a child
+      pending: List[Tuple[np.ndarray, int, int]] = [(np.arange(len(store), dtype=np.int32), -1, 0)]
+      while pending:
+        rows, parent, side = pending.pop()
+        split = cls._split(unit, rows, options.leaf_size, rng)
+        if split is None:
+          node = ~len(leaves)
+          leaves.append(rows)
+        else:
+          normal, threshold, left = split
+          node = len(normals)
+          normals.append(normal)
+          thresholds.append(threshold)
+          children.append([0, 0])
+          pending.append((rows[left], node, 0))
+          pending.append((rows[~left], node, 1))
+        if parent < 0:
+          roots.append(node)
+        else:
+          children[parent][side] = node
+    leaf_offsets = np.zeros(len(leaves) + 1, dtype=np.int64)
+    np.cumsum([len(leaf) for leaf in leaves], out=leaf_offsets[1:])
+    return cls(
+      store,
+      options,
+      normals=np.array(normals, dtype=np.float32).reshape(len(normals), store.dimensions),
+      thresholds=np.array(thresholds, dtype=np.float32),
+      children=np.array(children, dtype=np.int32).reshape(len(children), 2),
+      leaf_offsets=leaf_offsets,
+      leaf_rows=np.concatenate(leaves) if leaves else np.zeros(0, dtype=np.int32),
+      roots=np.array(roots, dtype=np.int32),
+    )
+
+  @classmethod
+  def _split(
+    cls,
+    unit: np.ndarray,
+    rows: np.ndarray,
+    leaf_size: int,
+    rng: np.random.Generator,
+  ) -> Optional[Tuple[np.ndarray, float, np.ndarray]]:
+    """normal, threshold and which rows go left, None to make them a leaf."""
+    if len(rows) <= leaf_size:
+      return None
+    first, second = rng.choice(len(rows), 2, replace=False)
+    normal = unit[rows[first]] - unit[rows[second]]
+    threshold = float(normal @ (unit[rows[first]] + unit[rows[second]])) / 2
+    projections = unit[rows] @ normal
+    left = projections < threshold
+    if not left.any() or left.all():
+      # The two were the same vector: a random direction, split at the median.
+      normal = rng.standard_normal(unit.shape[1]).astype(np.float32)
+      projections = unit[rows] @ normal
+      threshold = float(np.median(projections))
+      left = projections < threshold
+      if not left.any() or left.all():
+        # They all are.
+        return None
+    return normal, threshold, left
+
+  @property
+  def node_count(self) -> int:
+    return len(self.thresholds)
+
+  @property
+  def leaf_count(self) -> int:
+    return len(self.leaf_offsets) - 1
+
+  def default_search_k(self) -> int:
+    # About a leaf per tree.
+    return self.options.trees * self.options.leaf_size
+
+  def candidates(self, query: np.ndarray, search_k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    The rows in the leaves closest to query (a unit vector), at least search_k of them (those in mask,
+    if any) unless that's all of them. Unsorted, a row can be in there more than once.
+    """
+    # This loop is most of a query's time: plain Python lists and locals, numpy only for the dot products.
+    if self.child_lists is None or self.threshold_list is None:
+      self.child_lists = self.children.tolist()
+      self.threshold_list = self.thresholds.tolist()
+    children = self.child_lists
+    thresholds = self.threshold_list
+    normals = self.normals
+    leaf_offsets = self.leaf_offsets
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    # Nodes by how far the query is on their side of every split on the way there (the least of those),
+    # negated so the closest comes out first.
+    heap: List[Tuple[float, int]] = [(-np.inf, root) for root in self.roots.tolist()]
+    found: List[np.ndarray] = []
+    count = 0
+    while heap and count < search_k:
+      negated, node = heappop(heap)
+      if node < 0:
+        leaf = ~node
+        rows = self.leaf_rows[leaf_offsets[leaf]:leaf_offsets[leaf + 1]]
+        found.append(rows)
+        count += len(rows) if mask is None else int(np.count_nonzero(mask[rows]))
+        continue
+      margin = normals[node].dot(query).item() - thresholds[node]
+      left, right = children[node]
+      heappush(heap, (negated if negated > margin else margin, left))
+      heappush(heap, (negated if negated > -margin else -margin, right))
+    return np.concatenate(found) if found else np.zeros(0, dtype=np.int32)
+
+  def search(
+    self,
+    queries: np.ndarray,
+    k: int = 10,
+    search_k: Optional[int] = None,
+    exclude_rows: Optional[np.ndarray] = None,
+    mask: Optional[np.ndarray] = None,
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """Like EmbeddingStore.top_k, but only scoring the candidates (see candidates)."""
+    search_k = max(k, search_k or self.default_search_k())
+    queries = normalize_rows(queries)
+    scales = self.store.scales()
+    found_rows = np.full((len(queries), k), -1, dtype=np.int64)
+    found_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    for index, query in enumerate(queries):
+      rows = np.unique(self.candidates(query, search_k, mask))
+      if mask is not None:
+        rows = rows[mask[rows]]
+      if exclude_rows is not None:
+        rows = rows[rows != exclude_rows[index]]
+      scores = (self.store.vectors[rows] @ query) * scales[rows]
+      if len(rows) > k:
+        kept = np.argpartition(scores, -k)[-k:]
+        rows, scores = rows[kept], scores[kept]
+      order = np.argsort(-scores, kind="stable")
+      found_rows[index, :len(rows)] = rows[order]
+      found_scores[index, :len(rows)] = scores[order]
+    return found_rows, found_scores
+
+  def similar(
+    self,
+    ids: Union[Sequence[int], np.ndarray],
+    k: int = 10,
+    node_type: Optional[str] = None,
+    search_k: Optional[int] = None,
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """Like EmbeddingStore.similar (e.g. node_type="Function" for the functions like ids), approximately."""
+    store = self.store
+    rows = store.rows(ids)
+    if (rows < 0).any():
+      raise KeyError(np.asarray(ids)[rows < 0].tolist())
+    found, scores = self.search(store.vectors[rows], k=k, search_k=search_k, exclude_rows=rows, mask=store.node_type_mask(node_type))
+    return np.where(found >= 0, store.ids[found], -1), scores
+
+  def write(self, path: str) -> None:
+    """Writes the trees (not the store, see open) to path, replacing it at once."""
+    write_section_file(
+      path,
+      self.MAGIC,
+      self.VERSION,
+      [(name, getattr(self, name)) for name in self.SECTIONS],
+      options=self.options.model_dump(mode="json"),
+      rows=len(self.store),
+      dimensions=self.store.dimensions,
+    )
+
+  @classmethod
+  def open(cls, path: str, store: EmbeddingStore) -> "ProjectionForest":
+    """The forest at path, over store (the one it was built from)."""
+    map, sections, directory = read_section_file(path, cls.MAGIC, cls.VERSION, "a projection forest")
+    if directory["rows"] != len(store) or directory["dimensions"] != store.dimensions:
+      raise ValueError(f"{path} was built over {directory['rows']} rows of {directory['dimensions']}, not {store.path}.")
+    ret = cls(store, ForestOptions.model_validate(directory["options"]), **sections)
+    ret.map = map
+    return ret
+
+  def nbytes(self) -> int:
+    return sum(getattr(self, name).nbytes for name in self.SECTIONS)
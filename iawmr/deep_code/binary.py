@@ -0,0 +1,379 @@
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+
+import iawmr.deep_code.library as library
+import iawmr.deep_code.model as model
+import iawmr.deep_code.project as project
+from iawmr.deep_code.compact import CompactProject, StringPool
+
+
+NO_SCOPE = -1
+
+
+class BinaryFormat:
+  """
+  A whole parsed project in one file, laid out like a CompactProject so it can be read through mmap
+  without deserializing it:
+
+    header | section | section | ... | directory (json: section name -> offset, typecode, length)
+
+  The sections are the CompactProject columns as they are, plus:
+
+    strings:      string_offsets, string_data (utf-8)
+    scopes:       scope_start (per module) -> scope_names, scope_parents (in the module), alias_start -> alias_names, alias_targets
+    path tables:  path_start (per module) -> path_parents, path_segments (string ids)
+    side tables:  function_nodes, function_type_ids (sorted by node), module_relative_paths
+    unresolved:   unresolved_references (string ids)
+
+  Every section starts 8 byte aligned, and the numbers are in the writer's byte order (checked on open).
+  """
+  MAGIC = b"IAWMRBIN"
+  # Bump this whenever a section changes shape.
+  VERSION = 3
+  # magic, version, little endian?, directory offset, directory length
+  HEADER = struct.Struct("<8sIIQQ")
+  SUFFIX = ".iawmr"
+
+  COLUMNS = [
+    "node_types",
+    "ast_types",
+    "parents",
+    "subtree_end",
+    "scope_ids",
+    "fully_qualified_names",
+    "names",
+    "path_ids",
+    "field_start",
+    "reference_start",
+    "field_names",
+    "field_is_list",
+    "group_start",
+    "group_first_child",
+    "group_size",
+    "reference_local_names",
+    "reference_fully_qualified_names",
+    "reference_types",
+    "reference_targets",
+    "reference_external_targets",
+    "reference_resolutions",
+    "module_roots",
+  ]
+
+  @classmethod
+  def write(cls, source: Union[project.Project, CompactProject], path: str) -> None:
+    """Writes the project (resolved references included) to path, replacing it at once."""
+    store = CompactProject.from_project(source) if isinstance(source, project.Project) else source
+    sections = cls.sections(store)
+    directory: Dict[str, Tuple[int, str, int]] = {}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+      with open(tmp_path, "wb") as f:
+        f.write(b"\0" * cls.HEADER.size)
+        for name, column in sections:
+          f.write(b"\0" * (-f.tell() % 8))
+          directory[name] = (f.tell(), column.typecode, len(column))
+          column.tofile(f)
+        directory_bytes = json.dumps(dict(
+          sections=directory,
+          has_unresolved_references=store.unresolved_references is not None,
+        )).encode()
+        directory_offset = f.tell()
+        f.write(directory_bytes)
+        f.seek(0)
+        f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, sys.byteorder == "little", directory_offset, len(directory_bytes)))
+      os.replace(tmp_path, path)
+    except BaseException:
+      # Half a file (disk full, interrupted...) is no use to anybody.
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+  @classmethod
+  def sections(cls, store: CompactProject) -> List[Tuple[str, array]]:
+    strings = store.strings
+    ret = [(name, getattr(store, name)) for name in cls.COLUMNS]
+
+    # Each module's scope table, the parents are ids in the same table (like the json).
+    scope_names = array("i")
+    scope_parents = array("i")
+    alias_start = array("i", [0])
+    alias_names = array("i")
+    alias_targets = array("i")
+    for scope in store.scopes:
+      scope_names.append(strings.intern(scope.name))
+      scope_parents.append(NO_SCOPE if scope.parent is None else scope.parent.id)
+      for local_name, fully_qualified_name in scope.aliases.items():
+        alias_names.append(strings.intern(local_name))
+        alias_targets.append(strings.intern(fully_qualified_name))
+      alias_start.append(len(alias_names))
+    ret.extend([
+      ("scope_start", store.scope_start),
+      ("scope_names", scope_names),
+      ("scope_parents", scope_parents),
+      ("alias_start", alias_start),
+      ("alias_names", alias_names),
+      ("alias_targets", alias_targets),
+    ])
+
+    path_start = array("i", [0])
+    path_parents = array("i")
+    path_segments = array("i")
+    for paths in store.path_tables:
+      segment_ids = [strings.intern(name) for name in paths.segment_names]
+      path_parents.extend(paths.parents)
+      path_segments.extend(segment_ids[segment] for segment in paths.segments)
+      path_start.append(len(path_parents))
+    ret.extend([
+      ("path_start", path_start),
+      ("path_parents", path_parents),
+      ("path_segments", path_segments),
+    ])
+
+    function_nodes = array("i", sorted(store.function_types))
+    ret.extend([
+      ("function_nodes", function_nodes),
+      ("function_type_ids", array("i", (strings.intern(store.function_types[node]) for node in function_nodes))),
+      ("module_relative_paths", array("i", (strings.intern(store.relative_paths.get(root)) for root in store.module_roots))),
+      ("unresolved_references", array("i", (strings.intern(name) for name in sorted(store.unresolved_references or ())))),
+    ])
+
+    # Last, everything above interns.
+    encoded = [value.encode("utf-8", "surrogatepass") for value in strings.strings]
+    string_offsets = array("q", [0])
+    total = 0
+    for value in encoded:
+      total += len(value)
+      string_offsets.append(total)
+    ret.extend([
+      ("string_offsets", string_offsets),
+      ("string_data", array("B", b"".join(encoded))),
+    ])
+    return ret
+
+  @classmethod
+  def open(cls, path: str, libraries: Optional[library.Libraries] = None) -> "MappedProject":
+    return MappedProject(path, libraries=libraries)
+
+  @classmethod
+  def load_modules(cls, path: str) -> Dict[str, model.Module]:
+    store = cls.open(path)
+    return {module.fully_qualified_name: module for module in store.to_modules()}
+
+  @classmethod
+  def load_module(cls, path: str, module_path: str) -> model.Module:
+    """Only builds the one module (its references into other modules come back unresolved)."""
+    store = cls.open(path)
+    return store.to_modules([store.find_module(module_path)])[0]
+
+
+class MappedStrings(Sequence[str]):
+  """The string pool section, decoded one string at a time (and kept) as they get read."""
+  offsets: memoryview
+  data: memoryview
+  decoded: Dict[int, str]
+  # Interned after loading
+  added: List[str]
+
+  def __init__(self, offsets: memoryview, data: memoryview):
+    self.offsets = offsets
+    self.data = data
+    self.decoded = {}
+    self.added = []
+
+  def __len__(self) -> int:
+    return len(self.offsets) - 1 + len(self.added)
+
+  def __getitem__(self, index):
+    value = self.decoded.get(index)
+    if value is not None:
+      return value
+    count = len(self.offsets) - 1
+    if index >= count:
+      return self.added[index - count]
+    value = self.decoded[index] = str(self.data[self.offsets[index]:self.offsets[index + 1]], "utf-8", "surrogatepass")
+    return value
+
+  def __iter__(self) -> Iterator[str]:
+    for index in range(len(self)):
+      yield self[index]
+
+  def append(self, value: str) -> None:
+    self.added.append(value)
+
+
+class MappedStringPool(StringPool):
+  """Reads from the file; the lookup for intern() is only built the first time something gets interned."""
+  ids: Optional[Dict[str, int]]  # type: ignore[assignment]
+
+  def __init__(self, strings: MappedStrings):
+    self.strings = strings  # type: ignore[assignment]
+    self.ids = None
+
+  def intern(self, value: Optional[str]) -> int:
+    if self.ids is None:
+      self.ids = {string: index for index, string in enumerate(self.strings)}
+    return super().intern(value)
+
+
+class MappedScopes(Sequence[model.Scope]):
+  """Builds the model.Scopes (and their parents) as they get asked for."""
+  store: "MappedProject"
+  loaded: Dict[int, model.Scope]
+
+  def __init__(self, store: "MappedProject"):
+    self.store = store
+    self.loaded = {}
+
+  def __len__(self) -> int:
+    return len(self.store.scope_names)
+
+  def __getitem__(self, index):
+    scope = self.loaded.get(index)
+    if scope is not None:
+      return scope
+    store = self.store
+    strings = store.strings.strings
+    first = store.scope_start[bisect.bisect_right(store.scope_start, index) - 1]
+    parent = store.scope_parents[index]
+    aliases = {
+      strings[store.alias_names[alias]]: strings[store.alias_targets[alias]]
+      for alias in range(store.alias_start[index], store.alias_start[index + 1])
+    }
+    scope = self.loaded[index] = model.Scope(
+      id=index - first,
+      name=strings[store.scope_names[index]],
+      parent=None if parent == NO_SCOPE else self[first + parent],
+      aliases=aliases,
+    )
+    return scope
+
+
+class MappedPathTables(Sequence[model.PathTable]):
+  """One model.PathTable per module, copied out of the file the first time it is asked for."""
+  store: "MappedProject"
+  loaded: Dict[int, model.PathTable]
+
+  def __init__(self, store: "MappedProject"):
+    self.store = store
+    self.loaded = {}
+
+  def __len__(self) -> int:
+    return len(self.store.module_roots)
+
+  def __getitem__(self, module):
+    paths = self.loaded.get(module)
+    if paths is not None:
+      return paths
+    store = self.store
+    start = store.path_start[module]
+    end = store.path_start[module + 1]
+    strings = store.strings.strings
+    segment_ids: Dict[int, int] = {}
+    segment_names: List[str] = []
+    segments = array("i")
+    for string_id in store.path_segments[start:end]:
+      segment = segment_ids.get(string_id)
+      if segment is None:
+        segment = segment_ids[string_id] = len(segment_names)
+        segment_names.append(strings[string_id])
+      segments.append(segment)
+    paths = self.loaded[module] = model.PathTable.from_columns(
+      parents=array("i", store.path_parents[start:end]),
+      segments=segments,
+      segment_names=segment_names,
+    )
+    return paths
+
+
+class MappedFunctionTypes:
+  """CompactProject.function_types (node -> function type), looked up in the sorted side table."""
+  store: "MappedProject"
+
+  def __init__(self, store: "MappedProject"):
+    self.store = store
+
+  def get(self, index: int) -> Optional[str]:
+    nodes = self.store.function_nodes
+    position = bisect.bisect_left(nodes, index)
+    if position == len(nodes) or nodes[position] != index:
+      return None
+    return self.store.strings.strings[self.store.function_type_ids[position]]
+
+
+class MappedRelativePaths:
+  """CompactProject.relative_paths (module root -> relative path)."""
+  store: "MappedProject"
+
+  def __init__(self, store: "MappedProject"):
+    self.store = store
+
+  def get(self, index: int) -> Optional[str]:
+    module = self.store.module_index(index)
+    if module < 0 or self.store.module_roots[module] != index:
+      return None
+    return self.store.strings.get(self.store.module_relative_paths[module])
+
+
+class MappedProject(CompactProject):
+  """
+  A CompactProject whose columns are views straight into a BinaryFormat file. Nothing is read until
+  it is used, and only what is used. The mapping is copy on write: resolve_references can update
+  the references, the file never changes. Adding modules isn't supported.
+  """
+  path: str
+  map: mmap.mmap
+  scope_names: memoryview
+  scope_parents: memoryview
+  alias_start: memoryview
+  alias_names: memoryview
+  alias_targets: memoryview
+  path_start: memoryview
+  path_parents: memoryview
+  path_segments: memoryview
+  function_nodes: memoryview
+  function_type_ids: memoryview
+  module_relative_paths: memoryview
+
+  def __init__(self, path: str, libraries: Optional[library.Libraries] = None):
+    super().__init__(libraries=libraries)
+    self.path = path
+    with open(path, "rb") as f:
+      self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, little_endian, directory_offset, directory_length = BinaryFormat.HEADER.unpack_from(self.map, 0)
+    if magic != BinaryFormat.MAGIC:
+      raise ValueError(f"{path} is not a parsed project.")
+    if version != BinaryFormat.VERSION:
+      raise ValueError(f"{path} has format version {version}, expected {BinaryFormat.VERSION}.")
+    if bool(little_endian) != (sys.byteorder == "little"):
+      raise ValueError(f"{path} was written on a machine with the other byte order.")
+    directory = json.loads(self.map[directory_offset:directory_offset + directory_length])
+    view = memoryview(self.map)
+    columns: Dict[str, memoryview] = {}
+    for name, (offset, typecode, length) in directory["sections"].items():
+      itemsize = array(typecode).itemsize
+      columns[name] = view[offset:offset + length * itemsize].cast(typecode)
+    for name, column in columns.items():
+      if name not in ("string_offsets", "string_data", "unresolved_references"):
+        setattr(self, name, column)
+    self.strings = MappedStringPool(MappedStrings(offsets=columns["string_offsets"], data=columns["string_data"]))
+    self.scopes = MappedScopes(self)  # type: ignore[assignment]
+    self.path_tables = MappedPathTables(self)  # type: ignore[assignment]
+    self.function_types = MappedFunctionTypes(self)  # type: ignore[assignment]
+    self.relative_paths = MappedRelativePaths(self)  # type: ignore[assignment]
+    if directory["has_unresolved_references"]:
+      self.unresolved_references = {self.strings.strings[name] for name in columns["unresolved_references"]}
+
+  def add_module(self, module, indexes=None, targets=None) -> int:
+    raise TypeError("A mapped project can't be added to, parse into a CompactProject instead.")
+
+  def find_module(self, module_path: str) -> int:
+    for module, root in enumerate(self.module_roots):
+      if self.strings.get(self.fully_qualified_names[root]) == module_path:
+        return module
+    raise KeyError(module_path)
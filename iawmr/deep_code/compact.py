@@ -0,0 +1,582 @@
+from array import array
+import bisect
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import iawmr.deep_code.library as library
+import iawmr.deep_code.model as model
+import iawmr.deep_code.project as project
+from iawmr.deep_code.queries import CallGraph
+from iawmr.deep_code.reports import ReportSink, ResolutionStats
+from iawmr.deep_code.scheduling import ImportGraph
+from iawmr.deep_code.symbols import SymbolIndex
+
+
+# Row values of CompactProject.node_types
+NODE_TYPES: List[str] = [node_type.value for node_type in model.AstNodeType]
+NODE_TYPE_IDS: Dict[str, int] = {node_type: index for index, node_type in enumerate(NODE_TYPES)}
+# What the parser builds for each node type (see to_modules)
+NODE_CLASSES: Dict[str, type] = {
+  model.AstNodeType.Module.value: model.Module,
+  model.AstNodeType.Class.value: model.Class,
+  model.AstNodeType.Function.value: model.Function,
+  model.AstNodeType.Statement.value: model.Statement,
+  model.AstNodeType.Expression.value: model.Expression,
+  model.AstNodeType.Unknown.value: model.AstNode,
+  model.AstNodeType.Variable.value: model.Variable,
+}
+
+# Row values of CompactProject.reference_resolutions
+RESOLUTION_KINDS: List[str] = [resolution.value for resolution in model.ResolutionKind]
+RESOLUTION_KIND_IDS: Dict[str, int] = {resolution: index for index, resolution in enumerate(RESOLUTION_KINDS)}
+
+NO_STRING = -1
+NO_NODE = -1
+NO_RESOLUTION = -1
+
+
+class StringPool:
+  """Every distinct string once, referred to by index."""
+  strings: List[str]
+  ids: Dict[str, int]
+
+  def __init__(self):
+    self.strings = []
+    self.ids = {}
+
+  def intern(self, value: Optional[str]) -> int:
+    if value is None:
+      return NO_STRING
+    id = self.ids.get(value)
+    if id is None:
+      id = self.ids[value] = len(self.strings)
+      self.strings.append(value)
+    return id
+
+  def get(self, id: int) -> Optional[str]:
+    return None if id == NO_STRING else self.strings[id]
+
+  def __len__(self) -> int:
+    return len(self.strings)
+
+
+class CompactProject:
+  """
+  The parsed nodes of a project as columns instead of one pydantic object (plus children, references...) each.
+
+  Nodes are numbered in the order all_nodes() visits them (pre-order), so a node's subtree is
+  [index, subtree_end[index]). Fields and groups are the NodeChildren of each node:
+
+    node --field_start--> fields (name, is_list) --group_start--> groups (first_child, size)
+
+  a value field has exactly one group, a list field one group per list (they can be empty).
+  References are a side table too, node --reference_start--> references.
+
+  Use NodeView (project.modules(), all_nodes()...) to read it like the model.
+  """
+  strings: StringPool
+  # Nodes
+  node_types: array
+  ast_types: array
+  parents: array
+  subtree_end: array
+  scope_ids: array
+  fully_qualified_names: array
+  names: array
+  # In the node's module's PathTable
+  path_ids: array
+  field_start: array
+  reference_start: array
+  # Fields
+  field_names: array
+  field_is_list: array
+  group_start: array
+  # Groups
+  group_first_child: array
+  group_size: array
+  # References
+  reference_local_names: array
+  reference_fully_qualified_names: array
+  reference_types: array
+  reference_targets: array
+  reference_external_targets: array
+  reference_resolutions: array
+  # Side tables for the few nodes that need them
+  # Every module's scope table (model.Module.scopes), one after the other
+  scopes: List[model.Scope]
+  # Per module, where its scopes start
+  scope_start: array
+  function_types: Dict[int, str]
+  relative_paths: Dict[int, str]
+  module_roots: array
+  path_tables: List[model.PathTable]
+  unresolved_references: Optional[Set[str]]
+  libraries: Optional[library.Libraries]
+  # Built by every resolve_references
+  symbols: Optional[SymbolIndex]
+  # From the last resolve_references
+  stats: Optional[ResolutionStats]
+  # See call_graph
+  calls: Optional[CallGraph]
+
+  def __init__(self, libraries: Optional[library.Libraries] = None):
+    self.strings = StringPool()
+    self.node_types = array("b")
+    self.ast_types = array("i")
+    self.parents = array("i")
+    self.subtree_end = array("i")
+    self.scope_ids = array("i")
+    self.fully_qualified_names = array("i")
+    self.names = array("i")
+    self.path_ids = array("i")
+    self.field_start = array("i", [0])
+    self.reference_start = array("i", [0])
+    self.field_names = array("i")
+    self.field_is_list = array("b")
+    self.group_start = array("i", [0])
+    self.group_first_child = array("i")
+    self.group_size = array("i")
+    self.reference_local_names = array("i")
+    self.reference_fully_qualified_names = array("i")
+    self.reference_types = array("i")
+    self.reference_targets = array("i")
+    self.reference_external_targets = array("i")
+    self.reference_resolutions = array("b")
+    self.scopes = []
+    self.scope_start = array("i", [0])
+    self.function_types = {}
+    self.relative_paths = {}
+    self.module_roots = array("i")
+    self.path_tables = []
+    self.unresolved_references = None
+    self.libraries = libraries
+    self.symbols = None
+    self.stats = None
+    self.calls = None
+
+  @classmethod
+  def from_project(cls, source: project.Project) -> "CompactProject":
+    ret = cls(libraries=source.libraries)
+    indexes: Dict[int, int] = {}
+    targets: List[Tuple[int, model.AstNode]] = []
+    for module in source.modules():
+      ret.add_module(module, indexes=indexes, targets=targets)
+    for reference, target in targets:
+      ret.reference_targets[reference] = indexes[id(target)]
+    ret.unresolved_references = source.unresolved_references
+    return ret
+
+  @classmethod
+  def from_modules(cls, modules: Iterable[model.Module], libraries: Optional[library.Libraries] = None) -> "CompactProject":
+    """Lets the modules go as soon as they are added, so the whole model never has to fit in memory."""
+    ret = cls(libraries=libraries)
+    for module in modules:
+      ret.add_module(module)
+    return ret
+
+  def add_module(
+    self,
+    module: model.Module,
+    indexes: Optional[Dict[int, int]] = None,
+    targets: Optional[List[Tuple[int, model.AstNode]]] = None,
+  ) -> int:
+    """
+    Appends the module's nodes. References that are already resolved are kept when indexes/targets
+    are given (targets get filled in with (reference, target node) for the caller to patch once every
+    module is in); otherwise they are dropped and need resolve_references again.
+    """
+    # A node's scope is in its module's table, at the scope's id.
+    first_scope = len(self.scopes)
+    root = len(self.node_types)
+    self.module_roots.append(root)
+    self.path_tables.append(module.path.table)
+    # (node, parent, parent scope, group), or (None, index to close, ...)
+    stack: List[Tuple[Optional[model.AstNode], int, Optional[model.Scope], int]] = [(module, NO_NODE, None, -1)]
+    while stack:
+      node, parent, parent_scope, group = stack.pop()
+      if node is None:
+        self.subtree_end[parent] = len(self.node_types)
+        continue
+      node.expand()
+      index = len(self.node_types)
+      if indexes is not None:
+        indexes[id(node)] = index
+      if group >= 0 and self.group_first_child[group] == NO_NODE:
+        self.group_first_child[group] = index
+      scope = node.get_scope(parent_scope)
+      assert scope
+      scope_id = first_scope + scope.id
+
+      self.node_types.append(NODE_TYPE_IDS[str(node.node_type)])
+      self.ast_types.append(self.strings.intern(node.ast_type))
+      self.parents.append(parent)
+      self.subtree_end.append(index + 1)
+      self.scope_ids.append(scope_id)
+      self.fully_qualified_names.append(self.strings.intern(node.get_fully_qualified_name()))
+      self.names.append(self.strings.intern(getattr(node, "name", None)))
+      self.path_ids.append(node.path.id)
+      if isinstance(node, model.Function):
+        self.function_types[index] = str(node.function_type)
+      elif isinstance(node, model.Module):
+        self.relative_paths[index] = node.relative_path
+
+      for reference in node.references:
+        if targets is not None and reference.target is not None:
+          targets.append((len(self.reference_targets), reference.target))
+        self.reference_local_names.append(self.strings.intern(reference.local_name))
+        self.reference_fully_qualified_names.append(self.strings.intern(reference.fully_qualified_name))
+        self.reference_types.append(self.strings.intern(reference.reference_type))
+        self.reference_targets.append(NO_NODE)
+        self.reference_external_targets.append(self.strings.intern(reference.external_target))
+        # Without the target, how it was found doesn't mean anything anymore.
+        resolution = reference.resolution if targets is not None or reference.target is None else None
+        self.reference_resolutions.append(NO_RESOLUTION if resolution is None else RESOLUTION_KIND_IDS[resolution])
+      self.reference_start.append(len(self.reference_targets))
+
+      # Same order as NodeChildren.all_nodes: value fields, then list fields.
+      children: List[Tuple[model.AstNode, int]] = []
+      for field_name, values in node.children.value_fields.items():
+        children.extend((child, len(self.group_size)) for child in values)
+        self.add_field(field_name=field_name, is_list=False, sizes=[len(values)])
+      for field_name, groups in node.children.list_fields.items():
+        first_group = len(self.group_size)
+        for offset, values in enumerate(groups):
+          children.extend((child, first_group + offset) for child in values)
+        self.add_field(field_name=field_name, is_list=True, sizes=[len(values) for values in groups])
+      self.field_start.append(len(self.field_names))
+
+      stack.append((None, index, None, -1))
+      for child, child_group in reversed(children):
+        stack.append((child, index, scope, child_group))
+    # Only now, expanding the bodies adds scopes.
+    self.scopes.extend(module.scopes)
+    self.scope_start.append(len(self.scopes))
+    return root
+
+  def add_field(self, field_name: str, is_list: bool, sizes: List[int]) -> None:
+    self.field_names.append(self.strings.intern(field_name))
+    self.field_is_list.append(1 if is_list else 0)
+    for size in sizes:
+      self.group_first_child.append(NO_NODE)
+      self.group_size.append(size)
+    self.group_start.append(len(self.group_size))
+
+  def __len__(self) -> int:
+    return len(self.node_types)
+
+  def node(self, index: int) -> "NodeView":
+    return NodeView(self, index)
+
+  def modules(self) -> Iterator["NodeView"]:
+    for root in self.module_roots:
+      yield NodeView(self, root)
+
+  def module_index(self, index: int) -> int:
+    return bisect.bisect_right(self.module_roots, index) - 1
+
+  def all_nodes(self) -> Iterator[Tuple["NodeView", model.Scope]]:
+    for index in range(len(self.node_types)):
+      yield NodeView(self, index), self.scopes[self.scope_ids[index]]
+
+  def children(self, index: int) -> Iterator[int]:
+    child = index + 1
+    end = self.subtree_end[index]
+    while child < end:
+      yield child
+      child = self.subtree_end[child]
+
+  def group_children(self, group: int) -> List[int]:
+    children = []
+    child = self.group_first_child[group]
+    for _ in range(self.group_size[group]):
+      children.append(child)
+      child = self.subtree_end[child]
+    return children
+
+  def resolve_references(self, include_bodies: bool = True, report: Optional[ReportSink] = None) -> None:
+    # Everything is already expanded.
+    modules = list(self.modules())
+    # Like project.Project.resolve_references: modules may have been added since the last time.
+    self.symbols = SymbolIndex.build(modules, include_bodies=include_bodies)
+    self.stats = ResolutionStats()
+    self.calls = None
+    self.unresolved_references = project.resolve_references(
+      modules=modules,
+      libraries=self.libraries,
+      include_bodies=include_bodies,
+      symbols=self.symbols,
+      report=report,
+      stats=self.stats,
+      import_graph=ImportGraph(modules),
+    )
+
+  def call_graph(self) -> CallGraph:
+    """See project.Project.call_graph."""
+    if self.calls is None:
+      self.calls = CallGraph.build(self.modules())
+    return self.calls
+
+  def nbytes(self) -> int:
+    """Roughly, the columns only (not the strings, path tables or scopes)."""
+    return sum(
+      column.itemsize * len(column)
+      for column in vars(self).values()
+      if isinstance(column, (array, memoryview))
+    )
+
+  def to_modules(self, modules: Optional[Iterable[int]] = None) -> List[model.Module]:
+    """
+    Builds the model back, for the given module indexes (all of them by default). References whose
+    target is in a module that isn't built come back unresolved (target and resolution None).
+    """
+    nodes: Dict[int, model.AstNode] = {}
+    targets: List[Tuple[model.CodeReference, int]] = []
+    ret = [
+      self._to_module(module, nodes=nodes, targets=targets)
+      for module in (range(len(self.module_roots)) if modules is None else modules)
+    ]
+    for reference, target in targets:
+      reference.target = nodes.get(target)
+      if reference.target is None and reference.external_target is None:
+        reference.resolution = None
+    return ret
+
+  def _to_module(self, module: int, nodes: Dict[int, model.AstNode], targets: List[Tuple[model.CodeReference, int]]) -> model.Module:
+    strings = self.strings
+    root = self.module_roots[module]
+    end = self.subtree_end[root]
+    paths = self.path_tables[module]
+    for index in range(root, end):
+      node_type = NODE_TYPES[self.node_types[index]]
+      fields = dict(
+        node_type=node_type,
+        path=model.NodePath(paths, self.path_ids[index]),
+        ast_type=strings.strings[self.ast_types[index]],
+        children=model.NodeChildren.construct_trusted(value_fields={}, list_fields={}, single_valued=False),
+        references=self._to_references(index, targets=targets),
+      )
+      if node_type == model.AstNodeType.Module.value:
+        fields.update(
+          relative_path=self.relative_paths.get(index),
+          fully_qualified_name=strings.get(self.fully_qualified_names[index]),
+          scopes=[self.scopes[scope] for scope in range(self.scope_start[module], self.scope_start[module + 1])],
+        )
+      elif node_type == model.AstNodeType.Class.value:
+        fields.update(name=strings.get(self.names[index]), fully_qualified_name=strings.get(self.fully_qualified_names[index]))
+      elif node_type == model.AstNodeType.Function.value:
+        fields.update(
+          name=strings.get(self.names[index]),
+          function_type=self.function_types.get(index),
+          fully_qualified_name=strings.get(self.fully_qualified_names[index]),
+          deferred_body=None,
+        )
+      elif node_type == model.AstNodeType.Variable.value:
+        fields.update(name=strings.get(self.names[index]))
+      node_class = NODE_CLASSES[node_type]
+      if issubclass(node_class, model.ScopedNode):
+        fields.update(scope=self.scopes[self.scope_ids[index]])
+      nodes[index] = node_class.construct_trusted(**fields)
+
+    for index in range(root, end):
+      children = nodes[index].children
+      for field in range(self.field_start[index], self.field_start[index + 1]):
+        groups = [
+          [nodes[child] for child in self.group_children(group)]
+          for group in range(self.group_start[field], self.group_start[field + 1])
+        ]
+        if self.field_is_list[field]:
+          children.list_fields[strings.strings[self.field_names[field]]] = groups
+        else:
+          children.value_fields[strings.strings[self.field_names[field]]] = groups[0]
+    ret = nodes[root]
+    assert isinstance(ret, model.Module)
+    return ret
+
+  def _to_references(self, index: int, targets: List[Tuple[model.CodeReference, int]]) -> List[model.CodeReference]:
+    start = self.reference_start[index]
+    end = self.reference_start[index + 1]
+    if start == end:
+      return model.NO_REFERENCES
+    strings = self.strings
+    references = []
+    for reference in range(start, end):
+      ret = model.CodeReference.construct_trusted(
+        local_name=strings.strings[self.reference_local_names[reference]],
+        fully_qualified_name=strings.strings[self.reference_fully_qualified_names[reference]],
+        target=None,
+        external_target=strings.get(self.reference_external_targets[reference]),
+        reference_type=strings.strings[self.reference_types[reference]],
+        resolution=None if self.reference_resolutions[reference] == NO_RESOLUTION else RESOLUTION_KINDS[self.reference_resolutions[reference]],
+      )
+      if self.reference_targets[reference] != NO_NODE:
+        targets.append((ret, self.reference_targets[reference]))
+      references.append(ret)
+    return references
+
+
+class ReferenceView:
+  __slots__ = ("store", "index")
+
+  store: CompactProject
+  index: int
+
+  def __init__(self, store: CompactProject, index: int):
+    self.store = store
+    self.index = index
+
+  @property
+  def local_name(self) -> str:
+    return self.store.strings.strings[self.store.reference_local_names[self.index]]
+
+  @property
+  def fully_qualified_name(self) -> str:
+    return self.store.strings.strings[self.store.reference_fully_qualified_names[self.index]]
+
+  @property
+  def reference_type(self) -> str:
+    return self.store.strings.strings[self.store.reference_types[self.index]]
+
+  @property
+  def target(self) -> Optional["NodeView"]:
+    target = self.store.reference_targets[self.index]
+    return None if target == NO_NODE else NodeView(self.store, target)
+
+  @target.setter
+  def target(self, target: Optional["NodeView"]) -> None:
+    self.store.reference_targets[self.index] = NO_NODE if target is None else target.index
+
+  @property
+  def external_target(self) -> Optional[str]:
+    return self.store.strings.get(self.store.reference_external_targets[self.index])
+
+  @external_target.setter
+  def external_target(self, external_target: Optional[str]) -> None:
+    self.store.reference_external_targets[self.index] = self.store.strings.intern(external_target)
+
+  @property
+  def resolution(self) -> Optional[str]:
+    resolution = self.store.reference_resolutions[self.index]
+    return None if resolution == NO_RESOLUTION else RESOLUTION_KINDS[resolution]
+
+  @resolution.setter
+  def resolution(self, resolution: Optional[str]) -> None:
+    self.store.reference_resolutions[self.index] = NO_RESOLUTION if resolution is None else RESOLUTION_KIND_IDS[resolution]
+
+
+class ChildrenView:
+  """NodeChildren, read only."""
+  __slots__ = ("store", "index")
+
+  store: CompactProject
+  index: int
+
+  def __init__(self, store: CompactProject, index: int):
+    self.store = store
+    self.index = index
+
+  def _fields(self, is_list: bool) -> Iterator[Tuple[str, List[List["NodeView"]]]]:
+    store = self.store
+    for field in range(store.field_start[self.index], store.field_start[self.index + 1]):
+      if store.field_is_list[field] != is_list:
+        continue
+      groups = [
+        [NodeView(store, child) for child in store.group_children(group)]
+        for group in range(store.group_start[field], store.group_start[field + 1])
+      ]
+      yield store.strings.strings[store.field_names[field]], groups
+
+  @property
+  def value_fields(self) -> Dict[str, List["NodeView"]]:
+    return {name: groups[0] for name, groups in self._fields(is_list=False)}
+
+  @property
+  def list_fields(self) -> Dict[str, List[List["NodeView"]]]:
+    return dict(self._fields(is_list=True))
+
+
+class NodeView:
+  """Reads like a model.AstNode, for code that only walks the tree (resolve_references, network...)."""
+  __slots__ = ("store", "index")
+
+  store: CompactProject
+  index: int
+
+  def __init__(self, store: CompactProject, index: int):
+    self.store = store
+    self.index = index
+
+  def __eq__(self, other: object) -> bool:
+    return isinstance(other, NodeView) and other.store is self.store and other.index == self.index
+
+  def __hash__(self) -> int:
+    return hash(self.index)
+
+  @property
+  def node_type(self) -> str:
+    return NODE_TYPES[self.store.node_types[self.index]]
+
+  @property
+  def ast_type(self) -> str:
+    return self.store.strings.strings[self.store.ast_types[self.index]]
+
+  @property
+  def path(self) -> model.NodePath:
+    return model.NodePath(self.store.path_tables[self.store.module_index(self.index)], self.store.path_ids[self.index])
+
+  @property
+  def project_unique_path(self) -> str:
+    return str(self.path)
+
+  @property
+  def name(self) -> Optional[str]:
+    return self.store.strings.get(self.store.names[self.index])
+
+  @property
+  def function_type(self) -> Optional[str]:
+    return self.store.function_types.get(self.index)
+
+  @property
+  def relative_path(self) -> Optional[str]:
+    return self.store.relative_paths.get(self.index)
+
+  @property
+  def scope(self) -> model.Scope:
+    return self.store.scopes[self.store.scope_ids[self.index]]
+
+  @property
+  def parent(self) -> Optional["NodeView"]:
+    parent = self.store.parents[self.index]
+    return None if parent == NO_NODE else NodeView(self.store, parent)
+
+  @property
+  def children(self) -> ChildrenView:
+    return ChildrenView(self.store, self.index)
+
+  @property
+  def references(self) -> List[ReferenceView]:
+    start = self.store.reference_start[self.index]
+    end = self.store.reference_start[self.index + 1]
+    return [ReferenceView(self.store, reference) for reference in range(start, end)]
+
+  def get_fully_qualified_name(self) -> Optional[str]:
+    return self.store.strings.get(self.store.fully_qualified_names[self.index])
+
+  def node_attributes(self) -> Dict[str, str]:
+    return dict(
+      node_type=self.node_type,
+      ast_type=self.ast_type,
+    )
+
+  def expand(self) -> None:
+    pass
+
+  def expand_all(self) -> None:
+    pass
+
+  def all_nodes(self, scope: Optional[model.Scope] = None, expand: bool = True) -> Iterator[Tuple["NodeView", model.Scope]]:
+    store = self.store
+    for index in range(self.index, store.subtree_end[self.index]):
+      yield NodeView(store, index), store.scopes[store.scope_ids[index]]
+
+  def all_children(self, expand: bool = True) -> Iterator["NodeView"]:
+    for index in range(self.index, self.store.subtree_end[self.index]):
+      yield NodeView(self.store, index)
@@ -0,0 +1,288 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+  """The rows scaled to length 1 (zero rows stay zero), as float32."""
+  vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+  norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+  return vectors / np.where(norms > 0, norms, 1)
+
+
+# The files below (EmbeddingStore, ann.ProjectionForest) are a header, numpy arrays each starting aligned,
+# and a json directory of where the arrays are (and whatever else the file needs):
+#
+#   header | section | section | ... | directory (json)
+#
+# The numbers are in the writer's byte order, checked on open.
+# magic, version, little endian?, directory offset, directory length
+SECTION_FILE_HEADER = struct.Struct("<8sIIQQ")
+SECTION_ALIGNMENT = 64
+
+
+def write_section_file(path: str, magic: bytes, version: int, sections: Sequence[Tuple[str, np.ndarray]], **metadata: Any) -> None:
+  """Writes the sections, and metadata in the directory, to path, replacing it at once."""
+  directory: Dict[str, Tuple[int, str, Tuple[int, ...]]] = {}
+  tmp_path = f"{path}.{os.getpid()}.tmp"
+  with open(tmp_path, "wb") as f:
+    f.write(b"\0" * SECTION_FILE_HEADER.size)
+    for name, column in sections:
+      f.write(b"\0" * (-f.tell() % SECTION_ALIGNMENT))
+      directory[name] = (f.tell(), column.dtype.str, column.shape)
+      f.write(np.ascontiguousarray(column).tobytes())
+    directory_bytes = json.dumps(dict(sections=directory, **metadata)).encode()
+    directory_offset = f.tell()
+    f.write(directory_bytes)
+    f.seek(0)
+    f.write(SECTION_FILE_HEADER.pack(magic, version, sys.byteorder == "little", directory_offset, len(directory_bytes)))
+  os.replace(tmp_path, path)
+
+
+def read_section_file(path: str, magic: bytes, version: int, kind: str) -> Tuple[mmap.mmap, Dict[str, np.ndarray], Dict[str, Any]]:
+  """
+  Opens path read only: the map, the sections (arrays pointing into the map) and the directory. kind is
+  what the file should be, for the errors.
+  """
+  with open(path, "rb") as f:
+    map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  found_magic, found_version, little_endian, directory_offset, directory_length = SECTION_FILE_HEADER.unpack_from(map, 0)
+  if found_magic != magic:
+    raise ValueError(f"{path} is not {kind}.")
+  if found_version != version:
+    raise ValueError(f"{path} has format version {found_version}, expected {version}.")
+  if bool(little_endian) != (sys.byteorder == "little"):
+    raise ValueError(f"{path} was written on a machine with the other byte order.")
+  directory = json.loads(map[directory_offset:directory_offset + directory_length])
+  sections = {}
+  for name, (offset, dtype, shape) in directory["sections"].items():
+    sections[name] = np.frombuffer(map, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+  return map, sections, directory
+
+
+class EmbeddingStore:
+  """
+  Node embeddings in one file, read through mmap (so opening it costs nothing, and processes that open
+  the same file share its pages):
+
+    header | ids | vectors | node_types | label_offsets | label_data | directory (json)
+
+  ids are the graph ids (see GraphIds), sorted, and vectors[row] is the embedding of ids[row], so finding
+  a node's row is a binary search. node_types (codes into node_type_names, -1 for the extra nodes) and
+  the labels are there to filter and show query results. With normalized, the vectors were scaled to
+  length 1 when written, so cosine similarity is a dot product.
+
+  The sections are laid out by write_section_file.
+  """
+  MAGIC = b"IAWMREMB"
+  VERSION = 1
+  SUFFIX = ".embeddings"
+  # Rows scored at a time by top_k, against this many queries at a time
+  BLOCK_ROWS = 65536
+  QUERY_ROWS = 256
+
+  path: str
+  map: mmap.mmap
+  ids: np.ndarray
+  vectors: np.ndarray
+  node_types: np.ndarray
+  node_type_names: List[str]
+  label_offsets: np.ndarray
+  label_data: np.ndarray
+  normalized: bool
+  # 1 / each row's length, made the first time it's needed (see scales)
+  inverse_norms: Optional[np.ndarray]
+
+  def __init__(self, path: str):
+    """Opens path read only, see write."""
+    self.path = path
+    self.map, sections, directory = read_section_file(path, self.MAGIC, self.VERSION, "an embedding store")
+    for name, section in sections.items():
+      setattr(self, name, section)
+    self.node_type_names = directory["node_type_names"]
+    self.normalized = directory["normalized"]
+    self.inverse_norms = None
+
+  @classmethod
+  def write(
+    cls,
+    path: str,
+    ids: np.ndarray,
+    vectors: np.ndarray,
+    normalize: bool = False,
+    node_types: Optional[np.ndarray] = None,
+    node_type_names: Optional[List[str]] = None,
+    labels: Optional[Sequence[str]] = None,
+  ) -> "EmbeddingStore":
+    """
+    Writes the vectors (a row per id, in any order) to path, replacing it at once. node_types and
+    labels, if any, are per id too.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    vectors = np.asarray(vectors, dtype=np.float32)[order]
+    if normalize:
+      vectors = normalize_rows(vectors)
+    if node_types is None:
+      node_types = np.full(len(ids), -1, dtype=np.int8)
+    encoded = [label.encode("utf-8", "surrogatepass") for label in labels] if labels is not None else [b""] * len(ids)
+    encoded = [encoded[row] for row in order.tolist()]
+    label_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(label) for label in encoded], out=label_offsets[1:])
+    sections = [
+      ("ids", ids[order]),
+      ("vectors", vectors),
+      ("node_types", np.asarray(node_types, dtype=np.int8)[order]),
+      ("label_offsets", label_offsets),
+      ("label_data", np.frombuffer(b"".join(encoded), dtype=np.uint8)),
+    ]
+    write_section_file(
+      path,
+      cls.MAGIC,
+      cls.VERSION,
+      sections,
+      node_type_names=list(node_type_names or []),
+      normalized=normalize,
+    )
+    return cls(path)
+
+  @classmethod
+  def open(cls, path: str) -> "EmbeddingStore":
+    return cls(path)
+
+  @property
+  def dimensions(self) -> int:
+    return self.vectors.shape[1]
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def __contains__(self, id: int) -> bool:
+    return self.rows(np.array([id]))[0] >= 0
+
+  def rows(self, ids: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+    """The row of each id, -1 for the ones that have no embedding."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(self.ids):
+      return np.full(len(ids), -1, dtype=np.int64)
+    rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+    return np.where(self.ids[rows] == ids, rows, -1)
+
+  def vector(self, id: int) -> np.ndarray:
+    row = self.rows(np.array([id]))[0]
+    if row < 0:
+      raise KeyError(id)
+    return self.vectors[row]
+
+  def label(self, row: int) -> str:
+    return bytes(self.label_data[self.label_offsets[row]:self.label_offsets[row + 1]]).decode("utf-8", "surrogatepass")
+
+  def node_type(self, row: int) -> Optional[str]:
+    code = self.node_types[row]
+    return None if code < 0 else self.node_type_names[code]
+
+  def scales(self) -> np.ndarray:
+    """What to multiply each row's dot products by to make them cosines (all 1 when normalized)."""
+    if self.inverse_norms is None:
+      if self.normalized:
+        self.inverse_norms = np.ones(len(self), dtype=np.float32)
+      else:
+        norms = np.linalg.norm(self.vectors, axis=1)
+        self.inverse_norms = (1 / np.where(norms > 0, norms, 1)).astype(np.float32)
+    return self.inverse_norms
+
+  def top_k(
+    self,
+    queries: np.ndarray,
+    k: int = 10,
+    exclude_rows: Optional[np.ndarray] = None,
+    mask: Optional[np.ndarray] = None,
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k rows most cosine similar to each query vector (a row each), best first, and their scores.
+    exclude_rows: a row per query to leave out (-1 for none), e.g. the query's own. mask: only the rows
+    where it is True. Where fewer than k rows qualify, the rest are -1 (with score -inf).
+
+    The rows are scored a block at a time (a matrix product per block), keeping the best k so far.
+    """
+    queries = normalize_rows(queries)
+    found = [
+      self._top_k(
+        queries[start:start + self.QUERY_ROWS],
+        k,
+        None if exclude_rows is None else exclude_rows[start:start + self.QUERY_ROWS],
+        mask,
+      )
+      for start in range(0, len(queries), self.QUERY_ROWS)
+    ]
+    if not found:
+      return np.zeros((0, k), dtype=np.int64), np.zeros((0, k), dtype=np.float32)
+    return np.concatenate([rows for rows, _ in found]), np.concatenate([scores for _, scores in found])
+
+  def _top_k(self, queries: np.ndarray, k: int, exclude_rows: Optional[np.ndarray], mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    count = len(queries)
+    best_rows = np.full((count, 0), -1, dtype=np.int64)
+    best_scores = np.full((count, 0), -np.inf, dtype=np.float32)
+    for start in range(0, len(self), self.BLOCK_ROWS):
+      end = min(start + self.BLOCK_ROWS, len(self))
+      scores = queries @ self.vectors[start:end].T
+      if not self.normalized:
+        scores *= self.scales()[start:end]
+      if mask is not None:
+        scores[:, ~mask[start:end]] = -np.inf
+      if exclude_rows is not None:
+        excluded = np.nonzero((exclude_rows >= start) & (exclude_rows < end))[0]
+        scores[excluded, exclude_rows[excluded] - start] = -np.inf
+      # The block's best k, then the best k of those and the ones so far.
+      rows, scores = self._best(np.broadcast_to(np.arange(start, end), scores.shape), scores, k)
+      best_rows, best_scores = self._best(
+        np.concatenate([best_rows, rows], axis=1),
+        np.concatenate([best_scores, scores], axis=1),
+        k,
+      )
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_rows[np.isneginf(best_scores)] = -1
+    if best_rows.shape[1] < k:
+      padding = k - best_rows.shape[1]
+      best_rows = np.pad(best_rows, ((0, 0), (0, padding)), constant_values=-1)
+      best_scores = np.pad(best_scores, ((0, 0), (0, padding)), constant_values=-np.inf)
+    return best_rows, best_scores
+
+  @staticmethod
+  def _best(rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if scores.shape[1] <= k:
+      return rows, scores
+    kept = np.argpartition(scores, -k, axis=1)[:, -k:]
+    return np.take_along_axis(rows, kept, axis=1), np.take_along_axis(scores, kept, axis=1)
+
+  def similar(self, ids: Union[Sequence[int], np.ndarray], k: int = 10, node_type: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """The k ids most similar to each of ids (leaving themselves out), and their scores; see top_k."""
+    rows = self.rows(ids)
+    if (rows < 0).any():
+      raise KeyError(np.asarray(ids)[rows < 0].tolist())
+    found, scores = self.top_k(self.vectors[rows], k=k, exclude_rows=rows, mask=self.node_type_mask(node_type))
+    return np.where(found >= 0, self.ids[found], -1), scores
+
+  def node_type_mask(self, node_type: Optional[str]) -> Optional[np.ndarray]:
+    """The rows of node_type (e.g. "Function"), None for all of them."""
+    if node_type is None:
+      return None
+    if node_type not in self.node_type_names:
+      return np.zeros(len(self), dtype=bool)
+    return self.node_types == self.node_type_names.index(node_type)
+
+  def nbytes(self) -> int:
+    return len(self.map)
+
+  def close(self) -> None:
+    # The arrays point into the map, drop them first.
+    for name in ("ids", "vectors", "node_types", "label_offsets", "label_data"):
+      self.__dict__.pop(name, None)
+    self.map.close()
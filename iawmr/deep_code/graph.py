@@ -0,0 +1,322 @@
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+import iawmr.deep_code.model as model
+from iawmr.deep_code.compact import CompactProject, NodeView
+from iawmr.deep_code.project import Project
+
+
+# The model, or its compact (array backed) version, they read the same.
+AnyProject = Union[Project, CompactProject]
+
+
+class GraphIds:
+  """
+  Integer ids for the graph. The nodes get theirs in the order they are added (see add), so only the
+  paths of actual nodes have one, not the paths in between (handlers[0]...). After the nodes come the
+  field groups and the unresolved/library names.
+  Nodes sharing a path (a property and its setter, if/else definitions...) each get their own id, the
+  ones after the first are found by the node itself (see duplicates) and labeled path#2, path#3...
+  The strings (paths, path::field::index...) only get made by label(), for exporting.
+  """
+  # Per module PathTable (by id()): its index in tables, and the graph id of each path id (-1 for the paths without a node)
+  by_table: Dict[int, Tuple[int, array]]
+  tables: List[model.PathTable]
+  # Per node id: which of tables, and its path id there
+  node_tables: array
+  node_paths: array
+  # The nodes whose path had an id already (by identity): their id, and which copy of the path they are.
+  # copy_counts is by the first one's id.
+  duplicates: Dict[Any, int]
+  copies: Dict[int, int]
+  copy_counts: Dict[int, int]
+  # Per extra id (groups and externals): the id its label extends (or -1) and the rest of the label
+  extra_owners: array
+  extra_labels: List[str]
+  externals: Dict[str, int]
+
+  def __init__(self):
+    self.by_table = {}
+    self.tables = []
+    self.node_tables = array("i")
+    self.node_paths = array("i")
+    self.duplicates = {}
+    self.copies = {}
+    self.copy_counts = {}
+    self.extra_owners = array("i")
+    self.extra_labels = []
+    self.externals = {}
+
+  @property
+  def node_count(self) -> int:
+    return len(self.node_paths)
+
+  def add(self, node: model.AstNode) -> int:
+    """The next node id, for node. The nodes all have to be added before the first group/external."""
+    if self.extra_owners:
+      raise Exception("Nodes have to be added before the groups and externals")
+    table = node.path.table
+    found = self.by_table.get(id(table))
+    if found is None:
+      found = self.by_table[id(table)] = (len(self.tables), array("i"))
+      self.tables.append(table)
+    table_index, ids = found
+    path_id = node.path.id
+    if path_id >= len(ids):
+      # Expanding (lazy bodies) adds paths.
+      ids.extend([-1] * (len(table) - len(ids)))
+    ret = self.node_count
+    if ids[path_id] < 0:
+      ids[path_id] = ret
+    else:
+      first = ids[path_id]
+      self.duplicates[self.identity(node)] = ret
+      self.copies[ret] = self.copy_counts[first] = self.copy_counts.get(first, 1) + 1
+    self.node_tables.append(table_index)
+    self.node_paths.append(path_id)
+    return ret
+
+  @staticmethod
+  def identity(node: model.AstNode) -> Any:
+    # The model's nodes are the same objects every time, NodeViews get made on every access but compare by row.
+    return node if isinstance(node, NodeView) else id(node)
+
+  def node(self, node: model.AstNode) -> int:
+    if self.duplicates:
+      ret = self.duplicates.get(self.identity(node))
+      if ret is not None:
+        return ret
+    found = self.by_table.get(id(node.path.table))
+    path_id = node.path.id
+    if found is None or path_id >= len(found[1]) or found[1][path_id] < 0:
+      raise KeyError(node.project_unique_path)
+    return found[1][path_id]
+
+  def _extra(self, owner: int, label: str) -> int:
+    self.extra_owners.append(owner)
+    self.extra_labels.append(label)
+    return self.node_count + len(self.extra_owners) - 1
+
+  def group(self, owner: int, suffix: str) -> int:
+    return self._extra(owner=owner, label=suffix)
+
+  def external(self, key: str) -> Tuple[int, bool]:
+    """The id for an unresolved/library name, and whether it is new."""
+    id = self.externals.get(key)
+    if id is not None:
+      return id, False
+    id = self.externals[key] = self._extra(owner=-1, label=key)
+    return id, True
+
+  def label(self, id: int) -> str:
+    if id < self.node_count:
+      path = self.tables[self.node_tables[id]].path(self.node_paths[id])
+      copy = self.copies.get(id)
+      return path if copy is None else f"{path}#{copy}"
+    owner = self.extra_owners[id - self.node_count]
+    label = self.extra_labels[id - self.node_count]
+    return label if owner < 0 else f"{self.label(owner)}::{label}"
+
+  def __len__(self) -> int:
+    return self.node_count + len(self.extra_owners)
+
+
+class Codes:
+  """Small integer codes for a handful of strings (edge types, ast types...)."""
+  names: List[str]
+  codes: Dict[str, int]
+
+  def __init__(self, names: Optional[List[str]] = None):
+    self.names = []
+    self.codes = {}
+    for name in names or []:
+      self.code(name)
+
+  def code(self, name: str) -> int:
+    code = self.codes.get(name)
+    if code is None:
+      code = self.codes[name] = len(self.names)
+      self.names.append(name)
+    return code
+
+
+class CodeGraph:
+  """
+  The project's graph (see GraphBuilder) as compressed sparse rows: the neighbors of node v are
+  targets[offsets[v]:offsets[v + 1]] (in order), with edge_types/resolutions lined up with targets.
+  It is undirected, so each edge is in the rows of both its ends (a self loop, once).
+  Node attributes are columns too; codes into their Codes, -1 for the nodes that don't have one.
+  """
+  RESOLUTIONS = ["resolved", "library", "unresolved"]
+
+  ids: GraphIds
+  offsets: np.ndarray
+  targets: np.ndarray
+  edge_types: np.ndarray
+  # Only for references, -1 otherwise
+  resolutions: np.ndarray
+  edge_type_codes: Codes
+  node_types: np.ndarray
+  node_type_codes: Codes
+  ast_types: np.ndarray
+  ast_type_codes: Codes
+  field_names: np.ndarray
+  field_name_codes: Codes
+
+  def __init__(self, **columns: Any):
+    for name, value in columns.items():
+      setattr(self, name, value)
+
+  @property
+  def node_count(self) -> int:
+    return len(self.offsets) - 1
+
+  def sources(self) -> np.ndarray:
+    """The source of each edge, lined up with targets."""
+    return np.repeat(np.arange(self.node_count, dtype=self.targets.dtype), np.diff(self.offsets))
+
+  @property
+  def edge_count(self) -> int:
+    return int(np.count_nonzero(self.sources() <= self.targets))
+
+  def neighbors(self, node: int) -> np.ndarray:
+    return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+  def node_attributes(self, node: int) -> Dict[str, str]:
+    """What networkx would have had for the node (see GraphBuilder)."""
+    attributes = {}
+    if self.node_types[node] >= 0:
+      attributes["node_type"] = self.node_type_codes.names[self.node_types[node]]
+      attributes["ast_type"] = self.ast_type_codes.names[self.ast_types[node]]
+    if self.field_names[node] >= 0:
+      attributes["field_name"] = self.field_name_codes.names[self.field_names[node]]
+    return attributes
+
+  def edges(self) -> Iterator[Tuple[int, int, Dict[str, str]]]:
+    """Every edge once (source <= target), with its attributes."""
+    sources = self.sources()
+    once = sources <= self.targets
+    edge_type_names = self.edge_type_codes.names
+    for source, target, edge_type, resolution in zip(
+      sources[once].tolist(),
+      self.targets[once].tolist(),
+      self.edge_types[once].tolist(),
+      self.resolutions[once].tolist(),
+    ):
+      attributes = {"edge_type": edge_type_names[edge_type]}
+      if resolution >= 0:
+        attributes["resolution"] = self.RESOLUTIONS[resolution]
+      yield source, target, attributes
+
+  def to_networkx(self) -> Any:
+    """The same graph as an nx.Graph, for small debugging runs (it takes a lot more memory)."""
+    import networkx as nx
+    graph = nx.Graph()
+    for node in range(self.node_count):
+      graph.add_node(node, **self.node_attributes(node))
+    for source, target, attributes in self.edges():
+      graph.add_edge(source, target, **attributes)
+    return graph
+
+  def nbytes(self) -> int:
+    return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+
+class GraphBuilder:
+  """
+  Collects the nodes and edges as flat columns (ints, not dicts), then makes the CodeGraph.
+  Like nx.Graph, adding an edge again replaces it (the last one's attributes win).
+  """
+  ids: GraphIds
+  sources: array
+  targets: array
+  edge_types: array
+  resolutions: array
+  edge_type_codes: Codes
+  # Per id
+  node_types: array
+  ast_types: array
+  field_names: array
+  node_type_codes: Codes
+  ast_type_codes: Codes
+  field_name_codes: Codes
+
+  def __init__(self, ids: GraphIds):
+    self.ids = ids
+    self.sources = array("i")
+    self.targets = array("i")
+    self.edge_types = array("b")
+    self.resolutions = array("b")
+    self.edge_type_codes = Codes()
+    self.node_types = array("b")
+    self.ast_types = array("i")
+    self.field_names = array("i")
+    self.node_type_codes = Codes()
+    self.ast_type_codes = Codes()
+    self.field_name_codes = Codes()
+
+  def _extra(self, id: int, field_name: Optional[str] = None) -> int:
+    self.node_types.append(-1)
+    self.ast_types.append(-1)
+    self.field_names.append(-1 if field_name is None else self.field_name_codes.code(field_name))
+    return id
+
+  def add_node(self, node: model.AstNode) -> int:
+    id = self.ids.add(node)
+    attributes = node.node_attributes()
+    self.node_types.append(self.node_type_codes.code(attributes["node_type"]))
+    self.ast_types.append(self.ast_type_codes.code(attributes["ast_type"]))
+    self.field_names.append(-1)
+    return id
+
+  def group(self, owner: int, suffix: str, field_name: str) -> int:
+    return self._extra(self.ids.group(owner, suffix), field_name=field_name)
+
+  def external(self, key: str) -> int:
+    id, new = self.ids.external(key)
+    return self._extra(id) if new else id
+
+  def add_edge(self, source: int, target: int, edge_type: str, resolution: Optional[str] = None) -> None:
+    self.sources.append(source)
+    self.targets.append(target)
+    self.edge_types.append(self.edge_type_codes.code(edge_type))
+    self.resolutions.append(-1 if resolution is None else CodeGraph.RESOLUTIONS.index(resolution))
+
+  def build(self) -> CodeGraph:
+    node_count = len(self.ids)
+    sources = np.frombuffer(self.sources, dtype=np.int32)
+    targets = np.frombuffer(self.targets, dtype=np.int32)
+    edge_types = np.frombuffer(self.edge_types, dtype=np.int8)
+    resolutions = np.frombuffer(self.resolutions, dtype=np.int8)
+    # One per pair of nodes, the last one added.
+    low = np.minimum(sources, targets).astype(np.int64)
+    high = np.maximum(sources, targets).astype(np.int64)
+    keys = low * node_count + high
+    _, last = np.unique(keys[::-1], return_index=True)
+    kept = len(keys) - 1 - last
+    low, high = low[kept], high[kept]
+    edge_types, resolutions = edge_types[kept], resolutions[kept]
+    # Both ways, but a self loop once.
+    loops = low == high
+    row_sources = np.concatenate([low, high[~loops]])
+    row_targets = np.concatenate([high, low[~loops]])
+    # Each row sorted by target, so finding an edge is a binary search (see walks.RandomWalker).
+    order = np.lexsort((row_targets, row_sources))
+    offsets = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_sources, minlength=node_count), out=offsets[1:])
+    return CodeGraph(
+      ids=self.ids,
+      offsets=offsets,
+      targets=row_targets[order].astype(np.int32),
+      edge_types=np.concatenate([edge_types, edge_types[~loops]])[order],
+      resolutions=np.concatenate([resolutions, resolutions[~loops]])[order],
+      edge_type_codes=self.edge_type_codes,
+      node_types=np.array(self.node_types, dtype=np.int8),
+      node_type_codes=self.node_type_codes,
+      ast_types=np.array(self.ast_types, dtype=np.int32),
+      ast_type_codes=self.ast_type_codes,
+      field_names=np.array(self.field_names, dtype=np.int32),
+      field_name_codes=self.field_name_codes,
+    )
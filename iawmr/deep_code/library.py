@@ -0,0 +1,246 @@
+from enum import Enum
+from importlib import metadata
+from typing import ClassVar, Dict, Iterator, List, Optional, Tuple
+import ast
+import glob
+import json
+import os
+import re
+
+import pydantic
+
+import iawmr.deep_code.model as model
+
+
+class SymbolKind(Enum):
+  Module = "Module"
+  Class = "Class"
+  Function = "Function"
+
+
+class LibraryIndex(model.BaseModel):
+  """
+  The signatures of one installed distribution: which modules, classes and functions it defines,
+  and what the names it imports at module/class level point at (that is how most packages re-export things).
+  Function bodies are never looked at.
+  """
+  # Bump this when the indexing changes, old index files get rebuilt.
+  FORMAT_VERSION: ClassVar[int] = 2
+
+  format_version: int
+  distribution: str
+  version: str
+  symbols: Dict[str, SymbolKind] = {}
+  # "pkg.Thing" -> "pkg._impl.Thing"
+  aliases: Dict[str, str] = {}
+  # "pkg" -> ["pkg._impl"] for from pkg._impl import *
+  star_imports: Dict[str, List[str]] = {}
+
+
+class Libraries(model.BaseModel):
+  """All of the library indexes for a venv, merged for lookups."""
+  indexes: List[LibraryIndex] = []
+  symbols: Dict[str, SymbolKind] = {}
+  aliases: Dict[str, str] = {}
+  star_imports: Dict[str, List[str]] = {}
+
+  # Re-exports of re-exports...
+  MAX_ALIAS_HOPS: ClassVar[int] = 8
+
+  @classmethod
+  def create(cls, indexes: List[LibraryIndex]) -> "Libraries":
+    symbols: Dict[str, SymbolKind] = {}
+    aliases: Dict[str, str] = {}
+    star_imports: Dict[str, List[str]] = {}
+    for index in indexes:
+      symbols.update(index.symbols)
+      aliases.update(index.aliases)
+      for module_name, bases in index.star_imports.items():
+        star_imports.setdefault(module_name, []).extend(bases)
+    return cls(indexes=indexes, symbols=symbols, aliases=aliases, star_imports=star_imports)
+
+  def resolve(self, name: str) -> Optional[str]:
+    """The library symbol name refers to, following re-exports, if there is one."""
+    candidates = [name]
+    seen = set()
+    for _ in range(self.MAX_ALIAS_HOPS):
+      rewritten = []
+      for candidate in candidates:
+        if candidate in self.symbols:
+          return candidate
+        if candidate in seen:
+          continue
+        seen.add(candidate)
+        rewritten.extend(self._rewrites(candidate))
+      if not rewritten:
+        return None
+      candidates = rewritten
+    return None
+
+  def _rewrites(self, name: str) -> List[str]:
+    # The longest aliased prefix wins: pkg.Thing.method -> pkg._impl.Thing.method
+    parts = name.split(".")
+    for end in range(len(parts), 0, -1):
+      prefix = ".".join(parts[:end])
+      target = self.aliases.get(prefix)
+      # from pkg import sub, in pkg/__init__.py, aliases pkg.sub to itself
+      if target is not None and target != prefix:
+        return [".".join([target] + parts[end:])]
+    # Otherwise it might have come in through a star import
+    rewrites = []
+    for end in range(len(parts) - 1, 0, -1):
+      for base in self.star_imports.get(".".join(parts[:end]), []):
+        rewrites.append(".".join([base] + parts[end:]))
+    return rewrites
+
+
+class LibraryIndexer:
+  @classmethod
+  def find_site_packages(cls, venv: str) -> List[str]:
+    if glob.glob(os.path.join(venv, "*.dist-info")):
+      return [venv]
+    return sorted(
+      glob.glob(os.path.join(venv, "lib", "python*", "site-packages"))
+      + glob.glob(os.path.join(venv, "Lib", "site-packages"))
+    )
+
+  @classmethod
+  def module_name(cls, relative_path: str) -> Tuple[str, bool]:
+    parts = relative_path[:-len(".py")].replace(os.sep, "/").split("/")
+    is_package = parts[-1] == "__init__"
+    if is_package:
+      parts = parts[:-1]
+    return ".".join(parts), is_package
+
+  @classmethod
+  def absolute_import(cls, module_name: str, is_package: bool, node: ast.ImportFrom) -> Optional[str]:
+    if node.level == 0:
+      return node.module
+    package = module_name.split(".")
+    if not is_package:
+      package = package[:-1]
+    if node.level > 1:
+      if node.level - 1 > len(package):
+        return None
+      package = package[:len(package) - (node.level - 1)]
+    return ".".join(package + ([node.module] if node.module else []))
+
+  @classmethod
+  def index_body(cls, index: LibraryIndex, module_name: str, is_package: bool, prefix: str, body: List[ast.stmt]) -> None:
+    for node in body:
+      if isinstance(node, ast.ClassDef):
+        name = f"{prefix}.{node.name}"
+        index.symbols[name] = SymbolKind.Class.value
+        cls.index_body(index=index, module_name=module_name, is_package=is_package, prefix=name, body=node.body)
+      elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        # Signatures only, the body is none of our business.
+        index.symbols[f"{prefix}.{node.name}"] = SymbolKind.Function.value
+      elif isinstance(node, ast.Import):
+        for alias in node.names:
+          if alias.asname is not None:
+            index.aliases[f"{prefix}.{alias.asname}"] = alias.name
+          else:
+            top_level = alias.name.split(".")[0]
+            index.aliases[f"{prefix}.{top_level}"] = top_level
+      elif isinstance(node, ast.ImportFrom):
+        base = cls.absolute_import(module_name=module_name, is_package=is_package, node=node)
+        if base is None:
+          continue
+        for alias in node.names:
+          if alias.name == "*":
+            index.star_imports.setdefault(prefix, []).append(base)
+            continue
+          local_name = alias.name if alias.asname is None else alias.asname
+          index.aliases[f"{prefix}.{local_name}"] = f"{base}.{alias.name}"
+      elif isinstance(node, (ast.If, ast.Try, ast.With)):
+        # Conditional imports and definitions (try: import x except ImportError: ...)
+        for inner in cls.inner_bodies(node):
+          cls.index_body(index=index, module_name=module_name, is_package=is_package, prefix=prefix, body=inner)
+
+  @classmethod
+  def inner_bodies(cls, node: ast.stmt) -> Iterator[List[ast.stmt]]:
+    for field in ("body", "orelse", "finalbody"):
+      inner = getattr(node, field, None)
+      if inner:
+        yield inner
+    for handler in getattr(node, "handlers", []):
+      yield handler.body
+
+  @classmethod
+  def index_file(cls, index: LibraryIndex, site_packages: str, relative_path: str) -> None:
+    try:
+      with open(os.path.join(site_packages, relative_path), "rb") as f:
+        tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+      # Python 2 leftovers, test fixtures with deliberate errors, ...
+      return
+    module_name, is_package = cls.module_name(relative_path)
+    index.symbols[module_name] = SymbolKind.Module.value
+    cls.index_body(index=index, module_name=module_name, is_package=is_package, prefix=module_name, body=tree.body)
+
+  @classmethod
+  def index_distribution(cls, distribution: metadata.Distribution, site_packages: str) -> LibraryIndex:
+    index = LibraryIndex(
+      format_version=LibraryIndex.FORMAT_VERSION,
+      distribution=distribution.metadata["Name"],
+      version=distribution.version,
+    )
+    for file in distribution.files or []:
+      relative_path = str(file)
+      if not relative_path.endswith(".py") or relative_path.startswith(".."):
+        continue
+      cls.index_file(index=index, site_packages=site_packages, relative_path=relative_path)
+    return index
+
+
+class LibraryIndexStore:
+  """
+  Library indexes on disk, one file per distribution and version, shared between projects and runs.
+  """
+  directory: str
+
+  def __init__(self, directory: Optional[str] = None):
+    self.directory = directory or self.default_directory()
+    os.makedirs(self.directory, exist_ok=True)
+
+  @classmethod
+  def default_directory(cls) -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "iawmr", "libraries")
+
+  def path(self, distribution: str, version: str) -> str:
+    name = re.sub(r"[-_.]+", "-", distribution).lower()
+    return os.path.join(self.directory, f"{name}-{version}.json")
+
+  def load(self, distribution: str, version: str) -> Optional[LibraryIndex]:
+    try:
+      with open(self.path(distribution=distribution, version=version), "r") as f:
+        index = LibraryIndex.model_validate(json.load(f))
+    except (OSError, ValueError, pydantic.ValidationError):
+      return None
+    if index.format_version != LibraryIndex.FORMAT_VERSION:
+      return None
+    return index
+
+  def save(self, index: LibraryIndex) -> None:
+    path = self.path(distribution=index.distribution, version=index.version)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+      f.write(index.model_dump_json())
+    os.replace(tmp_path, path)
+
+  def load_or_index(self, distribution: metadata.Distribution, site_packages: str) -> LibraryIndex:
+    index = self.load(distribution=distribution.metadata["Name"], version=distribution.version)
+    if index is None:
+      index = LibraryIndexer.index_distribution(distribution=distribution, site_packages=site_packages)
+      self.save(index)
+    return index
+
+  def index_venv(self, venv: str) -> Libraries:
+    indexes = []
+    for site_packages in LibraryIndexer.find_site_packages(venv):
+      for distribution in metadata.distributions(path=[site_packages]):
+        if not distribution.metadata["Name"]:
+          continue
+        indexes.append(self.load_or_index(distribution=distribution, site_packages=site_packages))
+    return Libraries.create(indexes)
@@ -1,6 +1,7 @@
 
 import ast
-from typing import Dict, Generator, Iterator, List, Optional, Tuple
+from array import array
+from typing import Callable, Dict, Generator, Iterable, Iterator, List, Optional, Tuple
 import pydantic
 from enum import Enum, auto
 from uuid import uuid4
@@ -29,38 +30,258 @@ class FunctionType(Enum):
   # Static = auto()
   # Class = auto()
 
+class PathTable:
+  """
+  The project_unique_paths of one module's nodes, as a trie: every path is its parent path plus one segment
+  (pkg.mod -> pkg.mod.Class -> pkg.mod.Class.method -> ...). Nodes only keep the id of their path,
+  the dotted string is built when somebody asks for it (see NodePath).
+
+  The same path always gets the same id, so if they define the same function twice, the two share it.
+  """
+  ROOT = -1
+
+  parents: array
+  segments: array
+  segment_names: List[str]
+  # Only needed to add paths, dropped by trim() and rebuilt when needed.
+  _segment_ids: Optional[Dict[str, int]]
+  _children: Optional[Dict[Tuple[int, int], int]]
+
+  def __init__(self):
+    self.parents = array("i")
+    self.segments = array("i")
+    self.segment_names = []
+    self._segment_ids = {}
+    self._children = {}
+
+  @classmethod
+  def from_columns(cls, parents: array, segments: array, segment_names: List[str]) -> "PathTable":
+    """A table that was saved (see binary.py), ready to read. Adding paths rebuilds the index first."""
+    ret = cls()
+    ret.parents = parents
+    ret.segments = segments
+    ret.segment_names = segment_names
+    ret.trim()
+    return ret
+
+  def __len__(self) -> int:
+    return len(self.parents)
+
+  def child(self, parent: int, segment: str) -> int:
+    if self._children is None or self._segment_ids is None:
+      self._build_index()
+      assert self._children is not None and self._segment_ids is not None
+    segment_id = self._segment_ids.get(segment)
+    if segment_id is None:
+      segment_id = self._segment_ids[segment] = len(self.segment_names)
+      self.segment_names.append(segment)
+    key = (parent, segment_id)
+    path_id = self._children.get(key)
+    if path_id is None:
+      path_id = self._children[key] = len(self.parents)
+      self.parents.append(parent)
+      self.segments.append(segment_id)
+    return path_id
+
+  def parent(self, path_id: int) -> int:
+    return self.parents[path_id]
+
+  def segment(self, path_id: int) -> str:
+    return self.segment_names[self.segments[path_id]]
+
+  def path(self, path_id: int) -> str:
+    segments = []
+    while path_id != self.ROOT:
+      segments.append(self.segment_names[self.segments[path_id]])
+      path_id = self.parents[path_id]
+    segments.reverse()
+    return ".".join(segments)
+
+  def trim(self) -> None:
+    """Drops the lookup tables, for when no more paths are coming (mostly)."""
+    self._segment_ids = None
+    self._children = None
+
+  def _build_index(self) -> None:
+    self._segment_ids = {name: index for index, name in enumerate(self.segment_names)}
+    self._children = {
+      (parent, segment): path_id
+      for path_id, (parent, segment) in enumerate(zip(self.parents, self.segments))
+    }
+
+  def __getstate__(self):
+    return (self.parents, self.segments, self.segment_names)
+
+  def __setstate__(self, state) -> None:
+    self.parents, self.segments, self.segment_names = state
+    self._segment_ids = None
+    self._children = None
+
+
+class NodePath:
+  """A path in a PathTable, which is what a node's project_unique_path is made of."""
+  __slots__ = ("table", "id")
+
+  table: PathTable
+  id: int
+
+  def __init__(self, table: PathTable, id: int):
+    self.table = table
+    self.id = id
+
+  def __str__(self) -> str:
+    return self.table.path(self.id)
+
+  def __repr__(self) -> str:
+    return f"NodePath({self.table.path(self.id)!r})"
+
+  def __eq__(self, other: object) -> bool:
+    return isinstance(other, NodePath) and other.table is self.table and other.id == self.id
+
+  def __hash__(self) -> int:
+    return hash((id(self.table), self.id))
+
+
+# Field names for construct_trusted, empty if the model needs model_construct.
+_TRUSTED_FIELD_NAMES: Dict[type, Tuple[str, ...]] = {}
+
+
 class BaseModel(pydantic.BaseModel):
-    class Config:  
-        use_enum_values = True
+    model_config = pydantic.ConfigDict(
+        use_enum_values=True,
+        # For NodePath
+        arbitrary_types_allowed=True,
+    )
+
+    @classmethod
+    def construct_trusted(cls, **values):
+        """
+        Builds the model without any validation, even cheaper than model_construct.
+        Every field has to be given, already of the right type (and enums already as their values).
+        """
+        names = _TRUSTED_FIELD_NAMES.get(cls)
+        if names is None:
+            names = _TRUSTED_FIELD_NAMES[cls] = () if cls.__private_attributes__ else tuple(cls.__pydantic_fields__)
+        if not names:
+            return cls.model_construct(**values)
+        ret = cls.__new__(cls)
+        # Serialization goes by __dict__ order, so keep it in field order.
+        object.__setattr__(ret, "__dict__", {name: values[name] for name in names})
+        object.__setattr__(ret, "__pydantic_fields_set__", set(values))
+        object.__setattr__(ret, "__pydantic_extra__", None)
+        object.__setattr__(ret, "__pydantic_private__", None)
+        return ret
+
+
+class ResolutionKind(Enum):
+  # The name is defined in the project
+  Exact = "Exact"
+  # It is, once the re-exports are followed (pkg.Thing -> pkg._impl.Thing)
+  ReExport = "ReExport"
+  # Only the start of it is (pkg.mod.Class.method.__call__ -> pkg.mod.Class.method)
+  Prefix = "Prefix"
+  # It is in one of the libraries
+  Library = "Library"
 
 
 class CodeReference(BaseModel):
   local_name: str
   fully_qualified_name: str
   target: Optional["AstNode"] = None
+  # The library symbol (see library.Libraries) this points at, when it isn't in the project
+  external_target: Optional[str] = None
   reference_type: str
+  # How target/external_target was found, None while unresolved
+  resolution: Optional[ResolutionKind] = None
   
 
+class ScopeChildren:
+  """A scope's child scopes, so add_alias can reach the descendants (a plain object: comparing or printing a scope doesn't recurse back down)."""
+  __slots__ = ("scopes",)
+
+  scopes: List["Scope"]
+
+  def __init__(self):
+    self.scopes = []
+
+
 class Scope(BaseModel):
+  # Where it is in its module's scope table (Module.scopes), which is how the json refers to it
+  id: int = 0
   name: str
-  # This is a circular reference
-  parent: Optional["Scope"] = None
+  # This is a circular reference. Exported as the parent's id.
+  parent: Optional["Scope"] = pydantic.Field(default=None, serialization_alias="parent_id")
+  # Use add_alias, so the resolve caches know about it.
   aliases: Dict[str, str] = {}
-  
+  # name -> resolve(name), until stale
+  resolved: Dict[str, Optional[str]] = pydantic.Field(default_factory=dict, exclude=True)
+  # An alias changed here or further up since resolved was filled in
+  stale: bool = pydantic.Field(default=False, exclude=True)
+  # resolved has every name that resolves to something (see freeze)
+  frozen: bool = pydantic.Field(default=False, exclude=True)
+  children: ScopeChildren = pydantic.Field(default_factory=ScopeChildren, exclude=True)
+
+  model_config = pydantic.ConfigDict(serialize_by_alias=True)
+
+  @pydantic.field_serializer("parent")
+  def serialize_parent(self, parent: Optional["Scope"]) -> Optional[int]:
+    return None if parent is None else parent.id
+
+  def model_post_init(self, __context) -> None:
+    if self.parent is not None:
+      self.parent.children.scopes.append(self)
+
+  def add_alias(self, local_name: str, fully_qualified_name: str) -> None:
+    self.aliases[local_name] = fully_qualified_name
+    # Only this scope and the ones under it look through its aliases.
+    pending = [self]
+    while pending:
+      scope = pending.pop()
+      scope.stale = True
+      pending.extend(scope.children.scopes)
+
+  def freeze(self) -> None:
+    """
+    Resolves everything that can be resolved from here up front, so lookups never walk up the parents.
+    For when the scope's block is done, but it still gets looked in. Adding an alias (in this
+    scope or above) thaws it until the next lookup.
+    """
+    self._check_stale()
+    names = set()
+    scope: Optional[Scope] = self
+    while scope is not None:
+      names.update(scope.aliases)
+      scope = scope.parent
+    for name in names:
+      self.resolve(name)
+    self.frozen = True
+
   def resolve(self, name: str) -> Optional[str]:
-    resolved, located = self._resolve_inner(name=name, resolved=False)
-    return resolved if located else None
-  
-  def _resolve_inner(self, name: str, resolved: bool) -> Tuple[Optional[str], bool]:
-    if name in self.aliases:
-      name = self.aliases[name]
-      resolved = True
-    return self._resolve_from_parent(name, resolved)
+    self._check_stale()
+    try:
+      return self.resolved[name]
+    except KeyError:
+      pass
+    if self.frozen:
+      # Only names in somebody's aliases resolve, and they are all in there.
+      return None
+    # An alias here renames it, the parents take it from there.
+    renamed = self.aliases.get(name)
+    lookup = name if renamed is None else renamed
+    ret = None if self.parent is None else self.parent.resolve(lookup)
+    if ret is None:
+      ret = renamed
+    self.resolved[name] = ret
+    return ret
 
-  def _resolve_from_parent(self, name: str, resolved: bool) -> Tuple[Optional[str], bool]:
-    if self.parent:
-      return self.parent._resolve_inner(name=name, resolved=resolved)
-    return name, resolved
+  def _check_stale(self) -> None:
+    if not self.stale:
+      return
+    self.stale = False
+    self.resolved.clear()
+    if self.frozen:
+      self.frozen = False
+      self.freeze()
 
 
 # class ResolvableReference(BaseModel):
@@ -93,36 +314,71 @@ class NodeChildren(BaseModel):
     elif self.single_valued:
       raise ValueError(f"Field {name} was defined twice.")
     self.list_fields[name].append(value)
+  
+  def add_placeholder(self, name: str, is_list: bool):
+    """Reserves the field's spot (dicts keep insertion order) for a body that gets parsed later."""
+    if is_list:
+      self.list_fields.setdefault(name, [])
+    else:
+      self.value_fields.setdefault(name, [])
+  
+  def remove_placeholders(self, names: Iterable[str]):
+    for name in names:
+      # List fields always get a group, even an empty one. Value fields only get added when there is a node.
+      if name in self.value_fields and not self.value_fields[name]:
+        del self.value_fields[name]
     
-  def all_nodes(self, scope: Optional[Scope] = None) -> Iterator[Tuple["AstNode", Scope]]:
+  def all_nodes(self, scope: Optional[Scope] = None, expand: bool = True) -> Iterator[Tuple["AstNode", Scope]]:
     assert scope
     for field_group in self.value_fields.values():
       for child in field_group:
-        yield from child.all_nodes(scope=scope)
+        yield from child.all_nodes(scope=scope, expand=expand)
     for outer_group in self.list_fields.values():
       for inner_group in outer_group:
         for child in inner_group:
-          yield from child.all_nodes(scope=scope)
+          yield from child.all_nodes(scope=scope, expand=expand)
           
-  def all_children(self) -> Iterator["AstNode"]:
+  def all_children(self, expand: bool = True) -> Iterator["AstNode"]:
     for field_group in self.value_fields.values():
       for child in field_group:
-        yield from child.all_children()
+        yield from child.all_children(expand=expand)
     for outer_group in self.list_fields.values():
       for inner_group in outer_group:
         for child in inner_group:
-          yield from child.all_children()
+          yield from child.all_children(expand=expand)
+
+
+# Most nodes never get a reference, so they all share this list until they do.
+# Don't append to it: use AstNode.add_reference.
+NO_REFERENCES: List[CodeReference] = []
 
 
 # rename to base or generic?
 class AstNode(BaseModel):
   # parent: Optional["AstNode"]
   node_type: AstNodeType
+  # Gets exported as the project_unique_path string.
   # This SHOULD be unique, but if they define the same function twice, it won't be.
-  project_unique_path: str
+  path: NodePath = pydantic.Field(serialization_alias="project_unique_path")
   ast_type: str
   children: NodeChildren = pydantic.Field(default_factory=NodeChildren)
   references: List[CodeReference] = []
+
+  model_config = pydantic.ConfigDict(serialize_by_alias=True)
+
+  @pydantic.field_serializer("path")
+  def serialize_path(self, path: NodePath) -> str:
+    return str(path)
+
+  @property
+  def project_unique_path(self) -> str:
+    return str(self.path)
+  
+  def add_reference(self, reference: CodeReference) -> None:
+    if self.references is NO_REFERENCES:
+      self.references = [reference]
+    else:
+      self.references.append(reference)
   
   def node_attributes(self) -> Dict[str, str]:
     return dict(
@@ -136,22 +392,28 @@ class AstNode(BaseModel):
   def get_scope(self, scope: Optional[Scope]):
     return scope
   
-  def all_nodes(self, scope: Optional[Scope] = None) -> Iterator[Tuple["AstNode", Scope]]:
+  def expand(self) -> None:
+    """Parses anything that was left for later (see Function)."""
+    pass
+  
+  def expand_all(self) -> None:
+    for _ in self.all_children(expand=True):
+      pass
+  
+  def all_nodes(self, scope: Optional[Scope] = None, expand: bool = True) -> Iterator[Tuple["AstNode", Scope]]:
+    if expand:
+      self.expand()
     scope = self.get_scope(scope)
     assert scope
     yield (self, scope)
-    yield from self.children.all_nodes(scope=scope)
+    yield from self.children.all_nodes(scope=scope, expand=expand)
   
-  def all_children(self) -> Iterator["AstNode"]:
+  def all_children(self, expand: bool = True) -> Iterator["AstNode"]:
+    if expand:
+      self.expand()
     yield self
-    yield from self.children.all_children()
+    yield from self.children.all_children(expand=expand)
   
-  def assert_tree_structure(self):
-    for child in self.children.all_children():
-      assert child.project_unique_path != self.project_unique_path, f"Node {self.project_unique_path} is a child of itself."
-    for child in self.children.all_children():
-      child.assert_tree_structure()
-    
     
 #   def all_references(self, scope: Optional[Scope]):
 #     scope = self.get_scope(scope)
@@ -165,7 +427,12 @@ class AstNode(BaseModel):
 # ResolvableReference.update_forward_refs()
 
 class ScopedNode(AstNode):
-  scope: Scope
+  # The scope lives in the module's scope table, only its id is exported.
+  scope: Scope = pydantic.Field(serialization_alias="scope_id")
+
+  @pydantic.field_serializer("scope")
+  def serialize_scope(self, scope: Scope) -> int:
+    return scope.id
   
   def get_scope(self, scope: Optional[Scope]):
     return self.scope
@@ -173,7 +440,8 @@ class ScopedNode(AstNode):
 class Module(ScopedNode):
   relative_path: str
   fully_qualified_name: Optional[str]
-  scope: Scope
+  # Every scope in the module (its own first), by id
+  scopes: List[Scope] = []
 
   def get_fully_qualified_name(self) -> Optional[str]:
     return self.fully_qualified_name
@@ -182,14 +450,21 @@ class Function(ScopedNode):
   name: str
   function_type: FunctionType
   fully_qualified_name: Optional[str]
-  scope: Scope
+  # With lazy_bodies, this parses the body into children the first time it is needed (see parsing.DeferredBody).
+  deferred_body: Optional[Callable[["Function"], None]] = pydantic.Field(default=None, exclude=True)
+  
+  def expand(self) -> None:
+    deferred_body = self.deferred_body
+    if deferred_body is None:
+      return
+    self.deferred_body = None
+    deferred_body(self)
 
   def get_fully_qualified_name(self) -> Optional[str]:
     return self.fully_qualified_name
 
 class Class(ScopedNode):
   name: str
-  scope: Scope
   fully_qualified_name: Optional[str]
 
   def get_fully_qualified_name(self) -> Optional[str]:
@@ -1,164 +1,188 @@
 
-from typing import List, Set
-from node2vec import Node2Vec
-import networkx as nx
-from uuid import uuid4
-import matplotlib
-import matplotlib.pyplot as plt
-from networkx.readwrite import json_graph
+from typing import Dict, List, Optional, Union
+from gensim.models import Word2Vec
 import iawmr.deep_code.model as model
 import json
+import numpy as np
 
 
-from iawmr.deep_code.project import Project
+from iawmr.deep_code.embeddings import EmbeddingStore
+from iawmr.deep_code.graph import AnyProject, CodeGraph, GraphBuilder, GraphIds
+from iawmr.deep_code.walks import RandomWalks, WalkCorpus, WalkOptions, WalkSentences
 
 
-def create_nodes(project: Project, graph: nx.Graph, node_uuids: Set[str]) -> None:
+def create_nodes(project: AnyProject, builder: GraphBuilder) -> None:
   for module in project.modules():
     for node, _ in module.all_nodes():
-      id = node.project_unique_path
-      if id in node_uuids:
-        raise Exception("Duplicate node")
-      node_uuids.add(id)
-      attrs = node.node_attributes()
-      graph.add_node(id, **attrs)
+      builder.add_node(node)
 
 
-def add_nodes_references(graph: nx.Graph, node_uuids: Set[str], node: model.AstNode, reference: model.CodeReference) -> None:
+def add_nodes_references(builder: GraphBuilder, node: model.AstNode, reference: model.CodeReference) -> None:
   if reference.target:
-    graph.add_edge(
-      node.project_unique_path,
-      reference.target.project_unique_path,
+    builder.add_edge(
+      builder.ids.node(node),
+      builder.ids.node(reference.target),
       edge_type=reference.reference_type,
       resolution="resolved",
     )
     return
 
-  key = f"unresolved::{reference.fully_qualified_name}"
-  if key not in node_uuids:
-    # TODO: use the Project's unresolved_references, then we can assume it is here, right?
-    node_uuids.add(key)
-    graph.add_node(key)
+  if reference.external_target:
+    key = f"library::{reference.external_target}"
+    resolution = "library"
+  else:
+    key = f"unresolved::{reference.fully_qualified_name}"
+    resolution = "unresolved"
+  # TODO: use the Project's unresolved_references, then we can assume it is here, right?
+  external = builder.external(key)
           
-  graph.add_edge(
-    node.project_unique_path,
-    key,
+  builder.add_edge(
+    builder.ids.node(node),
+    external,
     edge_type=reference.reference_type,
-    resolution="unresolved",
+    resolution=resolution,
   )
 
 
-def add_references(project: Project, graph: nx.Graph, node_uuids: Set[str]) -> None:
+def add_references(project: AnyProject, builder: GraphBuilder) -> None:
   for module in project.modules():
     for node, _ in module.all_nodes():
       for reference in node.references:
-        add_nodes_references(graph=graph, node_uuids=node_uuids, node=node, reference=reference)
+        add_nodes_references(builder=builder, node=node, reference=reference)
 
 
-def add_child_list(graph: nx.Graph, parent: str, values: List[model.AstNode]) -> None:
+def add_child_list(builder: GraphBuilder, parent: int, values: List[model.AstNode]) -> None:
   # Add beginning sentinal?
   prev_child = None
   for child in values:
-    graph.add_edge(parent, child.project_unique_path, edge_type="is_child")
+    child_id = builder.ids.node(child)
+    builder.add_edge(parent, child_id, edge_type="is_child")
     if prev_child is not None:
-      graph.add_edge(prev_child.project_unique_path, child.project_unique_path, edge_type="child_follows")
-    prev_child = child
+      builder.add_edge(prev_child, child_id, edge_type="child_follows")
+    prev_child = child_id
 
 
-def add_value_fields(graph: nx.Graph, node_uuids: Set[str], node: model.AstNode) -> None:
+def add_value_fields(builder: GraphBuilder, node: model.AstNode) -> None:
+  node_id = builder.ids.node(node)
   prev_group_node = None
   for index, mapping in enumerate(node.children.value_fields.items()):
     field_name, values = mapping
     
-    group_node = f"{node.project_unique_path}::{field_name}::{index}"
-    node_uuids.add(group_node)
-    graph.add_node(group_node, field_name=field_name)
-    graph.add_edge(node.project_unique_path, group_node, edge_type="field")
+    group_node = builder.group(node_id, f"{field_name}::{index}", field_name=field_name)
+    builder.add_edge(node_id, group_node, edge_type="field")
     if prev_group_node is not None:
-      graph.add_edge(prev_group_node, group_node, edge_type="group_follows")
-    # Check if the node already exists
+      builder.add_edge(prev_group_node, group_node, edge_type="group_follows")
   
-    add_child_list(graph=graph, parent=group_node, values=values)  
+    add_child_list(builder=builder, parent=group_node, values=values)  
   
     prev_group_node = group_node
   
 
-def add_list_fields(graph: nx.Graph, node_uuids: Set[str], node: model.AstNode) -> None:
+def add_list_fields(builder: GraphBuilder, node: model.AstNode) -> None:
+  node_id = builder.ids.node(node)
   prev_outer_group_node = None
   for outer_index, outer_mapping in enumerate(node.children.list_fields.items()):
     field_name, outer_values = outer_mapping
     
-    outer_group_node = f"{node.project_unique_path}::{field_name}::{outer_index}"
-    node_uuids.add(outer_group_node)
-    graph.add_node(outer_group_node, field_name=field_name)
-    graph.add_edge(node.project_unique_path, outer_group_node, edge_type="outer-field")
+    outer_group_node = builder.group(node_id, f"{field_name}::{outer_index}", field_name=field_name)
+    builder.add_edge(node_id, outer_group_node, edge_type="outer-field")
     if prev_outer_group_node is not None:
-      graph.add_edge(prev_outer_group_node, outer_group_node, edge_type="group_follows")
+      builder.add_edge(prev_outer_group_node, outer_group_node, edge_type="group_follows")
     
     prev_inner_group_node = None
     for inner_index, inner_values in enumerate(outer_values):
-      group_node = f"{outer_group_node}::{inner_index}"
-      node_uuids.add(group_node)
-      graph.add_node(group_node, field_name=field_name)
-      graph.add_edge(outer_group_node, group_node, edge_type="inner-field")
+      group_node = builder.group(outer_group_node, str(inner_index), field_name=field_name)
+      builder.add_edge(outer_group_node, group_node, edge_type="inner-field")
       if prev_inner_group_node is not None:
-        graph.add_edge(prev_inner_group_node, group_node, edge_type="group_follows")
+        builder.add_edge(prev_inner_group_node, group_node, edge_type="group_follows")
         
-      add_child_list(graph=graph, parent=group_node, values=inner_values)
+      add_child_list(builder=builder, parent=group_node, values=inner_values)
       prev_inner_group_node = group_node
     prev_outer_group_node = outer_group_node
   
 
-def add_nodes_children(graph: nx.Graph, node_uuids: Set[str], node: model.AstNode) -> None:
+def add_nodes_children(builder: GraphBuilder, node: model.AstNode) -> None:
   # TODO: Should I add sentinal nodes? (Or just a begin?)
-  add_value_fields(graph=graph, node_uuids=node_uuids, node=node)
-  add_list_fields(graph=graph, node_uuids=node_uuids, node=node)
+  add_value_fields(builder=builder, node=node)
+  add_list_fields(builder=builder, node=node)
 
 
-def add_children(project: Project, graph: nx.Graph, node_uuids: Set[str]) -> None:
+def add_children(project: AnyProject, builder: GraphBuilder) -> None:
   for module in project.modules():
     for node, _ in module.all_nodes():
-      add_nodes_children(graph=graph, node_uuids=node_uuids, node=node)
-
-def fit_node2vec(project: Project):
-  graph = nx.Graph()
-  node_uuids: Set[str] = set()
-  
-  create_nodes(project=project, graph=graph, node_uuids=node_uuids)
-  add_references(project=project, graph=graph, node_uuids=node_uuids)
-  add_children(project=project, graph=graph, node_uuids=node_uuids)
-  
-  # Now add children
-  
-  if True:
-    data = json_graph.node_link_data(graph)
-    # Save the data to a JSON file
-    with open("output.dir/graph.json", "w") as f:
-      json.dump(data, f, indent=2)
-    print("wrote graph")
-    print_stats()
-  
-  if False:
-    # This takes too long.
-    pos = nx.spring_layout(graph)
-    nx.draw(graph, pos, with_labels=True)
-    plt.savefig("output.dir/graph.png")
-    print("wrote image")
-  
-
-  # Small so we can run quickly until it works
-  node2vec = Node2Vec(graph, dimensions=3, walk_length=5, num_walks=5)
-  n2v_model = node2vec.fit(window=5, min_count=1)
-
-  embeddings = {}
-  for node in node_uuids:
-    embedding = n2v_model.wv[node]
-    embeddings[node] = list(embedding)
-  return embeddings
-  
-def print_stats():
-  with open("output.dir/graph.json", "r") as f:
-    data = json.load(f)
-  print("number of nodes", len(data["nodes"]))
-  print("number of edges", len(data["links"]))
-  print("number of unresolved references", len([n for n in data["nodes"] if n["id"].startswith("unresolved::")]))
\ No newline at end of file
+      add_nodes_children(builder=builder, node=node)
+
+
+def build_graph(project: AnyProject) -> CodeGraph:
+  builder = GraphBuilder(GraphIds())
+  create_nodes(project=project, builder=builder)
+  add_references(project=project, builder=builder)
+  add_children(project=project, builder=builder)
+  return builder.build()
+
+
+def export_graph(graph: CodeGraph, path: str) -> None:
+  """networkx's node link json, written a node/edge at a time instead of building it all first."""
+  with open(path, "w") as f:
+    f.write('{"directed": false, "multigraph": false, "graph": {},\n"nodes": [')
+    separator = "\n"
+    for node in range(graph.node_count):
+      f.write(separator)
+      f.write(json.dumps({**graph.node_attributes(node), "id": node, "label": graph.ids.label(node)}))
+      separator = ",\n"
+    f.write('\n],\n"links": [')
+    separator = "\n"
+    for source, target, attributes in graph.edges():
+      f.write(separator)
+      f.write(json.dumps({**attributes, "source": source, "target": target}))
+      separator = ",\n"
+    f.write("\n]}\n")
+
+
+def graph_stats(graph: CodeGraph) -> Dict[str, int]:
+  return {
+    "number of nodes": graph.node_count,
+    "number of edges": graph.edge_count,
+    "number of unresolved references": sum(1 for key in graph.ids.externals if key.startswith("unresolved::")),
+  }
+
+
+def fit_node2vec(
+  graph: CodeGraph,
+  options: Optional[WalkOptions] = None,
+  dimensions: int = 64,
+  window: int = 5,
+  epochs: int = 5,
+  corpus_path: Optional[str] = None,
+  compress_corpus: bool = False,
+  store_path: str = "output.dir/embeddings" + EmbeddingStore.SUFFIX,
+  normalize: bool = False,
+) -> Optional[EmbeddingStore]:
+  """
+  Writes the embeddings of graph's nodes (see build_graph) to store_path (see EmbeddingStore) and returns them opened from there,
+  None if there were no nodes to walk.
+
+  With a corpus_path, the walks are written there as they get made and Word2Vec reads them back from
+  it every epoch (see WalkCorpus): a batch of walks in memory at a time instead of all of them.
+  """
+  options = options or WalkOptions()
+  sentences: Union[WalkSentences, WalkCorpus]
+  if corpus_path is None:
+    sentences = WalkSentences(RandomWalks.generate(graph, options))
+  else:
+    sentences = WalkCorpus.write(corpus_path, RandomWalks.chunks(graph, options), options.walk_length, compress=compress_corpus)
+  if not len(sentences):
+    return None
+  n2v_model = Word2Vec(sentences, vector_size=dimensions, window=window, min_count=1, sg=1, epochs=epochs)
+
+  # The words are graph ids (see GraphIds.label). A walk over the time budget might not have gotten to every node.
+  ids = np.array([int(key) for key in n2v_model.wv.index_to_key], dtype=np.int64)
+  return EmbeddingStore.write(
+    store_path,
+    ids=ids,
+    vectors=n2v_model.wv.vectors,
+    normalize=normalize,
+    node_types=graph.node_types[ids],
+    node_type_names=graph.node_type_codes.names,
+    labels=[graph.ids.label(id) for id in ids.tolist()],
+  )
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import os
+import pickle
+
+import iawmr.deep_code.model as model
+from iawmr.deep_code.parsing.state import ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+
+class ParseCache:
+  """
+  An on disk cache of parsed modules.
+
+  Entries are keyed by the module path, the file contents and the fingerprint of the parsing strategy,
+  so editing a file or changing the rules just misses. The least recently used entries are evicted once
+  the cache grows past max_bytes.
+  """
+  # Bump this whenever the pickled model changes shape.
+  FORMAT_VERSION = 7
+  SUFFIX = ".pickle"
+
+  directory: str
+  max_bytes: int
+  hits: int
+  misses: int
+  evictions: int
+  # key -> size, least recently used first
+  entries: "OrderedDict[str, int]"
+  total_bytes: int
+
+  def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.entries = OrderedDict()
+    self.total_bytes = 0
+    os.makedirs(directory, exist_ok=True)
+    # The only time the entries get stat'ed and sorted: after that, get and put keep the order.
+    found = []
+    with os.scandir(directory) as it:
+      for entry in it:
+        if not entry.name.endswith(self.SUFFIX):
+          continue
+        stat = entry.stat()
+        found.append((stat.st_mtime, entry.name[:-len(self.SUFFIX)], stat.st_size))
+    for _, key, size in sorted(found):
+      self.entries[key] = size
+      self.total_bytes += size
+
+  def key(self, module_path: str, source: str, parsing_strategy: ParsingStrategy, options: Optional[ParsingOptions] = None) -> str:
+    options_fingerprint = (options or ParsingOptions()).fingerprint()
+    h = hashlib.sha256()
+    h.update(f"{self.FORMAT_VERSION}\0{module_path}\0{parsing_strategy.fingerprint()}\0{options_fingerprint}\0".encode())
+    h.update(source.encode())
+    return h.hexdigest()
+
+  def _path(self, key: str) -> str:
+    return os.path.join(self.directory, key + self.SUFFIX)
+
+  def get(self, key: str) -> Optional[model.Module]:
+    if key not in self.entries:
+      self.misses += 1
+      return None
+    path = self._path(key)
+    try:
+      with open(path, "rb") as f:
+        module = pickle.load(f)
+      # The mtime doubles as the last used time for the LRU, the next time the cache is opened.
+      os.utime(path)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+      # Unreadable, or pickled by code that has changed since (missing modules, attributes...): a miss.
+      self._remove(key)
+      self.misses += 1
+      return None
+    self.entries.move_to_end(key)
+    self.hits += 1
+    return module
+
+  def put(self, key: str, module: model.Module) -> None:
+    path = self._path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+      pickle.dump(module, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    if key in self.entries:
+      self.total_bytes -= self.entries.pop(key)
+    size = os.path.getsize(path)
+    self.entries[key] = size
+    self.total_bytes += size
+    self.evict()
+
+  def evict(self) -> None:
+    while self.total_bytes > self.max_bytes and self.entries:
+      self._remove(next(iter(self.entries)))
+      self.evictions += 1
+
+  def _remove(self, key: str) -> None:
+    size = self.entries.pop(key)
+    self.total_bytes -= size
+    try:
+      os.remove(self._path(key))
+    except FileNotFoundError:
+      pass
+
+  def stats(self) -> str:
+    return f"parse cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, {len(self.entries)} entries ({self.total_bytes} bytes)"
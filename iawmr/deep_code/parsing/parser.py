@@ -28,7 +28,7 @@ class AstParser(ABC, Generic[O, G, N]):
     self.node_type = node_type
   
   def should_push(self, node: ast.AST) -> bool:
-    return self.state.parsing_strategy.should_push(node=node)
+    return self.state.decisions.should_push(node)
   
   @abstractmethod
   def begin(self, node: O, id_part: G) -> Optional[N]:
@@ -51,11 +51,17 @@ class AstParser(ABC, Generic[O, G, N]):
   def parse_base(self, node: O) -> Dict[str, Any]:
     return dict(
         ast_type=node.__class__.__name__,
-        children={},
-        references=[],
-        node_type=self.node_type,
-        project_unique_path=self.state.create_id(),
+        children=model.NodeChildren.construct_trusted(value_fields={}, list_fields={}, single_valued=False),
+        references=model.NO_REFERENCES,
+        node_type=self.node_type.value,
+        path=self.state.create_id(),
     )
+  
+  def build(self, node_class: Type[N], node: O, **fields: Any) -> N:
+    if self.state.options.validate_nodes:
+      return node_class(**self.parse_base(node=node), **fields)
+    # Everything we pass is already of the right type (and enums are already values), so skip validation.
+    return node_class.construct_trusted(**self.parse_base(node=node), **fields)
 
 
 class ModuleParser(AstParser[ast.Module, str, model.Module]):
@@ -68,12 +74,16 @@ class ModuleParser(AstParser[ast.Module, str, model.Module]):
     scope = self.state.scopes.push(f"module {id_part}")
     if not self.should_push(node=node):
       return None
-    ret = model.Module(
-      **self.parse_base(node=node),
+    ret = self.build(
+      model.Module,
+      node=node,
       scope=scope,
       relative_path=id_part,
       fully_qualified_name=id_part,
+      scopes=self.state.scopes.table,
     )
+    # Validation copies the list, keep adding to the module's.
+    self.state.scopes.table = ret.scopes
     self.state.codes.push(ret)
     return ret
       
@@ -96,8 +106,9 @@ class ClassParser(AstParser[ast.ClassDef, str, model.Class]):
     scope = self.state.scopes.push(f"class {id_part}")
     if not self.should_push(node=node):
       return None
-    ret = model.Class(
-      **self.parse_base(node=node),
+    ret = self.build(
+      model.Class,
+      node=node,
       name=id_part,
       scope=scope,
       fully_qualified_name=self.state.fully_qualify(),
@@ -124,10 +135,12 @@ class FunctionParser(AstParser[ast.AST, Tuple[Optional[str], model.FunctionType]
     scope = self.state.scopes.push(f"function {name}")
     if not self.should_push(node=node):
       return None
-    ret = model.Function(
-      **self.parse_base(node=node),
+    ret = self.build(
+      model.Function,
+      node=node,
       name=name if name is not None else "<anonymous>",
-      function_type=function_type,
+      function_type=function_type.value,
+      deferred_body=None,
       scope=scope,
       fully_qualified_name=self.state.fully_qualify(),
     )
@@ -151,7 +164,7 @@ class StatementParser(AstParser[ast.stmt, str, model.Statement]):
     self.state.referencable_paths.push(None)
     if not self.should_push(node=node):
       return None
-    ret = model.Statement(**self.parse_base(node=node))
+    ret = self.build(model.Statement, node=node)
     self.state.codes.push(ret)
     return ret
   
@@ -171,7 +184,7 @@ class ExpressionParser(AstParser[ast.expr, str, model.Expression]):
     self.state.referencable_paths.push(None)
     if not self.should_push(node=node):
       return None
-    ret = model.Expression(**self.parse_base(node=node))
+    ret = self.build(model.Expression, node=node)
     self.state.codes.push(ret)
     return ret
   
@@ -191,7 +204,7 @@ class UnknownParser(AstParser[ast.AST, str, model.AstNode]):
     self.state.referencable_paths.push(None)
     if not self.should_push(node=node):
       return None
-    ret = model.AstNode(**self.parse_base(node=node))
+    ret = self.build(model.AstNode, node=node)
     self.state.codes.push(ret)
     return ret
   
@@ -1,22 +1,51 @@
 
 
 
-from typing import Any, List, Optional, Dict, Set, Tuple, Type, TypeVar, Callable, Generic
+from typing import Any, FrozenSet, Iterable, Iterator, List, Optional, Dict, Set, Tuple, Type, TypeVar, Callable, Generic
+from concurrent.futures import ProcessPoolExecutor
 import ast
 import os
 import typing
+import warnings
 from contextlib import contextmanager
 from abc import ABC, abstractmethod
 import json
 from enum import Enum, auto
 
 import iawmr.deep_code.model as model
-from iawmr.deep_code.parsing.parser import Parsers
-from iawmr.deep_code.parsing.state import ParsingState
+from iawmr.deep_code.compact import CompactProject
+from iawmr.deep_code.library import Libraries, LibraryIndexStore
+from iawmr.deep_code.parsing.cache import ParseCache
+from iawmr.deep_code.parsing.parser import AstParser, Parsers
+from iawmr.deep_code.parsing.state import BodySource, ParsingEngine, ParsingOptions, ParsingState
 from iawmr.deep_code.parsing.strategy import ParsingStrategy
+from iawmr.deep_code.parsing.walker import IgnorePatterns, walk_source_files
+from iawmr.deep_code.validation import TreeValidator
 import iawmr.deep_code.project as project
 
 
+R = TypeVar("R")
+
+
+class DeferredBody:
+  """
+  A function body lazy_bodies left for later (see model.Function.expand): where it is in the source
+  (lineno, col_offset, end_lineno, end_col_offset, like the ast) and the key its scopes go under (see
+  ScopeStack.keys). The rest of what parsing it takes is rebuilt from the function (see ParsingState.resume).
+  """
+  __slots__ = ("bodies", "location", "scope_key")
+
+  bodies: BodySource
+  location: Tuple[int, int, int, int]
+  scope_key: Tuple[int, ...]
+
+  def __init__(self, bodies: BodySource, location: Tuple[int, int, int, int], scope_key: Tuple[int, ...]):
+    self.bodies = bodies
+    self.location = location
+    self.scope_key = scope_key
+
+  def __call__(self, function: model.Function) -> None:
+    Parsing.expand_deferred(deferred=self, function=function)
 
 
 class Parsing:
@@ -38,13 +67,13 @@ class Parsing:
     for alias in node.names:
       local_name = alias.name if alias.asname is None else alias.asname
       fully_qualifed_name = alias.name
-      parsers.state.scopes.peek().aliases[local_name] = fully_qualifed_name
+      parsers.state.scopes.peek().add_alias(local_name, fully_qualifed_name)
       reference = model.CodeReference(
         local_name=local_name,
         fully_qualified_name=fully_qualifed_name,
         reference_type="import",
       )
-      parsers.current().references.append(reference)
+      parsers.current().add_reference(reference)
     
   @classmethod
   def collect_import_from_references(cls, parsers: Parsers, node: ast.ImportFrom) -> None:
@@ -54,13 +83,13 @@ class Parsing:
     for alias in node.names:
       local_name = alias.name if alias.asname is None else alias.asname
       fully_qualified_name = ".".join(base + [alias.name])
-      parsers.state.scopes.peek().aliases[local_name] = fully_qualified_name
+      parsers.state.scopes.peek().add_alias(local_name, fully_qualified_name)
       reference = model.CodeReference(
         local_name=local_name,
         fully_qualified_name=fully_qualified_name,
         reference_type="import_from",
       )
-      parsers.current().references.append(reference)
+      parsers.current().add_reference(reference)
   
   @classmethod
   def list_references_in_expr(cls) -> None:
@@ -112,7 +141,7 @@ class Parsing:
         fully_qualified_name=fully_qualified_name,
         reference_type="calls",
       )
-      parsers.current().references.append(reference)
+      parsers.current().add_reference(reference)
   
   @classmethod
   def collect_name_references(cls, parsers: Parsers, node: ast.Name) -> None:
@@ -148,13 +177,129 @@ class Parsing:
       pass
       # return cls.parse_variable(parsers=parsers, node=node)
   
+  # Fields that lazy_bodies leaves for model.Function.expand()
+  LAZY_FIELDS: Dict[type, FrozenSet[str]] = {
+    ast.FunctionDef: frozenset(["body"]),
+    ast.AsyncFunctionDef: frozenset(["body"]),
+    ast.Lambda: frozenset(["body"]),
+  }
+  NO_FIELDS: FrozenSet[str] = frozenset()
+
+  @classmethod
+  def defer_fields(cls, parsers: Parsers, node: ast.AST, current: model.AstNode) -> FrozenSet[str]:
+    if not parsers.state.options.lazy_bodies or parsers.state.source_lines is None:
+      return cls.NO_FIELDS
+    fields = cls.LAZY_FIELDS.get(node.__class__)
+    # If the function wasn't pushed, its body belongs to some ancestor and can't wait.
+    if fields is None or not isinstance(current, model.Function) or not parsers.state.decisions.should_push(node):
+      return cls.NO_FIELDS
+    return fields
+
+  @classmethod
+  def defer_body(cls, parsers: Parsers, node: ast.AST, current: model.AstNode, key: str, is_list: bool) -> None:
+    """Leaves the (deferred) field key for later, where parse_fields would have parsed it."""
+    current.children.add_placeholder(key, is_list=is_list)
+    assert isinstance(current, model.Function)
+    if current.deferred_body is not None:
+      # The first deferred field carries on with all of them.
+      return
+    state = parsers.state
+    # Everything the parse has in its stacks right now is the function's scope, path and name.
+    assert state.scopes.peek() is current.scope
+    # Holding on to every function's ast (or parsing state) would cost more memory than parsing the bodies in
+    # the first place, so only remember where the function is and re-parse it from the source when it gets expanded.
+    # The scope key is taken right here (not before the earlier fields), so the body's scopes are numbered after theirs.
+    current.deferred_body = DeferredBody(
+      bodies=state.body_source(),
+      location=cls.location(node),
+      scope_key=state.scopes.next_key(),
+    )
+
+  @classmethod
+  def location(cls, node: ast.AST) -> Tuple[int, int, int, int]:
+    return (getattr(node, "lineno", 0), getattr(node, "col_offset", 0), getattr(node, "end_lineno", 0), getattr(node, "end_col_offset", 0))
+
+  @classmethod
+  def reparse_deferred(cls, source_lines: List[str], location: Tuple[int, int, int, int], is_lambda: bool) -> ast.AST:
+    node_classes = (ast.Lambda,) if is_lambda else (ast.FunctionDef, ast.AsyncFunctionDef)
+    lineno, col_offset, end_lineno, end_col_offset = location
+    try:
+      # The col offsets are in utf-8 bytes
+      first = source_lines[lineno - 1].encode()
+      if lineno == end_lineno:
+        segment = first[col_offset:end_col_offset].decode()
+      else:
+        last = source_lines[end_lineno - 1].encode()
+        segment = first[col_offset:].decode() + "".join(source_lines[lineno:end_lineno - 1]) + last[:end_col_offset].decode()
+      if is_lambda:
+        node = typing.cast(ast.Expression, ast.parse(f"({segment}\n)", mode="eval")).body
+        col_shift = col_offset - 1
+      else:
+        # Only the def line loses its indentation, the body is still indented more than it.
+        node = ast.parse(segment).body[0]
+        col_shift = col_offset
+      # Put the locations back where they are in the file, nested functions get deferred by them too.
+      for child in ast.walk(node):
+        if getattr(child, "lineno", None) == 1:
+          child.col_offset += col_shift
+        if getattr(child, "end_lineno", None) == 1:
+          child.end_col_offset += col_shift
+      node = ast.increment_lineno(node, lineno - 1)
+      if isinstance(node, node_classes) and cls.location(node) == location:
+        return node
+    except (SyntaxError, UnicodeDecodeError, IndexError):
+      pass
+    # The slice didn't parse back into the same function (the locations of what is in an f-string are off
+    # before python 3.12...): find it in the whole module, which is slower but has the same locations.
+    for candidate in ast.walk(ast.parse("".join(source_lines))):
+      if isinstance(candidate, node_classes) and cls.location(candidate) == location:
+        return candidate
+    raise ValueError(f"No function at {location} anymore")
+
+  @classmethod
+  def expand_deferred(cls, deferred: DeferredBody, function: model.Function) -> None:
+    bodies = deferred.bodies
+    node = cls.reparse_deferred(
+      source_lines=bodies.source_lines,
+      location=deferred.location,
+      is_lambda=function.function_type == model.FunctionType.Lambda.value,
+    )
+    fields = cls.LAZY_FIELDS[node.__class__]
+    state = ParsingState.resume(bodies=bodies, function=function, scope_key=deferred.scope_key)
+    parsers = Parsers.create(state=state)
+    if state.options.engine == ParsingEngine.Iterative:
+      work: List[Tuple] = []
+      cls.push_field_work(parsers=parsers, work=work, node=node, current=function, only=fields)
+      cls.run_work(parsers=parsers, work=work)
+    else:
+      cls.parse_fields(parsers=parsers, node=node, current=function, only=fields)
+    function.children.remove_placeholders(fields)
+    state.scopes.renumber()
+
   @classmethod
   def parse_children(cls, parsers: Parsers, node: ast.AST) -> None:
-    if not parsers.state.parsing_strategy.should_descend_into(node=node):
+    if not parsers.state.decisions.should_descend_into(node):
       return
     current = parsers.current()
+    deferred = cls.defer_fields(parsers=parsers, node=node, current=current)
+    cls.parse_fields(parsers=parsers, node=node, current=current, deferred=deferred)
+
+  @classmethod
+  def parse_fields(
+    cls,
+    parsers: Parsers,
+    node: ast.AST,
+    current: model.AstNode,
+    deferred: FrozenSet[str] = NO_FIELDS,
+    only: Optional[FrozenSet[str]] = None,
+  ) -> None:
     for field, value in ast.iter_fields(node):
       key = str(field)
+      if only is not None and key not in only:
+        continue
+      if key in deferred:
+        cls.defer_body(parsers=parsers, node=node, current=current, key=key, is_list=isinstance(value, list))
+        continue
       
       if isinstance(value, ast.AST):
         child = cls.parse_node(parsers=parsers, node=value, default_name=str(field))
@@ -265,10 +410,296 @@ class Parsing:
       # pass
     return cls.parse_generic(parsers=parsers, node=node, default_name=default_name)
   
+  @classmethod
+  def select_parser(cls, parsers: Parsers, node: ast.AST, default_name: str) -> Tuple[AstParser, Any]:
+    """The parser and id_part parse_node would have used."""
+    if isinstance(node, ast.ClassDef):
+      return parsers.clazz, node.name
+    if isinstance(node, ast.AsyncFunctionDef):
+      return parsers.functions, (node.name, model.FunctionType.Async)
+    if isinstance(node, ast.FunctionDef):
+      return parsers.functions, (node.name, model.FunctionType.Simple)
+    if isinstance(node, ast.Lambda):
+      return parsers.functions, (None, model.FunctionType.Lambda)
+    if isinstance(node, ast.stmt):
+      return parsers.statements, default_name
+    if isinstance(node, ast.expr):
+      return parsers.expressions, default_name
+    return parsers.unknown, default_name
+
+  # Work items for parse_iteratively
+  ENTER = 0
+  EXIT = 1
+  ADD_LIST = 2
+  PLACEHOLDER = 3
+  # Where an EXIT delivers the finished node
+  TO_ROOT = 0
+  TO_VALUE_FIELD = 1
+  TO_LIST_FIELD = 2
+
+  @classmethod
+  def push_field_work(
+    cls,
+    parsers: Parsers,
+    work: List[Tuple],
+    node: ast.AST,
+    current: model.AstNode,
+    deferred: FrozenSet[str] = NO_FIELDS,
+    only: Optional[FrozenSet[str]] = None,
+  ) -> None:
+    items: List[Tuple] = []
+    for field, value in ast.iter_fields(node):
+      key = str(field)
+      if only is not None and key not in only:
+        continue
+      if key in deferred:
+        # Has to happen in order too, the earlier fields may add keys to current
+        items.append((cls.PLACEHOLDER, node, current, key, isinstance(value, list)))
+        continue
+      if isinstance(value, ast.AST):
+        parser, id_part = cls.select_parser(parsers=parsers, node=value, default_name=key)
+        items.append((cls.ENTER, value, parser, id_part, cls.TO_VALUE_FIELD, current, key))
+        continue
+      if not isinstance(value, list):
+        continue
+      children: List[model.AstNode] = []
+      for index, item in enumerate(typing.cast(List[Any], value)):
+        if not isinstance(item, ast.AST):
+          continue
+        parser, id_part = cls.select_parser(parsers=parsers, node=item, default_name=f"{key}[{index}]")
+        items.append((cls.ENTER, item, parser, id_part, cls.TO_LIST_FIELD, children, None))
+      items.append((cls.ADD_LIST, current, key, children))
+    items.reverse()
+    work.extend(items)
+
+  @classmethod
+  def run_work(cls, parsers: Parsers, work: List[Tuple]) -> None:
+    decisions = parsers.state.decisions
+    while work:
+      item = work.pop()
+      kind = item[0]
+      if kind == cls.ENTER:
+        _, node, parser, id_part, target, container, key = item
+        ret = parser.begin(node=node, id_part=id_part)
+        work.append((cls.EXIT, node, parser, ret, target, container, key))
+        if decisions.should_descend_into(node):
+          current = parsers.current()
+          deferred = cls.defer_fields(parsers=parsers, node=node, current=current)
+          cls.push_field_work(parsers=parsers, work=work, node=node, current=current, deferred=deferred)
+      elif kind == cls.EXIT:
+        _, node, parser, ret, target, container, key = item
+        cls.collect_references(parsers=parsers, node=node)
+        parser.end(node=node)
+        if ret is None:
+          continue
+        if target == cls.TO_VALUE_FIELD:
+          container.children.add_value_field(key, ret)
+        elif target == cls.TO_LIST_FIELD:
+          container.append(ret)
+        else:
+          container[0] = ret
+      elif kind == cls.ADD_LIST:
+        _, current, key, children = item
+        current.children.add_list_field(key, children)
+      else:
+        _, node, current, key, is_list = item
+        cls.defer_body(parsers=parsers, node=node, current=current, key=key, is_list=is_list)
+
+  @classmethod
+  def parse_iteratively(cls, parsers: Parsers, parser: AstParser, node: ast.AST, id_part: Any) -> Optional[model.AstNode]:
+    """
+    Does the same thing as parse_node, in the same order, but with an explicit work stack instead of
+    recursion (and without the with_ context managers).
+    """
+    root: List[Optional[model.AstNode]] = [None]
+    cls.run_work(parsers=parsers, work=[(cls.ENTER, node, parser, id_part, cls.TO_ROOT, root, None)])
+    return root[0]
+
+  @classmethod
+  def parse_module_iteratively(cls, parsers: Parsers, node: ast.Module) -> Optional[model.Module]:
+    ret = cls.parse_iteratively(parsers=parsers, parser=parsers.modules, node=node, id_part=parsers.state.module_path)
+    return typing.cast(Optional[model.Module], ret)
+
   @classmethod
   def fs_path_to_py_path(cls, fs_path: str) -> str:
     return fs_path[:-len(".py")].replace("/", ".")
     
+  @classmethod
+  def find_source_files(cls, root_path: str, ignores: List[str], max_file_size: Optional[int] = None) -> List[str]:
+    # ignores are gitignore style patterns, relative to root_path
+    return walk_source_files(root_path=root_path, ignores=IgnorePatterns(ignores), max_file_size=max_file_size)
+
+  @classmethod
+  def write_json(cls, relative_path: str, module: model.Module) -> None:
+    # TODO: This probably won't work with multiple source directories
+    file_path = os.path.join("output.dir", relative_path + ".json")
+    dir_name = os.path.dirname(file_path)
+    os.makedirs(dir_name, exist_ok=True)
+    # With lazy_bodies, the json needs the bodies that weren't needed yet too (or it would have a "body": [] where
+    # the function's body is), so it is the same as without.
+    module.expand_all()
+    # Straight from pydantic, in one pass.
+    with open(file_path, "w", encoding="utf-8") as fp:
+      fp.write(module.model_dump_json(indent=2))
+
+  @classmethod
+  def parse_source(
+    cls,
+    relative_path: str,
+    source: str,
+    parsing_strategy: ParsingStrategy,
+    write_jsons: bool = False,
+    options: Optional[ParsingOptions] = None,
+  ) -> Tuple[str, model.Module]:
+    ast_node = ast.parse(source)
+    module_path = cls.fs_path_to_py_path(relative_path)
+    state = ParsingState.create(module_path=module_path, parsing_strategy=parsing_strategy, options=options, source=source)
+    parsers = Parsers.create(state=state)
+    if state.options.engine == ParsingEngine.Iterative:
+      module = cls.parse_module_iteratively(parsers=parsers, node=ast_node)
+    else:
+      module = cls.parse_module(parsers=parsers, node=ast_node)
+    assert module
+    state.assert_empty()
+    if not state.options.lazy_bodies:
+      # No more paths are coming.
+      state.paths.trim()
+    if write_jsons:
+      cls.write_json(relative_path=relative_path, module=module)
+    return module_path, module
+
+  @classmethod
+  def parse_file(
+    cls,
+    root_path: str,
+    file_path: str,
+    parsing_strategy: ParsingStrategy,
+    write_jsons: bool = False,
+    options: Optional[ParsingOptions] = None,
+  ) -> Tuple[str, model.Module]:
+    with open(file_path, "r") as f:
+      source = f.read()
+    return cls.parse_source(
+      relative_path=os.path.relpath(file_path, start=root_path),
+      source=source,
+      parsing_strategy=parsing_strategy,
+      write_jsons=write_jsons,
+      options=options,
+    )
+
+  @classmethod
+  def map_jobs(cls, function: Callable[..., R], jobs: int, *iterables: Iterable[Any]) -> Iterator[R]:
+    arguments = [list(iterable) for iterable in iterables]
+    count = min(len(argument) for argument in arguments) if arguments else 0
+    if jobs <= 1 or count <= 1:
+      yield from map(function, *arguments)
+      return
+    # The workers send back the finished (pickled) modules. map() keeps the input
+    # order, so the modules get merged in the same order as the serial path.
+    chunksize = max(1, count // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+      yield from executor.map(function, *arguments, chunksize=chunksize)
+
+  @classmethod
+  def parse_files(
+    cls,
+    root_path: str,
+    file_paths: List[str],
+    parsing_strategy: ParsingStrategy,
+    write_jsons: bool = False,
+    jobs: int = 1,
+    options: Optional[ParsingOptions] = None,
+  ) -> Iterator[Tuple[str, model.Module]]:
+    count = len(file_paths)
+    yield from cls.map_jobs(
+      cls.parse_file,
+      jobs,
+      [root_path] * count,
+      file_paths,
+      [parsing_strategy] * count,
+      [write_jsons] * count,
+      [options] * count,
+    )
+
+  @classmethod
+  def parse_files_cached(
+    cls,
+    root_path: str,
+    file_paths: List[str],
+    parsing_strategy: ParsingStrategy,
+    cache: ParseCache,
+    write_jsons: bool = False,
+    jobs: int = 1,
+    options: Optional[ParsingOptions] = None,
+  ) -> Iterator[Tuple[str, model.Module]]:
+    results: List[Optional[Tuple[str, model.Module]]] = []
+    missed: List[Tuple[int, str, str, str]] = []
+    for file_path in file_paths:
+      with open(file_path, "r") as f:
+        source = f.read()
+      relative_path = os.path.relpath(file_path, start=root_path)
+      module_path = cls.fs_path_to_py_path(relative_path)
+      key = cache.key(module_path=module_path, source=source, parsing_strategy=parsing_strategy, options=options)
+      module = cache.get(key)
+      if module is None:
+        missed.append((len(results), key, relative_path, source))
+        results.append(None)
+        continue
+      if write_jsons:
+        cls.write_json(relative_path=relative_path, module=module)
+      results.append((module_path, module))
+
+    count = len(missed)
+    parsed = cls.map_jobs(
+      cls.parse_source,
+      jobs,
+      [relative_path for _, _, relative_path, _ in missed],
+      [source for _, _, _, source in missed],
+      [parsing_strategy] * count,
+      [write_jsons] * count,
+      [options] * count,
+    )
+    for (index, key, _, _), result in zip(missed, parsed):
+      cache.put(key, result[1])
+      results[index] = result
+
+    for result in results:
+      assert result is not None
+      yield result
+
+  @classmethod
+  def parse_source_directory_modules(
+    cls,
+    root_path: str,
+    parsing_strategy: ParsingStrategy,
+    ignores: List[str],
+    write_jsons: bool = False,
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+    options: Optional[ParsingOptions] = None,
+    max_file_size: Optional[int] = None,
+  ) -> Iterator[Tuple[str, model.Module]]:
+    file_paths = cls.find_source_files(root_path=root_path, ignores=ignores, max_file_size=max_file_size)
+    if cache is None:
+      yield from cls.parse_files(
+        root_path=root_path,
+        file_paths=file_paths,
+        parsing_strategy=parsing_strategy,
+        write_jsons=write_jsons,
+        jobs=jobs,
+        options=options,
+      )
+    else:
+      yield from cls.parse_files_cached(
+        root_path=root_path,
+        file_paths=file_paths,
+        parsing_strategy=parsing_strategy,
+        cache=cache,
+        write_jsons=write_jsons,
+        jobs=jobs,
+        options=options,
+      )
+
   @classmethod
   def parse_source_directory(
     cls,
@@ -277,39 +708,37 @@ class Parsing:
     parsing_strategy: ParsingStrategy,
     ignores: List[str],
     write_jsons: bool = False,
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+    options: Optional[ParsingOptions] = None,
+    max_file_size: Optional[int] = None,
+    validator: Optional[TreeValidator] = None,
   ) -> project.SourceDirectory:
+    """
+    Checks the modules (see check_tree) if options.validate_tree. With a validator, they only get added to it,
+    for the caller to check along with the other directories'.
+    """
+    options = options or ParsingOptions()
+    check = validator is None and options.validate_tree
+    if check:
+      validator = TreeValidator()
+    parsed = cls.parse_source_directory_modules(
+      root_path=root_path,
+      parsing_strategy=parsing_strategy,
+      ignores=ignores,
+      write_jsons=write_jsons,
+      jobs=jobs,
+      cache=cache,
+      options=options,
+      max_file_size=max_file_size,
+    )
     modules = {}
-    for root, _, files in os.walk(root_path):
-      if any(ignore in root for ignore in ignores):
-        continue
-      for filename in files:
-        if not filename.endswith(".py"):
-          continue
-        file_path = os.path.join(root, filename)
-        with open(file_path, "r") as f:
-          source = f.read()
-          ast_node = ast.parse(source)
-          relative_path = os.path.relpath(file_path, start=root_path)
-          
-          module_path = cls.fs_path_to_py_path(relative_path)
-          state = ParsingState.create(module_path=module_path, parsing_strategy=parsing_strategy)
-          parsers = Parsers.create(state=state)
-          module = cls.parse_module(
-            parsers=parsers,
-            node=ast_node,
-          )
-          assert module
-          state.assert_empty()
-          module.assert_tree_structure()
-          modules[module_path] = module
-        if write_jsons:
-          # TODO: This probably won't work with multiple source directories
-          file_path = os.path.join("output.dir", relative_path + ".json")
-          dir_name = os.path.dirname(file_path)
-          os.makedirs(dir_name, exist_ok=True)
-          with open(file_path, "w") as fp:
-            js = json.loads(module.json())
-            json.dump(js, fp, indent=2)
+    for module_path, module in parsed:
+      modules[module_path] = module
+      if validator is not None:
+        validator.add_module(module)
+    if check:
+      cls.check_tree(validator=validator, options=options)
     return project.SourceDirectory(
       root_path=root_path,
       package_type=directory_type,
@@ -317,7 +746,16 @@ class Parsing:
     )
 
   @classmethod
-  def parse_project(cls, spec: project.ProjectSpec, write_jsons: bool = False) -> project.Project:
+  def parse_project(
+    cls,
+    spec: project.ProjectSpec,
+    write_jsons: bool = False,
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+    options: Optional[ParsingOptions] = None,
+  ) -> project.Project:
+    options = options or ParsingOptions()
+    validator = TreeValidator() if options.validate_tree else None
     source_directories = []
     for source_directory in spec.sources:
       source_directories.append(
@@ -327,19 +765,69 @@ class Parsing:
           ignores=spec.ignores,
           write_jsons=write_jsons,
           parsing_strategy=spec.parsing_strategy,
+          jobs=jobs,
+          cache=cache,
+          options=options,
+          max_file_size=spec.max_file_size,
+          validator=validator,
         )
       )
-    if spec.venv:
-      source_directories.append(
-        cls.parse_source_directory(
-          directory_type=project.SourceDirectoryType.Library,
-          root_path=source_directory,
-          ignores=spec.ignores,
-          write_jsons=write_jsons,
-          parsing_strategy=spec.parsing_strategy,
-        )
-      )
+    if validator is not None:
+      # Across the directories too.
+      cls.check_tree(validator=validator, options=options)
     return project.Project(
       spec=spec,
       sources=source_directories,
+      libraries=cls.load_libraries(spec),
     )
+
+  @classmethod
+  def check_tree(cls, validator: TreeValidator, options: ParsingOptions) -> None:
+    """
+    Raises for every violation at once. Duplicate paths are only a warning, unless options.unique_paths
+    (the graph gives such nodes one each, see GraphIds).
+    """
+    validator.check(unique_paths=options.unique_paths)
+    if not options.unique_paths:
+      duplicates = validator.duplicates()
+      if duplicates:
+        warnings.warn(f"{len(duplicates)} project_unique_paths are shared by more than one node, e.g. {duplicates[0].project_unique_path}")
+
+  @classmethod
+  def load_libraries(cls, spec: project.ProjectSpec) -> Optional[Libraries]:
+    if not spec.venv:
+      return None
+    # Only the signatures, from the shared index (built the first time we see a distribution/version).
+    return LibraryIndexStore(directory=spec.library_index_dir).index_venv(spec.venv)
+
+  @classmethod
+  def parse_project_compact(
+    cls,
+    spec: project.ProjectSpec,
+    write_jsons: bool = False,
+    jobs: int = 1,
+    cache: Optional[ParseCache] = None,
+    options: Optional[ParsingOptions] = None,
+  ) -> CompactProject:
+    """Like parse_project, but each module goes into the CompactProject (and is dropped) as soon as it is parsed."""
+    options = options or ParsingOptions()
+    compact = CompactProject(libraries=cls.load_libraries(spec))
+    validator = TreeValidator() if options.validate_tree else None
+    for source_directory in spec.sources:
+      parsed = cls.parse_source_directory_modules(
+        root_path=source_directory,
+        parsing_strategy=spec.parsing_strategy,
+        ignores=spec.ignores,
+        write_jsons=write_jsons,
+        jobs=jobs,
+        cache=cache,
+        options=options,
+        max_file_size=spec.max_file_size,
+      )
+      for _, module in parsed:
+        if validator is not None:
+          validator.add_module(module)
+        compact.add_module(module)
+    if validator is not None:
+      cls.check_tree(validator=validator, options=options)
+    return compact
@@ -1,12 +1,17 @@
 
 
 
-from typing import Any, List, Optional, Dict, Set, Tuple, Type, TypeVar, Callable, Generic
+from typing import Any, ClassVar, List, Optional, Dict, Set, Tuple, Type, TypeVar, Callable, Generic
 from contextlib import contextmanager
 from abc import ABC, abstractmethod
+from enum import Enum
+import bisect
+import io
+
+import pydantic
 
 import iawmr.deep_code.model as model
-from iawmr.deep_code.parsing.strategy import ParsingStrategy
+from iawmr.deep_code.parsing.strategy import DecisionTable, ParsingStrategy
 
 
 T = TypeVar("T")
@@ -57,12 +62,69 @@ class CodeStack(ParsingStack[model.AstNode, model.AstNode]):
 
 
 class ScopeStack(ParsingStack[str, model.Scope]):
+  # Freeze scopes once their block is done (see model.Scope.freeze)
+  freeze_on_pop: bool
+  # Every scope created for the module, the id of a scope is its index (see model.Module.scopes)
+  table: List[model.Scope]
+  # keys[i] is where table[i] was created in an eager parse: the scopes created and the bodies deferred
+  # (see parsing.Parsing.defer_body) are numbered as they come, and a deferred body's scopes go under the body's number.
+  # Lazy bodies get parsed whenever, but their scopes still land (and are numbered) where an eager parse puts them.
+  keys: List[Tuple[int, ...]]
+  prefix: Tuple[int, ...]
+  events: int
+  # The first table index whose scope id is out of date, see renumber
+  stale: Optional[int]
+
+  def __init__(
+    self,
+    elements: Optional[List[model.Scope]] = None,
+    freeze_on_pop: bool = False,
+    table: Optional[List[model.Scope]] = None,
+    keys: Optional[List[Tuple[int, ...]]] = None,
+    prefix: Tuple[int, ...] = (),
+  ):
+    super().__init__(elements=elements)
+    self.freeze_on_pop = freeze_on_pop
+    self.table = [] if table is None else table
+    self.keys = [] if keys is None else keys
+    self.prefix = prefix
+    self.events = 0
+    self.stale = None
+
+  def next_key(self) -> Tuple[int, ...]:
+    ret = self.prefix + (self.events,)
+    self.events += 1
+    return ret
+
   def create(self, arg: str) -> model.Scope:
-    return model.Scope(
+    key = self.next_key()
+    index = len(self.table)
+    if self.keys and key < self.keys[-1]:
+      index = bisect.bisect(self.keys, key)
+      self.stale = index if self.stale is None else min(self.stale, index)
+    ret = model.Scope(
+      id=index,
       name=arg,
       parent=self.maybe_peek(),
       aliases=dict(),
     )
+    self.table.insert(index, ret)
+    self.keys.insert(index, key)
+    return ret
+
+  def renumber(self) -> None:
+    """Catches the scope ids up with the table, after create inserted some in the middle of it."""
+    if self.stale is None:
+      return
+    for index in range(self.stale, len(self.table)):
+      self.table[index].id = index
+    self.stale = None
+
+  def pop(self) -> model.Scope:
+    ret = super().pop()
+    if self.freeze_on_pop:
+      ret.freeze()
+    return ret
 
 
 class PathStack(ParsingStack[Optional[str], Optional[str]]):
@@ -70,32 +132,169 @@ class PathStack(ParsingStack[Optional[str], Optional[str]]):
     return arg
 
 
+class NodePathStack(ParsingStack[Optional[str], Optional[str]]):
+  """
+  The detailed path segments, like a PathStack, but the path ids (in the module's PathTable) only get
+  made for the nodes that are actually built: most of the ast is walked through without keeping anything.
+  """
+  paths: model.PathTable
+  # ids[i] is the path id of elements[:i + 1], for as far as anybody has asked.
+  ids: List[int]
+
+  def __init__(self, paths: model.PathTable, elements: Optional[List[Optional[str]]] = None, ids: Optional[List[int]] = None):
+    super().__init__(elements=elements)
+    self.paths = paths
+    self.ids = ids or []
+
+  def create(self, arg: Optional[str]) -> Optional[str]:
+    return arg
+
+  def pop(self) -> Optional[str]:
+    ret = self.elements.pop()
+    if len(self.ids) > len(self.elements):
+      self.ids.pop()
+    return ret
+
+  def path_id(self) -> int:
+    ids = self.ids
+    for segment in self.elements[len(ids):]:
+      parent = ids[-1] if ids else model.PathTable.ROOT
+      # Nameless (lambdas): the children hang off of the parent's path
+      ids.append(parent if segment is None else self.paths.child(parent, segment))
+    return ids[-1]
+
+
+class ParsingEngine(Enum):
+  # parse_node -> parse_children -> parse_node...
+  Recursive = "Recursive"
+  # An explicit work stack, no recursion limit
+  Iterative = "Iterative"
+
+
+class ParsingOptions(model.BaseModel):
+  engine: ParsingEngine = ParsingEngine.Recursive
+  # Run pydantic validation on every node we build. Slow, but useful when debugging the parsers.
+  validate_nodes: bool = False
+  # Leave function and lambda bodies unparsed until something walks into them (see model.Function.expand)
+  lazy_bodies: bool = False
+  # Freeze every scope once its block is done, for the lazy bodies that resolve names in them later
+  freeze_scopes: bool = False
+  # Check the parsed project (see validation.TreeValidator). Turn it off when speed matters more.
+  validate_tree: bool = True
+  # Fail on nodes sharing a project_unique_path, instead of warning (real code defines things twice...)
+  unique_paths: bool = False
+  
+  # The options that change the parsed (and cached, see ParseCache) modules: unexpanded bodies, frozen
+  # scopes, validated pydantic objects. Both engines build the same modules, and the checks don't change them.
+  FINGERPRINTED: ClassVar[List[str]] = ["lazy_bodies", "freeze_scopes", "validate_nodes"]
+
+  def fingerprint(self) -> str:
+    return ",".join(f"{name}={getattr(self, name)}" for name in self.FINGERPRINTED)
+
+  model_config = pydantic.ConfigDict(use_enum_values=False)
+
+
+class BodySource:
+  """
+  What the bodies lazy_bodies deferred in a module get parsed from later, shared by all of them: the source,
+  and the module's scope table and keys (see ScopeStack.keys). Each body itself only keeps where it is
+  (see parsing.DeferredBody).
+  """
+  __slots__ = ("module_path", "source_lines", "parsing_strategy", "options", "table", "keys")
+
+  module_path: str
+  source_lines: List[str]
+  parsing_strategy: ParsingStrategy
+  options: ParsingOptions
+  table: List[model.Scope]
+  keys: List[Tuple[int, ...]]
+
+  def __init__(self, module_path: str, source_lines: List[str], parsing_strategy: ParsingStrategy, options: ParsingOptions, table: List[model.Scope], keys: List[Tuple[int, ...]]):
+    self.module_path = module_path
+    self.source_lines = source_lines
+    self.parsing_strategy = parsing_strategy
+    self.options = options
+    self.table = table
+    self.keys = keys
+
+
 class ParsingState:
   module_path: str
   codes: CodeStack
   scopes: ScopeStack
-  detailed_paths: PathStack
+  detailed_paths: NodePathStack
   referencable_paths: PathStack
   parsing_strategy: ParsingStrategy
+  decisions: DecisionTable
+  options: ParsingOptions
   
-  def __init__(self, module_path: str, codes: CodeStack, scopes: ScopeStack, detailed_paths: PathStack, referencable_paths: PathStack, parsing_strategy: ParsingStrategy):
+  # Only kept around for lazy_bodies, to re-parse the bodies from
+  source_lines: Optional[List[str]]
+  # Made by the first body that gets deferred, see body_source
+  bodies: Optional[BodySource]
+  
+  def __init__(self, module_path: str, codes: CodeStack, scopes: ScopeStack, detailed_paths: NodePathStack, referencable_paths: PathStack, parsing_strategy: ParsingStrategy, options: ParsingOptions, source_lines: Optional[List[str]] = None, bodies: Optional[BodySource] = None):
     self.module_path = module_path
     self.codes = codes
     self.scopes = scopes
     self.detailed_paths = detailed_paths
     self.referencable_paths = referencable_paths
     self.parsing_strategy = parsing_strategy
+    self.decisions = parsing_strategy.compile()
+    self.options = options
+    self.source_lines = source_lines
+    self.bodies = bodies
   
-  # TODO: (maybe) this thing should never have a None in it
-  def create_id(self) -> str:
-    assert all(s is not None for s in self.detailed_paths.elements)
-    return ".".join(s for s in self.detailed_paths.elements if s is not None)
+  @property
+  def paths(self) -> model.PathTable:
+    return self.detailed_paths.paths
+
+  def create_id(self) -> model.NodePath:
+    return model.NodePath(self.paths, self.detailed_paths.path_id())
   
   def fully_qualify(self) -> Optional[str]:
     if any(s is None for s in self.referencable_paths.elements):
       return None
     return ".".join(s for s in self.referencable_paths.elements if s is not None)
 
+  def body_source(self) -> BodySource:
+    # Not before the module is built: validation copies the scope table.
+    if self.bodies is None:
+      assert self.source_lines is not None
+      self.bodies = BodySource(
+        module_path=self.module_path,
+        source_lines=self.source_lines,
+        parsing_strategy=self.parsing_strategy,
+        options=self.options,
+        table=self.scopes.table,
+        keys=self.scopes.keys,
+      )
+    return self.bodies
+
+  @classmethod
+  def resume(cls, bodies: BodySource, function: model.Function, scope_key: Tuple[int, ...]) -> "ParsingState":
+    """
+    Where the parse was when it deferred function's body, rebuilt from the function: the scopes are its scope
+    and the ones above it, and below it only its path id and fully qualified name matter.
+    """
+    scopes: List[model.Scope] = []
+    scope: Optional[model.Scope] = function.scope
+    while scope is not None:
+      scopes.append(scope)
+      scope = scope.parent
+    scopes.reverse()
+    return cls(
+      module_path=bodies.module_path,
+      codes=CodeStack([function]),
+      scopes=ScopeStack(scopes, freeze_on_pop=bodies.options.freeze_scopes, table=bodies.table, keys=bodies.keys, prefix=scope_key),
+      detailed_paths=NodePathStack(function.path.table, [function.name], [function.path.id]),
+      referencable_paths=PathStack([function.fully_qualified_name]),
+      parsing_strategy=bodies.parsing_strategy,
+      options=bodies.options,
+      source_lines=bodies.source_lines,
+      bodies=bodies,
+    )
+
   def assert_empty(self) -> None:
     assert len(self.codes.elements) == 0
     assert len(self.scopes.elements) == 0
@@ -103,12 +302,16 @@ class ParsingState:
     assert len(self.referencable_paths.elements) == 0
   
   @classmethod
-  def create(cls, module_path: str, parsing_strategy: ParsingStrategy) -> "ParsingState":
+  def create(cls, module_path: str, parsing_strategy: ParsingStrategy, options: Optional[ParsingOptions] = None, source: Optional[str] = None) -> "ParsingState":
+    options = options or ParsingOptions()
     return cls(
       module_path=module_path,
       codes=CodeStack(),
-      scopes=ScopeStack(),
-      detailed_paths=PathStack(),
+      scopes=ScopeStack(freeze_on_pop=options.freeze_scopes),
+      detailed_paths=NodePathStack(model.PathTable()),
       referencable_paths=PathStack(),
       parsing_strategy=parsing_strategy,
+      options=options,
+      # Split on "\n" only, like the ast's line numbers (str.splitlines would also split on form feeds and such)
+      source_lines=io.StringIO(source).readlines() if source is not None and options.lazy_bodies else None,
     )
\ No newline at end of file
@@ -3,6 +3,7 @@
 
 from typing import Any, List, Optional, Dict, Set, Tuple, Type, TypeVar, Callable, Generic
 import ast
+import hashlib
 import os
 import typing
 from contextlib import contextmanager
@@ -49,11 +50,29 @@ class PushRule(pydantic.BaseModel):
     if self.classes_cache is None:
       assert self.values is not None
       self.classes_cache = set(
-        eval(value) for value in self.values
+        getattr(ast, value[len("ast."):]) for value in self.values
         if value.startswith("ast.") and "." not in value[len("ast."):]
       )
     return self.classes_cache
   
+  def depends_only_on_class(self) -> bool:
+    return self.rule_type in (PushRuleType.IsInstance, PushRuleType.IsClassName, PushRuleType.Any)
+  
+  def apply_rule_to_class(self, node_class: Type) -> PushCheckResultType:
+    """Same as apply_rule, for rules where depends_only_on_class() is true."""
+    if self.rule_type == PushRuleType.IsInstance:
+      if issubclass(node_class, tuple(self.get_classes_cache())):
+        return self.result_type
+      return PushCheckResultType.Continue
+    elif self.rule_type == PushRuleType.IsClassName:
+      assert self.values is not None
+      if node_class.__name__ in self.values:
+        return self.result_type
+      return PushCheckResultType.Continue
+    elif self.rule_type == PushRuleType.Any:
+      return self.result_type
+    raise Exception(f"Unknown rule type {self.rule_type}")
+  
   def apply_rule(self, node: ast.AST) -> PushCheckResultType:
     if self.rule_type == PushRuleType.IsInstance:
       for type_ in self.get_classes_cache():
@@ -69,40 +88,79 @@ class PushRule(pydantic.BaseModel):
       return self.result_type
     raise Exception(f"Unknown rule type {self.rule_type}")
 
+  def fingerprint(self) -> str:
+    values = "" if self.values is None else ",".join(sorted(self.values))
+    return f"{self.rule_type.value}:{self.result_type.value}:{values}"
+
 
 class ParsingStrategy(model.BaseModel):
   # TODO: now that parse_node return an Optional, we could have a ignore instead of descend into
   rules: List[PushRule]
   
-  def should_push(self, node: ast.AST) -> bool:
+  def fingerprint(self) -> str:
+    return hashlib.sha256(
+      "\n".join(rule.fingerprint() for rule in self.rules).encode()
+    ).hexdigest()
+  
+  _table: Optional["DecisionTable"] = pydantic.PrivateAttr(default=None)
+  
+  @classmethod
+  def to_decision(cls, result: PushCheckResultType) -> Tuple[bool, bool]:
+    if result == PushCheckResultType.Prune:
+      return False, False
+    elif result == PushCheckResultType.Descend:
+      return False, True
+    elif result == PushCheckResultType.Push:
+      return True, True
+    raise Exception(f"Unknown result type {result}")
+  
+  def decide_by_rules(self, node: ast.AST) -> Tuple[bool, bool]:
     for rule in self.rules:
       result = rule.apply_rule(node)
       if result == PushCheckResultType.Continue:
         continue
-      elif result == PushCheckResultType.Prune:
-        return False
-      elif result == PushCheckResultType.Descend:
-        return False
-      elif result == PushCheckResultType.Push:
-        return True
-      else:
-        raise Exception(f"Unknown result type {result}")
+      return self.to_decision(result)
     raise Exception(f"Could not find a rule for {node}")
   
-  def should_descend_into(self, node: ast.AST) -> bool:
+  def decide_for_class(self, node_class: Type) -> Tuple[bool, bool]:
     for rule in self.rules:
-      result = rule.apply_rule(node)
+      result = rule.apply_rule_to_class(node_class)
       if result == PushCheckResultType.Continue:
         continue
-      elif result == PushCheckResultType.Prune:
-        return False
-      elif result == PushCheckResultType.Descend:
-        return True
-      elif result == PushCheckResultType.Push:
-        return True
-      else:
-        raise Exception(f"Unknown result type {result}")
-    raise Exception(f"Could not find a rule for {node}")
+      return self.to_decision(result)
+    raise Exception(f"Could not find a rule for {node_class}")
+  
+  def compile_decisions(self) -> Optional[Dict[Type, Tuple[bool, bool]]]:
+    """
+    Every rule we have only looks at the node's class, so the answers can be computed once per ast class.
+    Returns None (and we fall back to walking the rules) if some rule needs to look at the node itself.
+    """
+    if not all(rule.depends_only_on_class() for rule in self.rules):
+      return None
+    decisions: Dict[Type, Tuple[bool, bool]] = {}
+    classes: List[Type] = [ast.AST]
+    while classes:
+      node_class = classes.pop()
+      if node_class in decisions:
+        continue
+      try:
+        decisions[node_class] = self.decide_for_class(node_class)
+      except Exception:
+        # No rule matches this one, let decide() raise if we actually see it.
+        pass
+      classes.extend(node_class.__subclasses__())
+    return decisions
+  
+  def compile(self) -> "DecisionTable":
+    if self._table is None:
+      self._table = DecisionTable(strategy=self, decisions=self.compile_decisions())
+    return self._table
+  
+  def should_push(self, node: ast.AST) -> bool:
+    return self.compile().should_push(node)
+  
+  def should_descend_into(self, node: ast.AST) -> bool:
+    return self.compile().should_descend_into(node)
 
   @classmethod
   def create(cls) -> "ParsingStrategy":
@@ -125,3 +183,38 @@ class ParsingStrategy(model.BaseModel):
         )
       ]
     )
+
+
+
+class DecisionTable:
+  """
+  A ParsingStrategy compiled down to node class -> (push, descend).
+  
+  This is a plain class rather than a model because it sits on the hottest path in parsing,
+  and pydantic makes attribute access on models (especially private ones) comparatively slow.
+  """
+  strategy: ParsingStrategy
+  # None if some rule needs to look at more than the node's class
+  decisions: Optional[Dict[Type, Tuple[bool, bool]]]
+  
+  def __init__(self, strategy: ParsingStrategy, decisions: Optional[Dict[Type, Tuple[bool, bool]]]):
+    self.strategy = strategy
+    self.decisions = decisions
+  
+  def decide(self, node: ast.AST) -> Tuple[bool, bool]:
+    decisions = self.decisions
+    if decisions is None:
+      return self.strategy.decide_by_rules(node)
+    try:
+      return decisions[node.__class__]
+    except KeyError:
+      # A subclass we didn't know about at compile time.
+      decision = self.strategy.decide_for_class(node.__class__)
+      decisions[node.__class__] = decision
+      return decision
+  
+  def should_push(self, node: ast.AST) -> bool:
+    return self.decide(node)[0]
+  
+  def should_descend_into(self, node: ast.AST) -> bool:
+    return self.decide(node)[1]
@@ -0,0 +1,148 @@
+from typing import Dict, List, Optional, Pattern, Tuple
+import os
+import re
+
+
+class IgnorePatterns:
+  """
+  gitignore style patterns, compiled once into a few regexes (names vs paths, directories vs files).
+
+    venv          any file or directory called venv, at any depth
+    /build        build, only at the root
+    docs/*.py     anchored, because of the slash in the middle
+    **/gen/       any directory called gen
+    *.pyi         globs, ** crosses directories and * doesn't
+
+  Negated (!) patterns aren't supported: they make the answer depend on pattern order.
+  """
+  patterns: List[str]
+  # Patterns without a slash only ever look at the last component, so they don't need the whole path.
+  directory_names: Optional[Pattern[str]]
+  directory_paths: Optional[Pattern[str]]
+  file_names: Optional[Pattern[str]]
+  file_paths: Optional[Pattern[str]]
+
+  def __init__(self, patterns: List[str]):
+    self.patterns = list(patterns)
+    # (anchored, directory only) -> regexes
+    regexes: Dict[Tuple[bool, bool], List[str]] = {
+      (anchored, directory_only): [] for anchored in (False, True) for directory_only in (False, True)
+    }
+    for pattern in self.patterns:
+      compiled = self.compile_pattern(pattern)
+      if compiled is None:
+        continue
+      regex, anchored, directory_only = compiled
+      regexes[(anchored, directory_only)].append(regex)
+    self.directory_names = self.combine(regexes[(False, False)] + regexes[(False, True)])
+    self.directory_paths = self.combine(regexes[(True, False)] + regexes[(True, True)])
+    self.file_names = self.combine(regexes[(False, False)])
+    self.file_paths = self.combine(regexes[(True, False)])
+
+  @classmethod
+  def combine(cls, regexes: List[str]) -> Optional[Pattern[str]]:
+    if not regexes:
+      return None
+    return re.compile("|".join(f"(?:{regex})" for regex in regexes))
+
+  @classmethod
+  def compile_pattern(cls, pattern: str) -> Optional[Tuple[str, bool, bool]]:
+    pattern = pattern.strip()
+    if not pattern or pattern.startswith("#"):
+      return None
+    if pattern.startswith("!"):
+      raise ValueError(f"Negated ignore patterns are not supported: {pattern}")
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    return cls.translate(pattern), anchored, directory_only
+
+  @classmethod
+  def translate(cls, pattern: str) -> str:
+    regex = []
+    i = 0
+    while i < len(pattern):
+      if pattern.startswith("**/", i):
+        regex.append("(?:.*/)?")
+        i += 3
+      elif pattern.startswith("**", i):
+        regex.append(".*")
+        i += 2
+      elif pattern[i] == "*":
+        regex.append("[^/]*")
+        i += 1
+      elif pattern[i] == "?":
+        regex.append("[^/]")
+        i += 1
+      elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+        end = pattern.index("]", i + 1)
+        body = pattern[i + 1:end]
+        if body.startswith("!"):
+          body = "^" + body[1:]
+        regex.append(f"[{body}]")
+        i = end + 1
+      else:
+        regex.append(re.escape(pattern[i]))
+        i += 1
+    return "".join(regex)
+
+  @classmethod
+  def matches(cls, names: Optional[Pattern[str]], paths: Optional[Pattern[str]], relative_path: str, name: str) -> bool:
+    if names is not None and names.fullmatch(name) is not None:
+      return True
+    return paths is not None and paths.fullmatch(relative_path) is not None
+
+  def ignores_directory(self, relative_path: str, name: str) -> bool:
+    return self.matches(self.directory_names, self.directory_paths, relative_path, name)
+
+  def ignores_file(self, relative_path: str, name: str) -> bool:
+    return self.matches(self.file_names, self.file_paths, relative_path, name)
+
+
+def walk_source_files(
+  root_path: str,
+  ignores: IgnorePatterns,
+  suffix: str = ".py",
+  max_file_size: Optional[int] = None,
+) -> List[str]:
+  """
+  Like os.walk (same order, symlinked directories aren't followed) but ignored directories are never
+  entered, and only what we need gets stat'ed.
+  """
+  file_paths = []
+  # (directory, path relative to root_path with "/" separators)
+  stack: List[Tuple[str, str]] = [(root_path, "")]
+  while stack:
+    directory, relative_directory = stack.pop()
+    subdirectories: List[Tuple[str, str]] = []
+    try:
+      entries = os.scandir(directory)
+    except OSError:
+      continue
+    with entries:
+      for entry in entries:
+        relative_path = f"{relative_directory}/{entry.name}" if relative_directory else entry.name
+        try:
+          is_directory = entry.is_dir()
+        except OSError:
+          continue
+        if is_directory:
+          if entry.is_symlink() or ignores.ignores_directory(relative_path, entry.name):
+            continue
+          subdirectories.append((entry.path, relative_path))
+          continue
+        if not entry.name.endswith(suffix) or ignores.ignores_file(relative_path, entry.name):
+          continue
+        if max_file_size is not None:
+          try:
+            size = entry.stat().st_size
+          except OSError:
+            # A dangling symlink
+            continue
+          if size > max_file_size:
+            continue
+        file_paths.append(entry.path)
+    subdirectories.reverse()
+    stack.extend(subdirectories)
+  return file_paths
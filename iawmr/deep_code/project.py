@@ -1,8 +1,21 @@
 from enum import Enum, auto
-from typing import Dict, Iterator, List, Optional, Set, Generator
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Generator, Tuple, TypeVar
 import pydantic
+import iawmr.deep_code.library as library
 import iawmr.deep_code.model as model
 from iawmr.deep_code.parsing.strategy import ParsingStrategy
+from iawmr.deep_code.queries import CallGraph
+from iawmr.deep_code.reports import ReportSink, ResolutionStats
+from iawmr.deep_code.scheduling import ImportGraph, WaveScheduler
+from iawmr.deep_code.symbols import ReferenceIndex, SymbolIndex, SymbolMatch
+
+
+R = TypeVar("R")
+
+
+# The enum lookups are slow for how often bind_reference runs.
+PREFIX = model.ResolutionKind.Prefix.value
+LIBRARY = model.ResolutionKind.Library.value
 
 
 class SourceDirectoryType(Enum):
@@ -20,8 +33,13 @@ class ProjectSpec(model.BaseModel):
   name: str
   sources: List[str]
   venv: Optional[str]
+  # gitignore style patterns (no negation), relative to each source directory
   ignores: List[str]
+  # Skip source files bigger than this many bytes (generated code, vendored blobs...)
+  max_file_size: Optional[int] = None
   parsing_strategy: ParsingStrategy
+  # Where the venv's library indexes are kept, defaults to LibraryIndexStore.default_directory()
+  library_index_dir: Optional[str] = None
 
 
 class Project(model.BaseModel):
@@ -29,46 +47,190 @@ class Project(model.BaseModel):
   sources: List[SourceDirectory]
   # Idk if this needs to be saved...
   unresolved_references: Optional[Set[str]] = None
+  # Signatures of what is installed in spec.venv
+  libraries: Optional[library.Libraries] = pydantic.Field(default=None, exclude=True)
+  # Built by every resolve_references (the modules may have changed since), kept up to date by replace_module
+  symbols: Optional[SymbolIndex] = pydantic.Field(default=None, exclude=True)
+  # Which references name what, for replace_module
+  references: Optional[ReferenceIndex] = pydantic.Field(default=None, exclude=True)
+  # From the last resolve_references
+  stats: Optional[ResolutionStats] = pydantic.Field(default=None, exclude=True)
+  # See call_graph
+  calls: Optional[CallGraph] = pydantic.Field(default=None, exclude=True)
+  # See import_graph
+  imports: Optional[ImportGraph] = pydantic.Field(default=None, exclude=True)
   
   def modules(self) -> Iterator[model.Module]:
     for source in self.sources:
       for module in source.modules.values():
         yield module
 
-  def resolve_references(self):
-    targets = {}
-    unresolved_references = set()
-    for module in self.modules():
-      for node, _ in module.all_nodes():
-        target = node.get_fully_qualified_name()
-        if not target:
-          continue
-        targets[target] = node
-    for module in self.modules():
-      for node, _ in module.all_nodes():
+  def resolve_references(self, include_bodies: bool = True, report: Optional[ReportSink] = None):
+    """
+    With include_bodies=False, function bodies that were left unparsed (lazy_bodies) stay that way,
+    so only what is defined/imported outside of them gets resolved.
+    """
+    modules = list(self.modules())
+    self.symbols = SymbolIndex.build(modules, include_bodies=include_bodies)
+    self.references = ReferenceIndex()
+    self.stats = ResolutionStats()
+    self.calls = None
+    # After symbols: building them expanded the bodies (with include_bodies), so the graph sees their imports.
+    self.imports = ImportGraph(modules)
+    self.unresolved_references = resolve_references(
+      modules=modules,
+      libraries=self.libraries,
+      include_bodies=include_bodies,
+      symbols=self.symbols,
+      references=self.references,
+      report=report,
+      stats=self.stats,
+      import_graph=self.imports,
+    )
+
+  def replace_module(self, module_path: str, module: model.Module, source: Optional[SourceDirectory] = None) -> int:
+    """
+    Puts module in the place of the one at module_path (in source, by default whichever has it, or the
+    first one), e.g. after its file changed. If the references were resolved already, only the new module's
+    references and the ones naming something either version of it defines get resolved again, and
+    unresolved_references is updated in place. Returns how many references that was.
+    """
+    if source is None:
+      source = next((source for source in self.sources if module_path in source.modules), self.sources[0])
+    old = source.modules.get(module_path)
+    source.modules[module_path] = module
+    self.calls = None
+    self.imports = None
+    if self.symbols is None or self.references is None:
+      return 0
+    include_bodies = self.symbols.include_bodies
+    if old is not None:
+      for node, _ in old.all_nodes(expand=include_bodies):
         for reference in node.references:
-          key = reference.fully_qualified_name
-          if key in targets:
-            reference.target = targets[key]
-          else:
-            unresolved_references.add(key)
-    self.unresolved_references = unresolved_references
-
-    with open("output.dir/summary.txt", "w") as f:
-      f.write("Targets:\n")
-      for key in targets.keys():
-        f.write(f"\t{key}\n")
-      f.write("Unresolved:\n")
-      for key in unresolved_references:
-        f.write(f"\t{key}\n")
-      f.write("Resolved:\n")
-      for module in self.modules():
-        for node, _ in module.all_nodes():
-          if not any(reference.target is not None for reference in node.references):
-            continue
-          f.write(f"\t{node.project_unique_path}\n")
-          for reference in node.references:
-            if reference.target:
-              f.write(f"\t\t({reference.reference_type})\t{reference.fully_qualified_name}\n")
-    
+          self.references.discard(reference)
+    changed = self.symbols.replace_module(None if old is None else old.get_fully_qualified_name(), module)
+    dependents = self.references.dependents(changed)
+    for reference in dependents:
+      self.references.discard(reference)
+      match, resolution = bind_reference(reference, self.symbols, self.libraries)
+      self.references.add(reference, match, resolution is not None)
+    count = len(dependents)
+    for node, _ in module.all_nodes(expand=include_bodies):
+      for reference in node.references:
+        match, resolution = bind_reference(reference, self.symbols, self.libraries)
+        self.references.add(reference, match, resolution is not None)
+        count += 1
+    return count
+
+  def call_graph(self) -> CallGraph:
+    """Built from the resolved references the first time it is asked for, until they change."""
+    if self.calls is None:
+      include_bodies = True if self.symbols is None else self.symbols.include_bodies
+      self.calls = CallGraph.build(self.modules(), include_bodies=include_bodies)
+    return self.calls
+
+  def import_graph(self) -> ImportGraph:
+    """Built by resolve_references (or the first time it is asked for), until a module gets replaced."""
+    if self.imports is None:
+      if self.symbols is None:
+        # Nothing expanded the lazy bodies yet.
+        for module in self.modules():
+          module.expand_all()
+      self.imports = ImportGraph(self.modules())
+    return self.imports
+
+  def process_modules(self, stage: Callable[[model.Module], R], jobs: int = 1, processes: bool = False) -> Dict[str, R]:
+    """stage(module) for every module, what they import first (see WaveScheduler), keyed by module name."""
+    return WaveScheduler.run(self.import_graph(), stage, jobs=jobs, processes=processes)
+
+
+def bind_reference(reference: Any, symbols: SymbolIndex, libraries: Optional[library.Libraries]) -> Tuple[SymbolMatch, Optional[str]]:
+  """
+  Points reference at the node (or library symbol) it names. Exact (and re-exported) names win, then the
+  libraries, then the longest prefix defined in the project (see SymbolIndex.resolve), and the reference
+  records which it was in its resolution. Returns the match, and that resolution (None if unresolved).
+  Whatever the reference was bound to before is dropped.
+  """
+  reference.target = None
+  reference.external_target = None
+  reference.resolution = None
+  match = symbols.resolve(reference.fully_qualified_name)
+  if match.resolution != PREFIX and match.target is not None:
+    reference.target = match.target
+    reference.resolution = match.resolution
+    return match, match.resolution
+  external_target = None if libraries is None else libraries.resolve(match.name)
+  if external_target is not None:
+    reference.external_target = external_target
+    reference.resolution = LIBRARY
+    return match, LIBRARY
+  if match.target is not None:
+    reference.target = match.target
+    reference.resolution = match.resolution
+    return match, match.resolution
+  return match, None
+
+
+def resolve_references(
+  modules: List[Any],
+  libraries: Optional[library.Libraries],
+  include_bodies: bool = True,
+  symbols: Optional[SymbolIndex] = None,
+  references: Optional[ReferenceIndex] = None,
+  report: Optional[ReportSink] = None,
+  stats: Optional[ResolutionStats] = None,
+  import_graph: Optional[ImportGraph] = None,
+) -> Set[str]:
+  """
+  Points every reference at the node (or library symbol) it names (see bind_reference), returns the names
+  that are neither. modules can be model.Modules or anything that quacks like one (see compact.NodeView).
+  With references, they're indexed there too (and the names returned are its unresolved_references).
+
+  It is the one pass over the nodes (besides building symbols, when it isn't given): stats get counted
+  along the way, and report (if any) is written as it goes. With import_graph (of modules), the modules
+  are bound a wave at a time, what they import first (see WaveScheduler), so the report follows the imports.
+  """
+  if symbols is None:
+    symbols = SymbolIndex.build(modules, include_bodies=include_bodies)
+  unresolved_references = set() if references is None else references.unresolved_references
+  if report is not None:
+    report.targets(symbols)
+  nodes = 0
+  # Resolution -> how many references got it (None: unresolved)
+  counts: Dict[Optional[str], int] = {}
+
+  def resolve_module(module: Any) -> None:
+    nonlocal nodes
+    for node, _ in module.all_nodes(expand=include_bodies):
+      nodes += 1
+      has_target = False
+      for reference in node.references:
+        match, resolution = bind_reference(reference, symbols, libraries)
+        counts[resolution] = counts.get(resolution, 0) + 1
+        if references is not None:
+          references.add(reference, match, resolution is not None)
+        elif resolution is None:
+          unresolved_references.add(reference.fully_qualified_name)
+        if resolution is not None and resolution != LIBRARY:
+          has_target = True
+      if has_target and report is not None:
+        report.node(node)
+
+  if import_graph is None:
+    for module in modules:
+      resolve_module(module)
+  else:
+    # One job: every module writes into the same indexes, counts and report.
+    WaveScheduler.run(import_graph, resolve_module)
 
+  if stats is None and report is not None:
+    stats = ResolutionStats()
+  if stats is not None:
+    stats.nodes = nodes
+    stats.references = sum(counts.values())
+    stats.unresolved = counts.pop(None, 0)
+    stats.resolutions = {resolution: count for resolution, count in counts.items() if resolution is not None}
+  if report is not None:
+    assert stats is not None
+    report.close(unresolved_references, stats)
+  return unresolved_references
@@ -0,0 +1,242 @@
+from array import array
+from collections import OrderedDict, deque
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class Traversal(Enum):
+  BreadthFirst = "bfs"
+  DepthFirst = "dfs"
+
+
+class Adjacency:
+  """Compressed rows: the edges of vertex v are targets[offsets[v]:offsets[v + 1]] (and their kinds)."""
+  offsets: array
+  targets: array
+  kinds: array
+
+  def __init__(self, vertex_count: int, sources: array, targets: array, kinds: array):
+    # Counting sort of the edges by source.
+    counts = array("i", [0]) * (vertex_count + 1)
+    for source in sources:
+      counts[source + 1] += 1
+    for vertex in range(vertex_count):
+      counts[vertex + 1] += counts[vertex]
+    self.offsets = array("i", counts)
+    self.targets = array("i", [0]) * len(targets)
+    self.kinds = array("b", [0]) * len(kinds)
+    for source, target, kind in zip(sources, targets, kinds):
+      edge = counts[source]
+      counts[source] = edge + 1
+      self.targets[edge] = target
+      self.kinds[edge] = kind
+
+  def neighbors(self, vertex: int) -> array:
+    return self.targets[self.offsets[vertex]:self.offsets[vertex + 1]]
+
+  def edges(self, vertex: int) -> Iterable[Tuple[int, int]]:
+    """(target, kind) pairs."""
+    start = self.offsets[vertex]
+    end = self.offsets[vertex + 1]
+    return zip(self.targets[start:end], self.kinds[start:end])
+
+
+class CallGraph:
+  """
+  Who references whom, between definitions (modules, classes and functions, by fully qualified name) and
+  the library symbols they use. A reference counts for the innermost definition it is in: the call in
+  pkg.mod.f's body is an edge pkg.mod.f -> the callee, with the reference_type as the edge's kind.
+
+  The edges are kept as compressed rows both ways (callees and callers), and closures get cached, so
+  queries don't have to touch the model (or networkx) again. Built from resolved references, so it
+  needs rebuilding after the next resolve_references (see Project.call_graph).
+  """
+  # How many closures to keep (least recently used are dropped)
+  CLOSURE_CACHE_SIZE = 1024
+  IMPORT_KINDS = ("import", "import_from")
+
+  names: List[str]
+  ids: Dict[str, int]
+  # Per vertex, the vertex of the module it is defined in (-1 for library symbols), and per module
+  # vertex, the vertices of its definitions (itself included).
+  modules: array
+  definitions: Dict[int, array]
+  # reference_type of each edge kind
+  kinds: List[str]
+  forward: Adjacency
+  reverse: Adjacency
+  closures: "OrderedDict[Tuple[int, Optional[int], bool, Traversal, Optional[frozenset]], Dict[int, int]]"
+
+  def __init__(self):
+    self.names = []
+    self.ids = {}
+    self.modules = array("i")
+    self.definitions = {}
+    self.kinds = []
+    self.closures = OrderedDict()
+
+  def _vertex(self, name: str, module: int) -> int:
+    vertex = self.ids.get(name)
+    if vertex is None:
+      vertex = self.ids[name] = len(self.names)
+      self.names.append(name)
+      self.modules.append(module)
+    return vertex
+
+  @classmethod
+  def build(cls, modules: Iterable[Any], include_bodies: bool = True) -> "CallGraph":
+    """modules are model.Modules or compact.NodeViews of them, with their references resolved."""
+    ret = cls()
+    kind_ids: Dict[str, int] = {}
+    # (source, target name or library symbol, kind), the targets might not have a vertex yet.
+    references: List[Tuple[int, str, int]] = []
+    for module in modules:
+      module_vertex = -1
+      # id(scope) -> the vertex of the definition it belongs to
+      owners: Dict[int, int] = {}
+      for node, scope in module.all_nodes(expand=include_bodies):
+        owner = owners.get(id(scope))
+        if owner is None:
+          name = node.get_fully_qualified_name()
+          if name:
+            owner = ret._vertex(name, module_vertex)
+            if module_vertex < 0:
+              module_vertex = owner
+              ret.modules[owner] = owner
+              ret.definitions[module_vertex] = array("i")
+            ret.definitions[module_vertex].append(owner)
+          else:
+            # Nameless (lambdas): it's in the enclosing definition.
+            parent = scope.parent
+            while owner is None and parent is not None:
+              owner = owners.get(id(parent))
+              parent = parent.parent
+            owner = module_vertex if owner is None else owner
+          owners[id(scope)] = owner
+        for reference in node.references:
+          target = reference.target
+          if target is not None:
+            target_name = target.get_fully_qualified_name()
+          else:
+            target_name = reference.external_target
+          if target_name is None:
+            continue
+          kind = kind_ids.get(reference.reference_type)
+          if kind is None:
+            kind = kind_ids[reference.reference_type] = len(ret.kinds)
+            ret.kinds.append(reference.reference_type)
+          references.append((owner, target_name, kind))
+
+    edges = set()
+    for source, target_name, kind in references:
+      edges.add((source, ret._vertex(target_name, -1), kind))
+    sources = array("i")
+    targets = array("i")
+    kinds = array("b")
+    for source, target, kind in sorted(edges):
+      sources.append(source)
+      targets.append(target)
+      kinds.append(kind)
+    ret.forward = Adjacency(len(ret.names), sources, targets, kinds)
+    ret.reverse = Adjacency(len(ret.names), targets, sources, kinds)
+    return ret
+
+  def _kind_ids(self, kinds: Optional[Iterable[str]]) -> Optional[frozenset]:
+    if kinds is None:
+      return None
+    return frozenset(index for index, kind in enumerate(self.kinds) if kind in kinds)
+
+  def _neighbors(self, vertex: int, reverse: bool, kinds: Optional[frozenset]) -> Iterable[int]:
+    adjacency = self.reverse if reverse else self.forward
+    if kinds is None:
+      return adjacency.neighbors(vertex)
+    return (target for target, kind in adjacency.edges(vertex) if kind in kinds)
+
+  def callees(self, name: str, kinds: Optional[Iterable[str]] = None) -> List[str]:
+    """What name references directly (only the given reference_types, if any)."""
+    vertex = self.ids.get(name)
+    if vertex is None:
+      return []
+    # Once each, even if it's referenced more than one way.
+    return [self.names[target] for target in dict.fromkeys(self._neighbors(vertex, False, self._kind_ids(kinds)))]
+
+  def callers(self, name: str, kinds: Optional[Iterable[str]] = None) -> List[str]:
+    """Who references name directly (only the given reference_types, if any)."""
+    vertex = self.ids.get(name)
+    if vertex is None:
+      return []
+    return [self.names[source] for source in dict.fromkeys(self._neighbors(vertex, True, self._kind_ids(kinds)))]
+
+  def closure(
+    self,
+    vertex: int,
+    depth: Optional[int] = None,
+    reverse: bool = False,
+    traversal: Traversal = Traversal.BreadthFirst,
+    kinds: Optional[frozenset] = None,
+  ) -> Dict[int, int]:
+    """
+    Every vertex reachable from vertex in at most depth edges (reverse: that reach it), and how many
+    edges it takes. Don't change the result, it is cached.
+    """
+    key = (vertex, depth, reverse, traversal, kinds)
+    found = self.closures.get(key)
+    if found is not None:
+      self.closures.move_to_end(key)
+      return found
+    found = {vertex: 0}
+    pending = deque([vertex])
+    pop = pending.popleft if traversal == Traversal.BreadthFirst else pending.pop
+    while pending:
+      current = pop()
+      distance = found[current] + 1
+      if depth is not None and distance > depth:
+        continue
+      for neighbor in self._neighbors(current, reverse, kinds):
+        # Depth first can find a shorter way later, which matters with a depth.
+        previous = found.get(neighbor)
+        if previous is None or previous > distance:
+          found[neighbor] = distance
+          pending.append(neighbor)
+    self.closures[key] = found
+    if len(self.closures) > self.CLOSURE_CACHE_SIZE:
+      self.closures.popitem(last=False)
+    return found
+
+  def reachable(
+    self,
+    name: str,
+    depth: Optional[int] = None,
+    reverse: bool = False,
+    traversal: Traversal = Traversal.BreadthFirst,
+    kinds: Optional[Iterable[str]] = None,
+  ) -> Dict[str, int]:
+    """
+    What name transitively references (reverse: what transitively references it), within depth edges,
+    and how many edges away each is. name itself is included, at 0.
+    """
+    vertex = self.ids.get(name)
+    if vertex is None:
+      return {}
+    found = self.closure(vertex, depth=depth, reverse=reverse, traversal=traversal, kinds=self._kind_ids(kinds))
+    return {self.names[vertex]: distance for vertex, distance in found.items()}
+
+  def importers(self, module_name: str) -> List[str]:
+    """The other modules that import module_name, or something defined in it."""
+    module = self.ids.get(module_name)
+    if module is None or module not in self.definitions:
+      return []
+    kinds = self._kind_ids(self.IMPORT_KINDS)
+    importers = set()
+    for vertex in self.definitions[module]:
+      for source in self._neighbors(vertex, True, kinds):
+        importer = self.modules[source]
+        if importer != module:
+          importers.add(importer)
+    return sorted(self.names[importer] for importer in importers)
+
+  def import_fan_in(self, module_name: str) -> int:
+    return len(self.importers(module_name))
+
+  def __len__(self) -> int:
+    return len(self.names)
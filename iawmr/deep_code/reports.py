@@ -0,0 +1,124 @@
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Any, Dict, Iterable, Optional, TextIO
+import json
+import os
+
+import iawmr.deep_code.model as model
+from iawmr.deep_code.symbols import SymbolIndex
+
+
+class ReportFormat(Enum):
+  Nothing = "none"
+  Text = "text"
+  Jsonl = "jsonl"
+
+
+class ResolutionStats(model.BaseModel):
+  nodes: int = 0
+  references: int = 0
+  unresolved: int = 0
+  # model.ResolutionKind value -> how many references were resolved that way
+  resolutions: Dict[str, int] = {}
+
+
+class ReportSink(ABC):
+  """
+  Gets told what resolve_references does as it goes, and writes it out as it gets it (nothing is kept).
+  In order: targets once, node for every node that got a reference resolved, then close.
+  """
+  SUFFIX = ""
+
+  @classmethod
+  def create(cls, report_format: ReportFormat, path: Optional[str] = None) -> Optional["ReportSink"]:
+    """path defaults to output.dir/summary with the format's suffix."""
+    if report_format == ReportFormat.Nothing:
+      return None
+    sink_class = TextReport if report_format == ReportFormat.Text else JsonlReport
+    path = path or "output.dir/summary" + sink_class.SUFFIX
+    # The report gets opened before anything else has written to output.dir.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return sink_class(path)
+
+  @abstractmethod
+  def targets(self, symbols: SymbolIndex) -> None:
+    pass
+
+  @abstractmethod
+  def node(self, node: Any) -> None:
+    pass
+
+  @abstractmethod
+  def close(self, unresolved_references: Iterable[str], stats: ResolutionStats) -> None:
+    pass
+
+
+class TextReport(ReportSink):
+  """What used to be output.dir/summary.txt: Targets, Resolved (by node), Unresolved, and the stats."""
+  SUFFIX = ".txt"
+
+  f: TextIO
+
+  def __init__(self, path: str):
+    self.f = open(path, "w")
+
+  def targets(self, symbols: SymbolIndex) -> None:
+    self.f.write("Targets:\n")
+    for key, _ in symbols.prefix():
+      self.f.write(f"\t{key}\n")
+    self.f.write("Resolved:\n")
+
+  def node(self, node: Any) -> None:
+    self.f.write(f"\t{node.project_unique_path}\n")
+    for reference in node.references:
+      if reference.target is not None:
+        self.f.write(f"\t\t({reference.reference_type}, {reference.resolution})\t{reference.fully_qualified_name}\n")
+
+  def close(self, unresolved_references: Iterable[str], stats: ResolutionStats) -> None:
+    self.f.write("Unresolved:\n")
+    for key in unresolved_references:
+      self.f.write(f"\t{key}\n")
+    self.f.write("Stats:\n")
+    for key, value in stats.model_dump().items():
+      self.f.write(f"\t{key}: {value}\n")
+    self.f.close()
+
+
+class JsonlReport(ReportSink):
+  """The same, one json object per line, each with a "kind": target, node, unresolved or stats."""
+  SUFFIX = ".jsonl"
+
+  f: TextIO
+
+  def __init__(self, path: str):
+    self.f = open(path, "w")
+
+  def write(self, line: Dict[str, Any]) -> None:
+    self.f.write(json.dumps(line))
+    self.f.write("\n")
+
+  def targets(self, symbols: SymbolIndex) -> None:
+    for key, _ in symbols.prefix():
+      self.write({"kind": "target", "name": key})
+
+  def node(self, node: Any) -> None:
+    self.write({
+      "kind": "node",
+      "path": node.project_unique_path,
+      "references": [
+        {
+          "name": reference.fully_qualified_name,
+          "reference_type": reference.reference_type,
+          "resolution": reference.resolution,
+          "target": reference.target.project_unique_path,
+        }
+        for reference in node.references
+        if reference.target is not None
+      ],
+    })
+
+  def close(self, unresolved_references: Iterable[str], stats: ResolutionStats) -> None:
+    for key in unresolved_references:
+      self.write({"kind": "unresolved", "name": key})
+    self.write({"kind": "stats", **stats.model_dump()})
+    self.f.close()
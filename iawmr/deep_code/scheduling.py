@@ -0,0 +1,196 @@
+from array import array
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from iawmr.deep_code.symbols import SymbolIndex
+
+
+R = TypeVar("R")
+
+
+class ImportGraph:
+  """
+  Which of the project's modules import which, from the aliases the imports left in their scopes (so it
+  doesn't need resolve_references, or a walk over the nodes): an import names the longest module its name
+  starts with, and a package is its __init__ (from pkg.mod import f -> pkg.mod, import pkg -> pkg.__init__).
+  Function bodies that haven't been expanded (lazy_bodies) have no scopes yet, so their imports are missed.
+
+  Import cycles are its strongly connected components. Those are numbered dependencies first, and put
+  in waves: everything a component imports is in an earlier wave, so a wave's components can be
+  processed at the same time (see WaveScheduler).
+  """
+  names: List[str]
+  ids: Dict[str, int]
+  modules: List[Any]
+  # Per module, the other modules it imports / that import it
+  imports: List[List[int]]
+  importers: List[List[int]]
+  # Each a cycle (or a lone module), dependencies first
+  components: List[List[int]]
+  # Per module, its component
+  component_of: array
+  # Component indexes, see the class docs
+  waves: List[List[int]]
+
+  def __init__(self, modules: Iterable[Any]):
+    """modules are model.Modules or compact.NodeViews of them."""
+    self.modules = list(modules)
+    self.names = [module.get_fully_qualified_name() or "" for module in self.modules]
+    self.ids = {name: index for index, name in enumerate(self.names)}
+    self.imports = [[] for _ in self.modules]
+    self.importers = [[] for _ in self.modules]
+    for index, module in enumerate(self.modules):
+      imported: Dict[int, None] = {}
+      scopes = [module.scope]
+      while scopes:
+        scope = scopes.pop()
+        scopes.extend(scope.children.scopes)
+        for fully_qualified_name in scope.aliases.values():
+          target = self.module_of(fully_qualified_name)
+          if target is not None and target != index:
+            imported[target] = None
+      self.imports[index] = list(imported)
+      for target in imported:
+        self.importers[target].append(index)
+    self.components = self._strongly_connected_components()
+    self.component_of = array("i", [0]) * len(self.modules)
+    for component, members in enumerate(self.components):
+      for member in members:
+        self.component_of[member] = component
+    self.waves = self._waves()
+
+  def module_of(self, name: str) -> Optional[int]:
+    """The module an imported name is in, if it's one of the project's."""
+    while name:
+      index = self.ids.get(name)
+      if index is None:
+        index = self.ids.get(name + SymbolIndex.PACKAGE_SUFFIX)
+      if index is not None:
+        return index
+      name = name.rpartition(".")[0]
+    return None
+
+  def _strongly_connected_components(self) -> List[List[int]]:
+    """Tarjan's, without recursion (import chains can be deep). It finds them dependencies first."""
+    count = len(self.modules)
+    indexes = [-1] * count
+    lows = [0] * count
+    on_stack = [False] * count
+    stack: List[int] = []
+    components: List[List[int]] = []
+    counter = 0
+    for root in range(count):
+      if indexes[root] >= 0:
+        continue
+      # (module, how many of its imports were looked at)
+      work: List[Tuple[int, int]] = [(root, 0)]
+      while work:
+        module, edge = work.pop()
+        if edge == 0:
+          indexes[module] = lows[module] = counter
+          counter += 1
+          stack.append(module)
+          on_stack[module] = True
+        imports = self.imports[module]
+        descended = False
+        while edge < len(imports):
+          target = imports[edge]
+          edge += 1
+          if indexes[target] < 0:
+            work.append((module, edge))
+            work.append((target, 0))
+            descended = True
+            break
+          if on_stack[target]:
+            lows[module] = min(lows[module], indexes[target])
+        if descended:
+          continue
+        if lows[module] == indexes[module]:
+          component = []
+          while True:
+            member = stack.pop()
+            on_stack[member] = False
+            component.append(member)
+            if member == module:
+              break
+          components.append(component)
+        if work:
+          parent = work[-1][0]
+          lows[parent] = min(lows[parent], lows[module])
+    return components
+
+  def _waves(self) -> List[List[int]]:
+    component_waves = [0] * len(self.components)
+    waves: List[List[int]] = []
+    # Dependencies first, so theirs are known already.
+    for component, members in enumerate(self.components):
+      wave = 0
+      for member in members:
+        for target in self.imports[member]:
+          dependency = self.component_of[target]
+          if dependency != component:
+            wave = max(wave, component_waves[dependency] + 1)
+      component_waves[component] = wave
+      if wave == len(waves):
+        waves.append([])
+      waves[wave].append(component)
+    return waves
+
+  def cycles(self) -> List[List[str]]:
+    """The import cycles, as module names."""
+    return [[self.names[member] for member in members] for members in self.components if len(members) > 1]
+
+  def dependents(self, name: str) -> Set[str]:
+    """The modules that import name, directly or not: what needs redoing when it changes (name included)."""
+    index = self.ids.get(name)
+    if index is None:
+      return set()
+    found = {index}
+    pending = deque([index])
+    while pending:
+      for importer in self.importers[pending.popleft()]:
+        if importer not in found:
+          found.add(importer)
+          pending.append(importer)
+    return {self.names[module] for module in found}
+
+  def __len__(self) -> int:
+    return len(self.modules)
+
+
+class WaveScheduler:
+  """
+  Runs a per module stage over an ImportGraph, one wave after the other, with the components of a wave
+  spread over a worker pool (the modules of an import cycle go to the same worker, in one go).
+
+  Threads share the model, but only stages that let go of the GIL (I/O, numpy...) get faster with
+  them. Processes get copies of the modules (the stage, and what it returns, have to pickle), so they
+  are for stages that compute something from a module rather than change it.
+  """
+
+  @classmethod
+  def run_component(cls, stage: Callable[[Any], R], modules: List[Any]) -> List[R]:
+    return [stage(module) for module in modules]
+
+  @classmethod
+  def run(cls, graph: ImportGraph, stage: Callable[[Any], R], jobs: int = 1, processes: bool = False) -> Dict[str, R]:
+    """stage(module) for every module of graph, keyed by module name."""
+    results: Dict[str, R] = {}
+    if jobs <= 1:
+      for wave in graph.waves:
+        for component in wave:
+          for member in graph.components[component]:
+            results[graph.names[member]] = stage(graph.modules[member])
+      return results
+    executor: Executor = ProcessPoolExecutor(max_workers=jobs) if processes else ThreadPoolExecutor(max_workers=jobs)
+    with executor:
+      for wave in graph.waves:
+        futures = [
+          executor.submit(cls.run_component, stage, [graph.modules[member] for member in graph.components[component]])
+          for component in wave
+        ]
+        for component, future in zip(wave, futures):
+          for member, result in zip(graph.components[component], future.result()):
+            results[graph.names[member]] = result
+    return results
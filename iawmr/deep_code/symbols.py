@@ -0,0 +1,357 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import iawmr.deep_code.model as model
+
+
+# The enum lookups are slow for how often resolve() runs.
+EXACT = model.ResolutionKind.Exact.value
+RE_EXPORT = model.ResolutionKind.ReExport.value
+PREFIX = model.ResolutionKind.Prefix.value
+
+class SymbolNode:
+  """One segment of a qualified name: what is defined there, and/or what the name is an alias of."""
+  __slots__ = ("children", "target", "alias")
+
+  children: Dict[str, "SymbolNode"]
+  # The node defining the name (a model.AstNode or a compact.NodeView)
+  target: Any
+  # Re-exports: the qualified name this one stands for
+  alias: Optional[str]
+
+  def __init__(self):
+    self.children = {}
+    self.target = None
+    self.alias = None
+
+
+class SymbolMatch:
+  """What a name resolved to, how, and the name it got there by (after following re-exports)."""
+  __slots__ = ("target", "resolution", "name", "via")
+
+  target: Any
+  # A model.ResolutionKind value
+  resolution: Optional[str]
+  name: str
+  # The names it was re-exported through before name, the one it was looked up by first
+  via: Tuple[str, ...]
+
+  def __init__(self, target: Any, resolution: Optional[str], name: str, via: Tuple[str, ...] = ()):
+    self.target = target
+    self.resolution = resolution
+    self.name = name
+    self.via = via
+
+
+class SymbolIndex:
+  """
+  Every qualified name defined in the project, as a trie of their dotted segments, so looking a name up
+  (exactly, by its longest defined prefix, or everything under it) only costs its number of segments.
+
+  Besides the definitions, it knows the project's re-exports: what each module imports at module level
+  (pkg.api.Thing -> pkg._impl.Thing), and packages (pkg -> pkg.__init__).
+  """
+  # Re-exports of re-exports...
+  MAX_ALIAS_HOPS = 8
+  PACKAGE_SUFFIX = ".__init__"
+
+  root: SymbolNode
+  # The exact names too, most references are one of them
+  targets: Dict[str, Any]
+  # What it was built with (see Project.resolve_references)
+  include_bodies: bool
+  # Module name -> the names it defines
+  definitions: Dict[str, List[str]]
+  # Module name -> the re-exports it adds (name -> what it stands for)
+  re_exports: Dict[str, Dict[str, str]]
+
+  def __init__(self, include_bodies: bool = True):
+    self.root = SymbolNode()
+    self.targets = {}
+    self.include_bodies = include_bodies
+    self.definitions = {}
+    self.re_exports = {}
+
+  @classmethod
+  def build(cls, modules: List[Any], include_bodies: bool = True) -> "SymbolIndex":
+    """modules are model.Modules or compact.NodeViews of them."""
+    ret = cls(include_bodies=include_bodies)
+    for module in modules:
+      ret.add_module(module)
+    return ret
+
+  def add_module(self, module: Any) -> None:
+    module_name = module.get_fully_qualified_name()
+    definitions = []
+    for node, _ in module.all_nodes(expand=self.include_bodies):
+      name = node.get_fully_qualified_name()
+      if name:
+        self.add(name, node)
+        definitions.append(name)
+    if not module_name:
+      return
+    re_exports = {
+      f"{module_name}.{local_name}": fully_qualified_name
+      for local_name, fully_qualified_name in module.scope.aliases.items()
+    }
+    if module_name.endswith(self.PACKAGE_SUFFIX):
+      re_exports[module_name[:-len(self.PACKAGE_SUFFIX)]] = module_name
+    for name, fully_qualified_name in re_exports.items():
+      self.add_alias(name, fully_qualified_name)
+    self.definitions[module_name] = definitions
+    self.re_exports[module_name] = re_exports
+
+  def remove_module(self, module_name: str) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Forgets what the module defines and re-exports, and returns those. If another module defines the
+    same name, it is forgotten too (it was only ever reachable if that one was added last).
+    """
+    definitions = self.definitions.pop(module_name, [])
+    re_exports = self.re_exports.pop(module_name, {})
+    for name in definitions:
+      self.remove(name)
+    for name in re_exports:
+      node, _, _ = self._walk(name.split("."))
+      if node is not None:
+        node.alias = None
+    return definitions, re_exports
+
+  def replace_module(self, module_name: Optional[str], module: Any) -> Set[str]:
+    """
+    Swaps what module_name (None when module is new) defines for what module does, and returns the
+    names that could mean something else now: everything either one defines, and the re-exports that changed.
+    """
+    definitions, re_exports = self.remove_module(module_name) if module_name else ([], {})
+    self.add_module(module)
+    new_name = module.get_fully_qualified_name()
+    new_re_exports = self.re_exports.get(new_name, {})
+    changed = set(definitions)
+    changed.update(self.definitions.get(new_name, ()))
+    changed.update(
+      name
+      for name in re_exports.keys() | new_re_exports.keys()
+      if re_exports.get(name) != new_re_exports.get(name)
+    )
+    return changed
+
+  def _node(self, name: str) -> SymbolNode:
+    node = self.root
+    for segment in name.split("."):
+      child = node.children.get(segment)
+      if child is None:
+        child = node.children[segment] = SymbolNode()
+      node = child
+    return node
+
+  def add(self, name: str, target: Any) -> None:
+    # If they define it twice, the last one wins.
+    self._node(name).target = target
+    self.targets[name] = target
+
+  def remove(self, name: str) -> None:
+    node, _, _ = self._walk(name.split("."))
+    if node is not None:
+      node.target = None
+    self.targets.pop(name, None)
+
+  def add_alias(self, name: str, fully_qualified_name: str) -> None:
+    if name != fully_qualified_name:
+      self._node(name).alias = fully_qualified_name
+
+  def _walk(self, segments: List[str]) -> Tuple[Optional[SymbolNode], int, int]:
+    """The node for all of the segments (if any), and how many segments the deepest target/alias takes."""
+    node: Optional[SymbolNode] = self.root
+    deepest_target = 0
+    deepest_alias = 0
+    for depth, segment in enumerate(segments, start=1):
+      assert node is not None
+      node = node.children.get(segment)
+      if node is None:
+        break
+      if node.target is not None:
+        deepest_target = depth
+      if node.alias is not None:
+        deepest_alias = depth
+    return node, deepest_target, deepest_alias
+
+  def exact(self, name: str) -> Any:
+    return self.targets.get(name)
+
+  def longest_prefix(self, name: str) -> Optional[Tuple[str, Any]]:
+    """The longest prefix of name (name included) that is defined, and what defines it."""
+    segments = name.split(".")
+    _, depth, _ = self._walk(segments)
+    if not depth:
+      return None
+    prefix = ".".join(segments[:depth])
+    return prefix, self.exact(prefix)
+
+  def prefix(self, name: str = "") -> Iterator[Tuple[str, Any]]:
+    """Every defined name under name (name included), depth first."""
+    node: Optional[SymbolNode] = self.root
+    if name:
+      node, _, _ = self._walk(name.split("."))
+    if node is None:
+      return
+    stack: List[Tuple[str, SymbolNode]] = [(name, node)]
+    while stack:
+      path, node = stack.pop()
+      if node.target is not None:
+        yield path, node.target
+      for segment, child in reversed(list(node.children.items())):
+        stack.append((f"{path}.{segment}" if path else segment, child))
+
+  def resolve(self, name: str) -> SymbolMatch:
+    """
+    An exact definition, following re-exports if that's what it takes. Otherwise, the longest defined
+    prefix (pkg.mod.Class.method.__call__ -> pkg.mod.Class.method) with resolution Prefix, and the name
+    after the re-exports, for looking in the libraries.
+    """
+    target = self.targets.get(name)
+    if target is not None:
+      return SymbolMatch(target=target, resolution=EXACT, name=name)
+    resolution = EXACT
+    via: Tuple[str, ...] = ()
+    for _ in range(self.MAX_ALIAS_HOPS):
+      segments = name.split(".")
+      node, deepest_target, deepest_alias = self._walk(segments)
+      if node is not None and deepest_target == len(segments):
+        return SymbolMatch(target=node.target, resolution=resolution, name=name, via=via)
+      # The alias has to be more specific than the definition: pkg.mod.CONST.x is in pkg.mod, even if pkg is an alias.
+      if deepest_alias <= deepest_target:
+        break
+      alias_node, _, _ = self._walk(segments[:deepest_alias])
+      assert alias_node is not None and alias_node.alias is not None
+      via += (name,)
+      name = ".".join([alias_node.alias] + segments[deepest_alias:])
+      resolution = RE_EXPORT
+    else:
+      segments = name.split(".")
+      _, deepest_target, _ = self._walk(segments)
+    # Only the name it ended up as counts: mod.json.dumps is json.dumps, not something in mod.
+    if deepest_target:
+      return SymbolMatch(
+        target=self.exact(".".join(segments[:deepest_target])),
+        resolution=PREFIX,
+        name=name,
+        via=via,
+      )
+    return SymbolMatch(target=None, resolution=None, name=name, via=via)
+
+  def __len__(self) -> int:
+    return len(self.targets)
+
+
+class DependentNode:
+  """One segment of a name that references look up, and those references."""
+  __slots__ = ("children", "references")
+
+  children: Dict[str, "DependentNode"]
+  # id(reference) -> reference
+  references: Dict[int, Any]
+
+  def __init__(self):
+    self.children = {}
+    self.references = {}
+
+
+class ReferenceIndex:
+  """
+  The other way around from SymbolIndex: for every name the project's references look up (including the
+  names they were re-exported through), which references those are. And how many references are left
+  unresolved per name, so that Project.replace_module only has to re-resolve the references whose names
+  the replaced module defines, not every reference in the project.
+
+  References are kept by identity, so this is only for model.CodeReferences (compact.ReferenceViews are
+  created on the fly).
+  """
+  root: DependentNode
+  # The same nodes by name, most names are looked up over and over
+  nodes: Dict[str, DependentNode]
+  # id(reference) -> the nodes it is kept in
+  recorded: Dict[int, List[DependentNode]]
+  # How many references to each unresolved name there are
+  unresolved: Dict[str, int]
+  # The names in unresolved, kept in sync (this is the project's unresolved_references)
+  unresolved_references: Set[str]
+
+  def __init__(self):
+    self.root = DependentNode()
+    self.nodes = {}
+    self.recorded = {}
+    self.unresolved = {}
+    self.unresolved_references = set()
+
+  def _node(self, name: str) -> DependentNode:
+    node = self.nodes.get(name)
+    if node is not None:
+      return node
+    node = self.root
+    for segment in name.split("."):
+      child = node.children.get(segment)
+      if child is None:
+        child = node.children[segment] = DependentNode()
+      node = child
+    self.nodes[name] = node
+    return node
+
+  def add(self, reference: Any, match: SymbolMatch, resolved: bool) -> None:
+    """reference was just resolved to match (see project.bind_reference)."""
+    if match.via:
+      nodes = [self._node(name) for name in match.via]
+      nodes.append(self._node(match.name))
+    else:
+      nodes = [self._node(match.name)]
+    key = id(reference)
+    for node in nodes:
+      node.references[key] = reference
+    self.recorded[key] = nodes
+    if not resolved:
+      name = reference.fully_qualified_name
+      count = self.unresolved.get(name, 0)
+      self.unresolved[name] = count + 1
+      if not count:
+        self.unresolved_references.add(name)
+
+  def discard(self, reference: Any) -> None:
+    key = id(reference)
+    nodes = self.recorded.pop(key, None)
+    if nodes is None:
+      return
+    for node in nodes:
+      del node.references[key]
+    if reference.target is not None or reference.external_target is not None:
+      return
+    name = reference.fully_qualified_name
+    count = self.unresolved[name] - 1
+    if count:
+      self.unresolved[name] = count
+    else:
+      del self.unresolved[name]
+      self.unresolved_references.discard(name)
+
+  def dependents(self, names: Iterable[str]) -> List[Any]:
+    """The references that looked up one of names, or a name under one of them (pkg.mod -> pkg.mod.f), once each."""
+    found: Dict[int, Any] = {}
+    covered = None
+    # Sorted, a name comes right before the ones under it, which its subtree already has.
+    for name in sorted(names):
+      if covered is not None and name.startswith(covered):
+        continue
+      covered = name + "."
+      node: Optional[DependentNode] = self.root
+      for segment in name.split("."):
+        assert node is not None
+        node = node.children.get(segment)
+        if node is None:
+          break
+      if node is None:
+        continue
+      stack = [node]
+      while stack:
+        node = stack.pop()
+        found.update(node.references)
+        stack.extend(node.children.values())
+    return list(found.values())
+
+  def __len__(self) -> int:
+    return len(self.recorded)
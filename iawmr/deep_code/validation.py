@@ -0,0 +1,160 @@
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Tuple
+
+import iawmr.deep_code.model as model
+
+
+class ViolationType(Enum):
+  # A node with the same path as one of its ancestors
+  DescendantOfItself = "DescendantOfItself"
+  # Two nodes (anywhere in the project) with the same project_unique_path
+  DuplicatePath = "DuplicatePath"
+
+
+class TreeViolation(model.BaseModel):
+  violation_type: ViolationType
+  project_unique_path: str
+  # How many nodes have the path
+  count: int = 1
+
+  def __str__(self) -> str:
+    if self.violation_type == ViolationType.DescendantOfItself.value:
+      return f"Node {self.project_unique_path} is a child of itself."
+    return f"{self.count} nodes have the path {self.project_unique_path}."
+
+
+class TreeValidationError(Exception):
+  violations: List[TreeViolation]
+
+  def __init__(self, violations: List[TreeViolation]):
+    self.violations = violations
+    lines = [str(violation) for violation in violations[:20]]
+    if len(violations) > len(lines):
+      lines.append(f"... and {len(violations) - len(lines)} more")
+    super().__init__(f"{len(violations)} tree violations:\n" + "\n".join(lines))
+
+
+class ModuleCounts:
+  """How many nodes use each path id of one module's PathTable."""
+  name: str
+  paths: model.PathTable
+  counts: List[int]
+
+  def __init__(self, name: str, paths: model.PathTable):
+    self.name = name
+    self.paths = paths
+    self.counts = [0] * len(paths)
+
+
+class TreeValidator:
+  """
+  Checks, in one pass over every node, that no node is its own descendant and that project_unique_paths
+  are unique across the whole project. Add every module, then look at violations() (or call check()).
+
+  Paths are compared by id within a module. Across modules the paths can only collide when one module's
+  path is a prefix of another's (a.py next to a/), and only those modules get their paths spelled out.
+  Bodies that haven't been expanded (lazy_bodies) are not looked at.
+  """
+  modules: List[ModuleCounts]
+  by_table: Dict[int, ModuleCounts]
+  descendants_of_themselves: List[TreeViolation]
+
+  def __init__(self):
+    self.modules = []
+    self.by_table = {}
+    self.descendants_of_themselves = []
+
+  @classmethod
+  def children(cls, node: Any) -> Iterable[Any]:
+    children = node.children
+    for values in children.value_fields.values():
+      yield from values
+    for groups in children.list_fields.values():
+      for values in groups:
+        yield from values
+
+  def add_module(self, module: Any) -> None:
+    """module is a model.Module, or a compact.NodeView of one."""
+    paths = module.path.table
+    counts = self.by_table.get(id(paths))
+    if counts is None:
+      counts = self.by_table[id(paths)] = ModuleCounts(name=module.project_unique_path, paths=paths)
+      self.modules.append(counts)
+    # Lazy bodies might have added paths since.
+    if len(counts.counts) < len(paths):
+      counts.counts.extend([0] * (len(paths) - len(counts.counts)))
+    node_counts = counts.counts
+    on_stack = bytearray(len(paths))
+    # (node, whether we are leaving it)
+    stack: List[Tuple[Any, bool]] = [(module, False)]
+    while stack:
+      node, leaving = stack.pop()
+      path_id = node.path.id
+      if leaving:
+        on_stack[path_id] -= 1
+        continue
+      if on_stack[path_id]:
+        self.descendants_of_themselves.append(TreeViolation(
+          violation_type=ViolationType.DescendantOfItself,
+          project_unique_path=node.project_unique_path,
+        ))
+      node_counts[path_id] += 1
+      on_stack[path_id] += 1
+      stack.append((node, True))
+      children = list(self.children(node))
+      children.reverse()
+      stack.extend((child, False) for child in children)
+
+  def duplicates(self) -> List[TreeViolation]:
+    duplicates = []
+    for module in self.modules:
+      for path_id, count in enumerate(module.counts):
+        if count > 1:
+          duplicates.append(TreeViolation(
+            violation_type=ViolationType.DuplicatePath,
+            project_unique_path=module.paths.path(path_id),
+            count=count,
+          ))
+    # Modules whose paths could collide with another module's: a and a.b, but not a and ab
+    names = {module.name for module in self.modules}
+    colliding = set()
+    for name in names:
+      parts = name.split(".")
+      for end in range(1, len(parts)):
+        prefix = ".".join(parts[:end])
+        if prefix in names:
+          colliding.add(prefix)
+          colliding.add(name)
+    if colliding:
+      counts: Dict[str, int] = {}
+      for module in self.modules:
+        if module.name not in colliding:
+          continue
+        for path_id, count in enumerate(module.counts):
+          if count:
+            path = module.paths.path(path_id)
+            counts[path] = counts.get(path, 0) + count
+      already = {violation.project_unique_path for violation in duplicates}
+      for path, count in counts.items():
+        if count > 1 and path not in already:
+          duplicates.append(TreeViolation(violation_type=ViolationType.DuplicatePath, project_unique_path=path, count=count))
+    return duplicates
+
+  def violations(self, unique_paths: bool = True) -> List[TreeViolation]:
+    violations = list(self.descendants_of_themselves)
+    if unique_paths:
+      violations.extend(self.duplicates())
+    return violations
+
+  def check(self, unique_paths: bool = True) -> None:
+    violations = self.violations(unique_paths=unique_paths)
+    if violations:
+      raise TreeValidationError(violations)
+
+  @classmethod
+  def validate(cls, modules: Iterable[Any], unique_paths: bool = True) -> List[TreeViolation]:
+    validator = cls()
+    for module in modules:
+      validator.add_module(module)
+    return validator.violations(unique_paths=unique_paths)
+
@@ -0,0 +1,297 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from typing import Deque, Iterable, Iterator, List, Optional
+import os
+import struct
+import sys
+import time
+import warnings
+import zlib
+
+import numpy as np
+
+import iawmr.deep_code.model as model
+from iawmr.deep_code.graph import CodeGraph
+
+
+class WalkOptions(model.BaseModel):
+  walk_length: int = 80
+  # Walks starting at each node
+  num_walks: int = 10
+  # node2vec's return (p) and in-out (q) parameters: going back to the previous node weighs 1/p,
+  # going to one of its neighbors 1, going further away 1/q.
+  p: float = 1.0
+  q: float = 1.0
+  # Processes to walk with
+  jobs: int = 1
+  seed: int = 0
+  # Walks per task (each gets its own seed, so the walks don't depend on jobs)
+  batch_size: int = 16384
+  # Keep the walks done so far and stop, after this many seconds / once the walks would take this many bytes
+  max_seconds: Optional[float] = None
+  max_bytes: Optional[int] = None
+
+
+class RandomWalker:
+  """
+  node2vec's second order random walks, straight from a CodeGraph's rows, a batch of walks at a time.
+
+  Instead of precomputing the transition probabilities of every (previous, current) edge pair (what the
+  node2vec package does, in dicts), every step proposes a uniformly random neighbor and accepts it
+  with its weight over the biggest weight (rejection sampling), for all the walks of the batch at once.
+  """
+  offsets: np.ndarray
+  targets: np.ndarray
+  degrees: np.ndarray
+  # source * node_count + target for every edge: with the rows sorted by target, these are sorted too
+  keys: np.ndarray
+
+  def __init__(self, offsets: np.ndarray, targets: np.ndarray):
+    """Rows sorted by target (see CodeGraph)."""
+    self.offsets = offsets
+    self.targets = targets
+    self.degrees = np.diff(offsets)
+    sources = np.repeat(np.arange(self.node_count, dtype=np.int64), self.degrees)
+    self.keys = sources * self.node_count + targets
+
+  @classmethod
+  def from_graph(cls, graph: CodeGraph) -> "RandomWalker":
+    return cls(offsets=graph.offsets, targets=graph.targets)
+
+  @property
+  def node_count(self) -> int:
+    return len(self.offsets) - 1
+
+  def _uniform(self, current: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    starts = self.offsets[current]
+    return self.targets[starts + (rng.random(len(current)) * self.degrees[current]).astype(np.int64)]
+
+  def adjacent(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Whether each target is a neighbor of its source."""
+    if not len(self.keys):
+      return np.zeros(len(sources), dtype=bool)
+    keys = sources.astype(np.int64) * self.node_count + targets
+    found = np.searchsorted(self.keys, keys)
+    return self.keys[np.minimum(found, len(self.keys) - 1)] == keys
+
+  def _biased(self, current: np.ndarray, previous: np.ndarray, p: float, q: float, rng: np.random.Generator) -> np.ndarray:
+    chosen = np.empty(len(current), dtype=self.targets.dtype)
+    pending = np.arange(len(current))
+    upper = max(1 / p, 1.0, 1 / q)
+    lower = min(1 / p, 1.0, 1 / q)
+    while len(pending):
+      candidates = self._uniform(current[pending], rng)
+      before = previous[pending]
+      draws = rng.random(len(pending)) * upper
+      # Under every weight: no need to look the candidate up.
+      accepted = draws < lower
+      check = ~accepted
+      weights = np.where(
+        candidates[check] == before[check],
+        1 / p,
+        np.where(self.adjacent(before[check], candidates[check]), 1.0, 1 / q),
+      )
+      accepted[check] = draws[check] < weights
+      chosen[pending[accepted]] = candidates[accepted]
+      pending = pending[~accepted]
+    return chosen
+
+  def walk(self, starts: np.ndarray, walk_length: int, p: float, q: float, rng: np.random.Generator) -> np.ndarray:
+    """One walk per start, a row each. Walks that hit a node without edges stop there (padded with -1)."""
+    walks = np.full((len(starts), walk_length), -1, dtype=np.int32)
+    walks[:, 0] = starts
+    alive = np.arange(len(starts))
+    unbiased = p == 1 and q == 1
+    for step in range(1, walk_length):
+      alive = alive[self.degrees[walks[alive, step - 1]] > 0]
+      if not len(alive):
+        break
+      current = walks[alive, step - 1]
+      if step == 1 or unbiased:
+        walks[alive, step] = self._uniform(current, rng)
+      else:
+        walks[alive, step] = self._biased(current, walks[alive, step - 2], p, q, rng)
+    return walks
+
+
+# The process pool workers' walker, see RandomWalks.generate
+worker_walker: Optional[RandomWalker] = None
+
+
+def start_worker(offsets: np.ndarray, targets: np.ndarray) -> None:
+  global worker_walker
+  worker_walker = RandomWalker(offsets=offsets, targets=targets)
+
+
+def walk_batch(starts: np.ndarray, options: WalkOptions, seed: np.random.SeedSequence) -> np.ndarray:
+  assert worker_walker is not None
+  return worker_walker.walk(starts, options.walk_length, options.p, options.q, np.random.default_rng(seed))
+
+
+class RandomWalks:
+
+  @classmethod
+  def starts(cls, node_count: int, options: WalkOptions) -> np.ndarray:
+    """num_walks rounds over every node, each in its own random order."""
+    rng = np.random.default_rng(options.seed)
+    rounds = [rng.permutation(node_count).astype(np.int32) for _ in range(options.num_walks)]
+    return np.concatenate(rounds) if rounds else np.zeros(0, dtype=np.int32)
+
+  @classmethod
+  def chunks(cls, graph: CodeGraph, options: Optional[WalkOptions] = None) -> Iterator[np.ndarray]:
+    """
+    The walks, options.batch_size rows at a time (see RandomWalker.walk), in order. Only a few batches
+    are ever in memory (a couple per process). Over budget (options.max_seconds/max_bytes), it warns
+    and stops after the batches that were done.
+    """
+    options = options or WalkOptions()
+    walker = RandomWalker.from_graph(graph)
+    starts = cls.starts(walker.node_count, options)
+    if options.max_bytes is not None:
+      max_walks = options.max_bytes // (4 * options.walk_length)
+      if max_walks < len(starts):
+        warnings.warn(f"Only {max_walks} of {len(starts)} walks fit in {options.max_bytes} bytes")
+        starts = starts[:max_walks]
+    batches = [starts[start:start + options.batch_size] for start in range(0, len(starts), options.batch_size)]
+    seeds = np.random.SeedSequence(options.seed).spawn(len(batches))
+    deadline = None if options.max_seconds is None else time.monotonic() + options.max_seconds
+    done = 0
+    if options.jobs <= 1:
+      for batch, seed in zip(batches, seeds):
+        if deadline is not None and time.monotonic() > deadline:
+          break
+        yield walker.walk(batch, options.walk_length, options.p, options.q, np.random.default_rng(seed))
+        done += 1
+    else:
+      executor = ProcessPoolExecutor(max_workers=options.jobs, initializer=start_worker, initargs=(walker.offsets, walker.targets))
+      try:
+        pending = zip(batches, seeds)
+        futures: Deque[Future] = deque()
+        while True:
+          while len(futures) < 2 * options.jobs:
+            submitted = next(pending, None)
+            if submitted is None:
+              break
+            futures.append(executor.submit(walk_batch, submitted[0], options, submitted[1]))
+          if not futures:
+            break
+          timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+          try:
+            walks = futures.popleft().result(timeout=timeout)
+          except TimeoutError:
+            break
+          yield walks
+          done += 1
+      finally:
+        executor.shutdown(cancel_futures=True)
+    if done < len(batches):
+      warnings.warn(f"Ran out of time after {done} of {len(batches)} batches of walks")
+
+  @classmethod
+  def generate(cls, graph: CodeGraph, options: Optional[WalkOptions] = None) -> np.ndarray:
+    """All the walks (see chunks) in one array."""
+    options = options or WalkOptions()
+    walks = list(cls.chunks(graph, options))
+    if not walks:
+      return np.zeros((0, options.walk_length), dtype=np.int32)
+    return np.concatenate(walks)
+
+
+def sentences(chunks: Iterable[np.ndarray]) -> Iterator[List[str]]:
+  """
+  Walks as Word2Vec sentences: node ids as strings (like the node2vec package), without the -1 padding.
+  Made a walk at a time, so only the int32 walks need to be in memory.
+  """
+  for chunk in chunks:
+    for walk in chunk:
+      yield [str(node) for node in walk[walk >= 0].tolist()]
+
+
+class WalkSentences:
+  """In memory walks (see RandomWalks.generate) as sentences, restartable for Word2Vec's epochs."""
+  walks: np.ndarray
+
+  def __init__(self, walks: np.ndarray):
+    self.walks = walks
+
+  def __iter__(self) -> Iterator[List[str]]:
+    return sentences([self.walks])
+
+  def __len__(self) -> int:
+    return len(self.walks)
+
+
+class WalkCorpus:
+  """
+  Walks on disk, for when they don't fit in memory: written a chunk at a time (see RandomWalks.chunks)
+  and read back a chunk at a time, as sentences, every time Word2Vec goes over them.
+
+    header | chunk header | chunk | chunk header | chunk | ...
+
+  A chunk is rows x walk_length int32 node ids (-1 padded), zlib compressed if the header says so. The
+  numbers are in the writer's byte order (checked on open).
+  """
+  MAGIC = b"IAWMRWLK"
+  VERSION = 1
+  # magic, version, little endian?, walk length, compressed?, walk count
+  HEADER = struct.Struct("<8sIIIIQ")
+  # rows, bytes
+  CHUNK_HEADER = struct.Struct("<IQ")
+  SUFFIX = ".walks"
+  # Node ids don't compress much, so the fastest level.
+  COMPRESSION_LEVEL = 1
+
+  path: str
+  walk_length: int
+  compressed: bool
+  walk_count: int
+
+  def __init__(self, path: str):
+    self.path = path
+    with open(path, "rb") as f:
+      magic, version, little_endian, self.walk_length, compressed, self.walk_count = self.HEADER.unpack(f.read(self.HEADER.size))
+    if magic != self.MAGIC:
+      raise ValueError(f"{path} is not a walk corpus.")
+    if version != self.VERSION:
+      raise ValueError(f"{path} has format version {version}, expected {self.VERSION}.")
+    if bool(little_endian) != (sys.byteorder == "little"):
+      raise ValueError(f"{path} was written with the other byte order.")
+    self.compressed = bool(compressed)
+
+  @classmethod
+  def write(cls, path: str, chunks: Iterable[np.ndarray], walk_length: int, compress: bool = False) -> "WalkCorpus":
+    """Writes the chunks to path as they come, replacing it at once."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    walk_count = 0
+    with open(tmp_path, "wb") as f:
+      f.write(b"\0" * cls.HEADER.size)
+      for chunk in chunks:
+        data = np.ascontiguousarray(chunk, dtype=np.int32).tobytes()
+        if compress:
+          data = zlib.compress(data, cls.COMPRESSION_LEVEL)
+        f.write(cls.CHUNK_HEADER.pack(len(chunk), len(data)))
+        f.write(data)
+        walk_count += len(chunk)
+      f.seek(0)
+      f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, sys.byteorder == "little", walk_length, compress, walk_count))
+    os.replace(tmp_path, path)
+    return cls(path)
+
+  def chunks(self) -> Iterator[np.ndarray]:
+    with open(self.path, "rb") as f:
+      f.seek(self.HEADER.size)
+      while True:
+        header = f.read(self.CHUNK_HEADER.size)
+        if not header:
+          return
+        rows, size = self.CHUNK_HEADER.unpack(header)
+        data = f.read(size)
+        if self.compressed:
+          data = zlib.decompress(data)
+        yield np.frombuffer(data, dtype=np.int32).reshape(rows, self.walk_length)
+
+  def __iter__(self) -> Iterator[List[str]]:
+    return sentences(self.chunks())
+
+  def __len__(self) -> int:
+    return self.walk_count
@@ -1,26 +1,127 @@
 
-from typing import Optional
+from typing import Optional, Tuple
 import iawmr.deep_code.network as network
+from iawmr.deep_code.ann import ForestOptions, ProjectionForest
+from iawmr.deep_code.binary import BinaryFormat
+from iawmr.deep_code.embeddings import EmbeddingStore
+from iawmr.deep_code.parsing.cache import ParseCache
 from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.state import ParsingEngine, ParsingOptions
 from iawmr.deep_code.parsing.strategy import ParsingStrategy
 from iawmr.deep_code.project import ProjectSpec
+from iawmr.deep_code.reports import ReportFormat, ReportSink
+from iawmr.deep_code.walks import WalkOptions
 import click
-import json
+import os
 
 
 @click.command()
 @click.option("--root-path", type=click.Path(exists=True))
-def main(root_path: Optional[str] = "."):
+@click.option("--venv", type=click.Path(exists=True, file_okay=False), default=None, help="Resolve references into the libraries installed here.")
+@click.option("--library-index-dir", type=click.Path(file_okay=False), default=None, help="Where to keep the (shared) library signature indexes.")
+@click.option("--ignore", "ignores", multiple=True, default=["venv", ".venv", ".git", "node_modules", "__pycache__"], help="gitignore style pattern of paths not to parse (repeatable).")
+@click.option("--max-file-size", type=int, default=None, help="Skip source files bigger than this many bytes.")
+@click.option("--jobs", type=int, default=1, help="Number of processes to parse files with.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None, help="Cache parsed modules in this directory.")
+@click.option("--cache-size-mb", type=int, default=1024, help="Evict the least recently used cache entries past this size.")
+@click.option("--engine", type=click.Choice([engine.value for engine in ParsingEngine]), default=ParsingEngine.Recursive.value, help="How to walk the ast.")
+@click.option("--lazy-bodies", is_flag=True, default=False, help="Only parse function bodies once something needs them (writing the json needs them all).")
+@click.option("--freeze-scopes", is_flag=True, default=False, help="Flatten each scope's name lookups once its block is parsed (helps --lazy-bodies).")
+@click.option("--skip-validation", is_flag=True, default=False, help="Don't check the parsed tree (faster).")
+@click.option("--unique-paths", is_flag=True, default=False, help="Fail when nodes share a project_unique_path. By default that is only a warning (the same function defined in both branches of an if...), and each node still gets its own graph node.")
+@click.option("--compact", is_flag=True, default=False, help="Keep the parsed project in flat arrays instead of pydantic objects (less memory).")
+@click.option("--output-format", type=click.Choice(["json", "binary"]), default="json", help="One pretty printed json per module, or one memory mappable file for the whole project.")
+@click.option("--report", "report_format", type=click.Choice([report_format.value for report_format in ReportFormat]), default=ReportFormat.Text.value, help="How to write what resolving the references found (none is fastest).")
+@click.option("--report-path", type=click.Path(dir_okay=False), default=None, help="Where to write the report, defaults to output.dir/summary.txt (or .jsonl).")
+@click.option("--export-graph", "graph_path", type=click.Path(dir_okay=False), default=None, help="Write the graph here as networkx node link json (slow on big projects), and print its size.")
+@click.option("--walk-length", type=int, default=80, help="Steps per node2vec walk.")
+@click.option("--num-walks", type=int, default=10, help="node2vec walks starting at each node.")
+@click.option("--walk-p", type=float, default=1.0, help="node2vec's return parameter (lower goes back more).")
+@click.option("--walk-q", type=float, default=1.0, help="node2vec's in-out parameter (lower goes further away).")
+@click.option("--walk-jobs", type=int, default=1, help="Number of processes to walk with.")
+@click.option("--walk-seconds", type=float, default=None, help="Stop walking after this many seconds (and embed the walks so far).")
+@click.option("--dimensions", type=int, default=64, help="Size of the node embeddings.")
+@click.option("--walk-corpus", type=click.Path(dir_okay=False), default=None, help="Stream the walks to this file and train from it, instead of keeping them all in memory.")
+@click.option("--compress-walks", is_flag=True, default=False, help="zlib compress the --walk-corpus chunks.")
+@click.option("--embeddings-path", type=click.Path(dir_okay=False), default=None, help="Where to write the node embeddings, defaults to output.dir/embeddings.embeddings.")
+@click.option("--forest-trees", type=int, default=0, help="Build an approximate nearest neighbor index (see ProjectionForest) of this many trees next to the embeddings.")
+@click.option("--normalize-embeddings", is_flag=True, default=False, help="Store the embeddings scaled to length 1 (cosine similarity is then a dot product).")
+@click.option("--validate-nodes", is_flag=True, default=False, help="Run pydantic validation on every parsed node (slow, for debugging).")
+def main(
+  root_path: Optional[str] = ".",
+  venv: Optional[str] = None,
+  library_index_dir: Optional[str] = None,
+  ignores: Tuple[str, ...] = ("venv",),
+  max_file_size: Optional[int] = None,
+  jobs: int = 1,
+  cache_dir: Optional[str] = None,
+  cache_size_mb: int = 1024,
+  engine: str = ParsingEngine.Recursive.value,
+  validate_nodes: bool = False,
+  lazy_bodies: bool = False,
+  freeze_scopes: bool = False,
+  skip_validation: bool = False,
+  unique_paths: bool = False,
+  compact: bool = False,
+  output_format: str = "json",
+  report_format: str = ReportFormat.Text.value,
+  report_path: Optional[str] = None,
+  graph_path: Optional[str] = None,
+  walk_length: int = 80,
+  num_walks: int = 10,
+  walk_p: float = 1.0,
+  walk_q: float = 1.0,
+  walk_jobs: int = 1,
+  walk_seconds: Optional[float] = None,
+  dimensions: int = 64,
+  walk_corpus: Optional[str] = None,
+  compress_walks: bool = False,
+  embeddings_path: Optional[str] = None,
+  normalize_embeddings: bool = False,
+  forest_trees: int = 0,
+):
   spec = ProjectSpec(
     name="my self",
-    ignores=["venv"],
-    venv=None,
+    ignores=list(ignores),
+    max_file_size=max_file_size,
+    venv=venv,
     sources=["."],
     parsing_strategy=ParsingStrategy.create(),
+    library_index_dir=library_index_dir,
   )
-  write_jsons = True
-  project = Parsing.parse_project(spec=spec, write_jsons=write_jsons)
-  project.resolve_references()
-  network.fit_node2vec(project)
+  write_jsons = output_format == "json"
+  cache = None if cache_dir is None else ParseCache(directory=cache_dir, max_bytes=cache_size_mb * 1024 * 1024)
+  options = ParsingOptions(engine=ParsingEngine(engine), validate_nodes=validate_nodes, lazy_bodies=lazy_bodies, freeze_scopes=freeze_scopes,
+    validate_tree=not skip_validation,
+    unique_paths=unique_paths,
+  )
+  if compact:
+    project = Parsing.parse_project_compact(spec=spec, write_jsons=write_jsons, jobs=jobs, cache=cache, options=options)
+  else:
+    project = Parsing.parse_project(spec=spec, write_jsons=write_jsons, jobs=jobs, cache=cache, options=options)
+  if cache is not None:
+    print(cache.stats())
+  project.resolve_references(report=ReportSink.create(ReportFormat(report_format), report_path))
+  if output_format == "binary":
+    # Only write_json makes output.dir otherwise.
+    os.makedirs("output.dir", exist_ok=True)
+    BinaryFormat.write(project, os.path.join("output.dir", "project" + BinaryFormat.SUFFIX))
+  walk_options = WalkOptions(walk_length=walk_length, num_walks=num_walks, p=walk_p, q=walk_q, jobs=walk_jobs, max_seconds=walk_seconds)
+  graph = network.build_graph(project)
+  if graph_path is not None:
+    network.export_graph(graph=graph, path=graph_path)
+    print("wrote graph to", graph_path)
+    for name, value in network.graph_stats(graph).items():
+      print(name, value)
+  store = network.fit_node2vec(graph, options=walk_options, dimensions=dimensions, corpus_path=walk_corpus, compress_corpus=compress_walks,
+    store_path=embeddings_path or os.path.join("output.dir", "embeddings" + EmbeddingStore.SUFFIX),
+    normalize=normalize_embeddings,
+  )
+  if store is not None:
+    print("wrote", len(store), "embeddings to", store.path)
+    if forest_trees > 0:
+      forest_path = os.path.splitext(store.path)[0] + ProjectionForest.SUFFIX
+      ProjectionForest.build(store, ForestOptions(trees=forest_trees)).write(forest_path)
+      print("wrote", forest_trees, "trees to", forest_path)
   # print(json.dumps(project.dict(), indent=2))
 
@@ -0,0 +1,39 @@
+from typing import Dict
+import os
+
+import iawmr.deep_code.project as project
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.state import ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy, PushCheckResultType, PushRule, PushRuleType
+
+
+def push_everything() -> ParsingStrategy:
+  return ParsingStrategy(rules=[PushRule(rule_type=PushRuleType.Any, result_type=PushCheckResultType.Push)])
+
+
+def parse_project(
+  sources: Dict[str, str],
+  strategy: ParsingStrategy = ParsingStrategy.create(),
+  options: ParsingOptions = ParsingOptions(),
+  resolve: bool = True,
+) -> project.Project:
+  """A project of sources (relative path -> source), parsed in memory."""
+  modules = {}
+  for relative_path, source in sources.items():
+    module_path, module = Parsing.parse_source(relative_path, source, strategy, options=options)
+    modules[module_path] = module
+  spec = project.ProjectSpec(name="test", sources=["."], venv=None, ignores=[], parsing_strategy=strategy)
+  directory = project.SourceDirectory(root_path=".", package_type=project.SourceDirectoryType.Application, modules=modules)
+  ret = project.Project(spec=spec, sources=[directory])
+  if resolve:
+    ret.resolve_references()
+  return ret
+
+
+def write_sources(root: str, sources: Dict[str, str]) -> None:
+  """Writes sources (relative path -> source) under root."""
+  for relative_path, source in sources.items():
+    path = os.path.join(root, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+      f.write(source)
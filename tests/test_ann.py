@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from iawmr.deep_code.ann import ForestOptions, ProjectionForest
+from iawmr.deep_code.embeddings import EmbeddingStore
+
+NODE_TYPES = ["Function", "Class", "Module"]
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+  rng = np.random.default_rng(0)
+  # Clustered, like embeddings are, so the neighbors are worth finding
+  centers = rng.standard_normal((40, 16))
+  vectors = centers[rng.integers(0, len(centers), 3000)] + rng.standard_normal((3000, 16)) * 0.4
+  store = EmbeddingStore.write(
+    str(tmp_path_factory.mktemp("ann") / "nodes.embeddings"),
+    np.arange(3000) * 2,
+    vectors,
+    node_types=rng.integers(0, len(NODE_TYPES), 3000),
+    node_type_names=NODE_TYPES,
+  )
+  yield store
+  store.close()
+
+
+@pytest.fixture(scope="module")
+def forest(store):
+  return ProjectionForest.build(store, ForestOptions(trees=8, leaf_size=32))
+
+
+def recall(found, expected):
+  return np.mean([len(set(a.tolist()) & set(b.tolist())) / len(b) for a, b in zip(found, expected)])
+
+
+def tree_rows(forest, root):
+  rows, pending = [], [root]
+  while pending:
+    node = pending.pop()
+    if node < 0:
+      rows.extend(forest.leaf_rows[forest.leaf_offsets[~node]:forest.leaf_offsets[~node + 1]].tolist())
+    else:
+      pending.extend(forest.children[node].tolist())
+  return rows
+
+
+def test_every_row_is_in_every_tree(store, forest):
+  assert len(forest.roots) == forest.options.trees
+  assert forest.leaf_offsets[-1] == forest.options.trees * len(store)
+  for root in forest.roots.tolist():
+    assert sorted(tree_rows(forest, root)) == list(range(len(store)))
+  assert np.diff(forest.leaf_offsets).max() <= forest.options.leaf_size
+
+
+def test_search_scores_are_exact(store, forest):
+  queries = np.random.default_rng(1).standard_normal((50, store.dimensions))
+  rows, scores = forest.search(queries, k=10)
+  # Whatever it finds, scored and ordered like top_k would
+  unit = store.vectors / np.linalg.norm(store.vectors, axis=1, keepdims=True)
+  expected = np.take_along_axis((queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ unit.T, rows, axis=1)
+  np.testing.assert_allclose(scores, expected, atol=1e-5)
+  assert (np.diff(scores, axis=1) <= 0).all()
+  assert all(len(set(row.tolist())) == 10 for row in rows)
+
+
+def test_searching_every_row_is_exact(store, forest):
+  queries = store.vectors[:60]
+  exclude_rows = np.arange(60)
+  mask = store.node_type_mask("Function")
+  rows, scores = forest.search(queries, k=8, search_k=len(store) * forest.options.trees, exclude_rows=exclude_rows, mask=mask)
+  expected_rows, expected_scores = store.top_k(queries, k=8, exclude_rows=exclude_rows, mask=mask)
+  np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+  assert (rows == expected_rows).mean() > 0.99
+
+
+def test_recall_at_the_default_search_k(store, forest):
+  ids = store.ids[::25]
+  found, _ = forest.similar(ids, k=10)
+  expected, _ = store.similar(ids, k=10)
+  assert recall(found, expected) > 0.9
+  assert not (found == ids[:, None]).any()
+  # The same for one node type
+  found, _ = forest.similar(ids, k=10, node_type="Class")
+  expected, _ = store.similar(ids, k=10, node_type="Class")
+  assert recall(found, expected) > 0.9
+  assert (store.node_types[store.rows(found.ravel())] == NODE_TYPES.index("Class")).all()
+
+
+def test_pads_when_too_few_rows_qualify(store, forest):
+  mask = np.zeros(len(store), dtype=bool)
+  mask[[10, 20]] = True
+  rows, scores = forest.search(store.vectors[:5], k=4, mask=mask)
+  assert (np.sort(rows[:, :2], axis=1) == [10, 20]).all()
+  assert (rows[:, 2:] == -1).all() and np.isneginf(scores[:, 2:]).all()
+
+
+def test_write_open_round_trip(store, forest, tmp_path):
+  path = str(tmp_path / "nodes.forest")
+  forest.write(path)
+  opened = ProjectionForest.open(path, store)
+  assert opened.options == forest.options
+  for name in ProjectionForest.SECTIONS:
+    assert (getattr(opened, name) == getattr(forest, name)).all()
+  ids = store.ids[:40]
+  for found, expected in zip(opened.similar(ids, k=5, search_k=100), forest.similar(ids, k=5, search_k=100)):
+    assert (found == expected).all()
+  # Built with the same seed, the same trees
+  rebuilt = ProjectionForest.build(store, forest.options)
+  assert all((getattr(rebuilt, name) == getattr(forest, name)).all() for name in ProjectionForest.SECTIONS)
+
+
+def test_open_over_another_store_is_rejected(store, forest, tmp_path):
+  path = str(tmp_path / "nodes.forest")
+  forest.write(path)
+  other = EmbeddingStore.write(str(tmp_path / "other.embeddings"), np.arange(10), np.ones((10, store.dimensions)))
+  with pytest.raises(ValueError):
+    ProjectionForest.open(path, other)
+  other.close()
+  with pytest.raises(ValueError):
+    ProjectionForest.open(store.path, store)
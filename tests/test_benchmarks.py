@@ -0,0 +1,33 @@
+import pytest
+
+from iawmr.benchmarks.harness import Benchmark, BenchmarkReport
+
+from helpers import write_sources
+
+
+SOURCES = {
+  "pkg/__init__.py": "",
+  "pkg/util.py": "def helper():\n  return 1\n",
+  "pkg/main.py": "import pkg.util\n\ndef run():\n  return pkg.util.helper()\n",
+}
+
+
+def test_report_round_trip(tmp_path):
+  write_sources(str(tmp_path / "src"), SOURCES)
+  report = Benchmark.run(str(tmp_path / "src"), repeats=2)
+  assert report.files == 3
+  assert report.references > 0
+  assert [stage.name for stage in report.stages] == Benchmark.STAGES
+  assert all(len(stage.seconds) == 2 for stage in report.stages)
+
+  path = str(tmp_path / "report.json")
+  report.save(path)
+  assert BenchmarkReport.load(path) == report
+  assert Benchmark.compare(report, report) == []
+
+
+@pytest.mark.parametrize("repeats", [0, -1])
+def test_at_least_one_repeat(tmp_path, repeats):
+  write_sources(str(tmp_path / "src"), SOURCES)
+  with pytest.raises(ValueError):
+    Benchmark.run(str(tmp_path / "src"), repeats=repeats)
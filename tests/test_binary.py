@@ -0,0 +1,71 @@
+import os
+from array import array
+
+import pytest
+
+from iawmr.deep_code.binary import BinaryFormat
+from iawmr.deep_code.compact import CompactProject
+
+from helpers import parse_project
+
+
+SOURCES = {
+  "pkg/__init__.py": "from pkg.shapes import Circle\n",
+  "pkg/shapes.py": "import math\n\nclass Circle:\n  def area(self, r=lambda: 1):\n    return math.pi * r() * r()\n",
+  "pkg/main.py": "from pkg import Circle\nimport pkg.shapes\n\ndef run():\n  return Circle().area(), pkg.shapes.Circle\n",
+}
+
+
+def test_round_trip(tmp_path):
+  parsed = parse_project(SOURCES)
+  path = str(tmp_path / ("project" + BinaryFormat.SUFFIX))
+  BinaryFormat.write(parsed, path)
+  assert os.listdir(tmp_path) == ["project" + BinaryFormat.SUFFIX]
+  loaded = BinaryFormat.load_modules(path)
+  assert list(loaded) == [module.fully_qualified_name for module in parsed.modules()]
+  for module in parsed.modules():
+    assert loaded[module.fully_qualified_name].model_dump_json() == module.model_dump_json()
+  mapped = BinaryFormat.open(path)
+  assert mapped.unresolved_references == parsed.unresolved_references
+  assert mapped.call_graph().names == parsed.call_graph().names
+  # One module on its own, nothing else gets built.
+  shapes = BinaryFormat.load_module(path, "pkg.shapes")
+  assert shapes.model_dump_json() == loaded["pkg.shapes"].model_dump_json()
+
+
+def test_round_trip_from_a_compact_project(tmp_path):
+  parsed = parse_project(SOURCES)
+  compact = CompactProject.from_modules(parse_project(SOURCES).modules())
+  compact.resolve_references()
+  path = str(tmp_path / ("project" + BinaryFormat.SUFFIX))
+  BinaryFormat.write(compact, path)
+  loaded = BinaryFormat.load_modules(path)
+  assert [module.model_dump_json() for module in loaded.values()] == [module.model_dump_json() for module in parsed.modules()]
+
+
+class BrokenColumn(array):
+  def tofile(self, f):
+    raise OSError("disk full")
+
+
+def test_failed_write_leaves_the_old_file_alone(tmp_path, monkeypatch):
+  parsed = parse_project(SOURCES)
+  path = str(tmp_path / ("project" + BinaryFormat.SUFFIX))
+  BinaryFormat.write(parsed, path)
+  with open(path, "rb") as f:
+    written = f.read()
+  sections = BinaryFormat.sections
+  monkeypatch.setattr(BinaryFormat, "sections", classmethod(lambda cls, store: sections(store) + [("broken", BrokenColumn("i", [1]))]))
+  with pytest.raises(OSError, match="disk full"):
+    BinaryFormat.write(parsed, path)
+  assert os.listdir(tmp_path) == ["project" + BinaryFormat.SUFFIX]
+  with open(path, "rb") as f:
+    assert f.read() == written
+
+
+def test_mapped_project_cant_be_added_to(tmp_path):
+  parsed = parse_project(SOURCES)
+  path = str(tmp_path / ("project" + BinaryFormat.SUFFIX))
+  BinaryFormat.write(parsed, path)
+  with pytest.raises(TypeError):
+    BinaryFormat.open(path).add_module(next(parsed.modules()))
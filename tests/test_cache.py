@@ -0,0 +1,89 @@
+import os
+
+from iawmr.deep_code.parsing.cache import ParseCache
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.state import ParsingEngine, ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+from helpers import push_everything, write_sources
+
+
+SOURCES = {
+  "pkg/a.py": "import os\n\ndef f(path):\n  return os.path.basename(path)\n",
+  "pkg/b.py": "from pkg.a import f\n\nprint(f('x'))\n",
+}
+
+
+def parse(root, cache, strategy=None, options=None):
+  file_paths = sorted(os.path.join(root, path) for path in SOURCES)
+  return list(Parsing.parse_files_cached(
+    root_path=str(root),
+    file_paths=file_paths,
+    parsing_strategy=strategy or ParsingStrategy.create(),
+    cache=cache,
+    options=options,
+  ))
+
+
+def dumps(results):
+  return [(module_path, module.model_dump_json()) for module_path, module in results]
+
+
+def test_second_parse_hits_and_matches_the_first(tmp_path):
+  root = tmp_path / "src"
+  write_sources(root, SOURCES)
+  cache = ParseCache(directory=str(tmp_path / "cache"))
+  first = parse(root, cache)
+  assert (cache.hits, cache.misses) == (0, 2)
+  # A new cache over the same directory finds the entries.
+  cache = ParseCache(directory=str(tmp_path / "cache"))
+  second = parse(root, cache)
+  assert (cache.hits, cache.misses) == (2, 0)
+  assert dumps(second) == dumps(first)
+
+
+def test_changes_invalidate_the_entries(tmp_path):
+  root = tmp_path / "src"
+  write_sources(root, SOURCES)
+  cache = ParseCache(directory=str(tmp_path / "cache"))
+  parse(root, cache)
+  (root / "pkg/a.py").write_text(SOURCES["pkg/a.py"] + "\nX = 1\n")
+  parse(root, cache)
+  assert (cache.hits, cache.misses) == (1, 3)
+  parse(root, cache, strategy=push_everything())
+  assert (cache.hits, cache.misses) == (1, 5)
+  parse(root, cache, options=ParsingOptions(lazy_bodies=True))
+  assert (cache.hits, cache.misses) == (1, 7)
+  # Both engines build the same modules.
+  parse(root, cache, options=ParsingOptions(engine=ParsingEngine.Iterative))
+  assert (cache.hits, cache.misses) == (3, 7)
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+  root = tmp_path / "src"
+  write_sources(root, SOURCES)
+  cache = ParseCache(directory=str(tmp_path / "cache"))
+  parse(root, cache)
+  for key in cache.entries:
+    with open(os.path.join(cache.directory, key + ParseCache.SUFFIX), "wb") as f:
+      f.write(b"\x80\x05truncated")
+  cache = ParseCache(directory=str(tmp_path / "cache"))
+  results = parse(root, cache)
+  assert (cache.hits, cache.misses) == (0, 2)
+  assert [module_path for module_path, _ in results] == ["pkg.a", "pkg.b"]
+  # And the entries got rewritten.
+  assert (len(cache.entries), ParseCache(directory=str(tmp_path / "cache")).total_bytes) == (2, cache.total_bytes)
+
+
+def test_evicts_the_least_recently_used(tmp_path):
+  root = tmp_path / "src"
+  write_sources(root, SOURCES)
+  cache = ParseCache(directory=str(tmp_path / "cache"))
+  parse(root, cache)
+  a, b = cache.entries
+  assert cache.get(a) is not None
+  cache.max_bytes = cache.total_bytes - 1
+  cache.evict()
+  assert list(cache.entries) == [a]
+  assert cache.evictions == 1
+  assert not os.path.exists(os.path.join(cache.directory, b + ParseCache.SUFFIX))
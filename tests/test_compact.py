@@ -0,0 +1,91 @@
+import pytest
+
+from iawmr.deep_code import model
+from iawmr.deep_code.compact import CompactProject
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+from helpers import parse_project, push_everything
+
+
+SOURCES = {
+  "pkg/shapes.py": "import math\n\nclass Circle:\n  def area(self, r):\n    return math.pi * r * r\n",
+  "pkg/main.py": "from pkg.shapes import Circle\nimport pkg.extra\n\nCircle().area(2)\npkg.extra.helper()\n",
+}
+
+
+def resolutions(modules):
+  return [
+    (node.project_unique_path, reference.fully_qualified_name, reference.resolution,
+     None if reference.target is None else reference.target.project_unique_path, reference.external_target)
+    for module in modules
+    for node, _ in module.all_nodes()
+    for reference in node.references
+  ]
+
+
+def test_resolves_like_the_project():
+  parsed = parse_project(SOURCES)
+  compact = CompactProject.from_modules(parse_project(SOURCES, resolve=False).modules())
+  compact.resolve_references()
+  assert resolutions(compact.modules()) == resolutions(parsed.modules())
+  assert compact.unresolved_references == parsed.unresolved_references
+
+
+def test_resolve_again_sees_the_modules_added_since():
+  compact = CompactProject.from_modules(parse_project(SOURCES, resolve=False).modules())
+  compact.resolve_references()
+  assert "pkg.extra" in compact.unresolved_references
+  _, extra = Parsing.parse_source("pkg/extra.py", "def helper():\n  pass\n", ParsingStrategy.create())
+  compact.add_module(extra)
+  compact.resolve_references()
+  assert "pkg.extra" not in compact.unresolved_references
+  assert resolutions(compact.modules()) == resolutions(parse_project({**SOURCES, "pkg/extra.py": "def helper():\n  pass\n"}).modules())
+
+
+@pytest.mark.parametrize("strategy", [ParsingStrategy.create, push_everything])
+def test_to_modules_round_trip(strategy):
+  parsed = parse_project(SOURCES, strategy=strategy())
+  compact = CompactProject.from_project(parsed)
+  rebuilt = compact.to_modules()
+  modules = list(parsed.modules())
+  assert [module.model_dump_json() for module in rebuilt] == [module.model_dump_json() for module in modules]
+  assert resolutions(rebuilt) == resolutions(modules)
+  for before, after in zip(modules, rebuilt):
+    pairs = list(zip(before.all_children(), after.all_children()))
+    assert len(pairs) == sum(1 for _ in before.all_children())
+    for node, rebuilt_node in pairs:
+      assert type(rebuilt_node) is type(node)
+      assert rebuilt_node.get_fully_qualified_name() == node.get_fully_qualified_name()
+      assert rebuilt_node.node_attributes() == node.node_attributes()
+      if isinstance(node, model.ScopedNode):
+        assert rebuilt_node.scope.id == node.scope.id
+  # The targets are the rebuilt nodes, not copies of them
+  rebuilt_nodes = {id(node) for module in rebuilt for node in module.all_children()}
+  targets = [reference.target for module in rebuilt for node in module.all_children() for reference in node.references if reference.target is not None]
+  assert targets
+  assert all(id(target) in rebuilt_nodes for target in targets)
+
+
+def test_views_match_the_model():
+  parsed = parse_project(SOURCES)
+  compact = CompactProject.from_project(parsed)
+  assert len(compact) == sum(1 for module in parsed.modules() for _ in module.all_children())
+  assert resolutions(compact.modules()) == resolutions(parsed.modules())
+  for module, view in zip(parsed.modules(), compact.modules()):
+    for node, node_view in zip(module.all_children(), view.all_children()):
+      assert node_view.node_attributes() == node.node_attributes()
+      assert node_view.get_fully_qualified_name() == node.get_fully_qualified_name()
+
+
+def test_to_modules_of_some_modules_leaves_the_others_out():
+  compact = CompactProject.from_project(parse_project(SOURCES))
+  paths = [module.project_unique_path for module in compact.modules()]
+  main = paths.index("pkg.main")
+  [rebuilt] = compact.to_modules([main])
+  references = {reference.fully_qualified_name: reference for node in rebuilt.all_children() for reference in node.references}
+  # pkg.shapes isn't built, so the references into it come back unresolved
+  assert references["pkg.shapes.Circle"].target is None
+  assert references["pkg.shapes.Circle"].resolution is None
+  # The module itself comes back whole
+  assert [node.project_unique_path for node in rebuilt.all_children()] == [node.project_unique_path for node in compact.to_modules()[main].all_children()]
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from iawmr.deep_code.embeddings import EmbeddingStore
+
+NODE_TYPES = ["Function", "Class", "Module"]
+
+
+def write_store(path, normalize, count=700, dimensions=8, seed=0):
+  rng = np.random.default_rng(seed)
+  # Ids out of order, with gaps
+  ids = rng.permutation(count) * 3 + 1
+  vectors = rng.standard_normal((count, dimensions)) * rng.uniform(0.1, 10, (count, 1))
+  node_types = rng.integers(0, len(NODE_TYPES), count)
+  labels = [f"node {id} ü" for id in ids]
+  store = EmbeddingStore.write(
+    str(path), ids, vectors, normalize=normalize, node_types=node_types, node_type_names=NODE_TYPES, labels=labels,
+  )
+  return store, ids, vectors, node_types, labels
+
+
+def brute_force(vectors, queries, k, exclude_rows=None, mask=None):
+  """Every cosine, sorted: what top_k should find."""
+  unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+  scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ unit.T
+  if mask is not None:
+    scores[:, ~mask] = -np.inf
+  if exclude_rows is not None:
+    scores[np.arange(len(queries)), exclude_rows] = -np.inf
+  rows = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+  scores = np.take_along_axis(scores, rows, axis=1)
+  return np.where(np.isneginf(scores), -1, rows), scores
+
+
+@pytest.fixture(params=[False, True], ids=["scaled", "normalized"])
+def store(request, tmp_path, monkeypatch):
+  # Small blocks, so the rows and queries span a few of them
+  monkeypatch.setattr(EmbeddingStore, "BLOCK_ROWS", 128)
+  monkeypatch.setattr(EmbeddingStore, "QUERY_ROWS", 32)
+  store, *_ = write_store(tmp_path / "nodes.embeddings", request.param)
+  yield store
+  store.close()
+
+
+def assert_same_top_k(found, expected):
+  rows, scores = found
+  expected_rows, expected_scores = expected
+  assert rows.shape == expected_rows.shape
+  np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+  # Ties aside, the same rows
+  assert (rows == expected_rows).mean() > 0.99
+
+
+def test_top_k_matches_brute_force(store):
+  queries = np.random.default_rng(1).standard_normal((100, store.dimensions))
+  assert_same_top_k(store.top_k(queries, k=7), brute_force(store.vectors, queries, 7))
+  assert store.top_k(queries[:0], k=7)[0].shape == (0, 7)
+
+
+def test_top_k_excluded_and_masked_rows(store):
+  queries = store.vectors[:80]
+  exclude_rows = np.arange(80)
+  mask = store.node_type_mask("Class")
+  found = store.top_k(queries, k=5, exclude_rows=exclude_rows, mask=mask)
+  assert_same_top_k(found, brute_force(store.vectors, queries, 5, exclude_rows, mask))
+  assert (found[0] != exclude_rows[:, None]).all()
+  assert mask[found[0]].all()
+
+
+def test_top_k_pads_when_too_few_rows_qualify(store):
+  mask = np.zeros(len(store), dtype=bool)
+  mask[[3, 400]] = True
+  rows, scores = store.top_k(store.vectors[:40], k=4, mask=mask)
+  assert sorted(rows[0, :2].tolist()) == [3, 400]
+  assert (rows[:, 2:] == -1).all() and np.isneginf(scores[:, 2:]).all()
+  assert np.isfinite(scores[:, :2]).all()
+  # A node type nobody has
+  rows, scores = store.top_k(store.vectors[:3], k=2, mask=store.node_type_mask("Lambda"))
+  assert (rows == -1).all() and np.isneginf(scores).all()
+
+
+def test_similar_leaves_the_query_out(store):
+  ids = store.ids[[0, 5, 300, 699]]
+  found, scores = store.similar(ids, k=6, node_type="Function")
+  rows = store.rows(ids)
+  expected_rows, expected_scores = brute_force(store.vectors, store.vectors[rows], 6, rows, store.node_type_mask("Function"))
+  np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+  assert (found == store.ids[expected_rows]).mean() > 0.99
+  assert not (found == ids[:, None]).any()
+  with pytest.raises(KeyError):
+    store.similar([0])
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_write_open_round_trip(tmp_path, normalize):
+  written, ids, vectors, node_types, labels = write_store(tmp_path / "nodes.embeddings", normalize, count=50)
+  written.close()
+  store = EmbeddingStore.open(str(tmp_path / "nodes.embeddings"))
+  assert store.normalized == normalize
+  assert store.ids.tolist() == sorted(ids.tolist())
+  rows = store.rows(ids)
+  expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True) if normalize else vectors
+  np.testing.assert_allclose(store.vectors[rows], expected, rtol=1e-6)
+  assert [store.label(row) for row in rows] == labels
+  assert [store.node_type(row) for row in rows] == [NODE_TYPES[code] for code in node_types]
+  assert ids[0] in store and 0 not in store
+  assert store.rows([0, ids[1]]).tolist() == [-1, rows[1]]
+  store.close()
+
+
+def test_other_files_are_rejected(tmp_path):
+  path = tmp_path / "other.embeddings"
+  path.write_bytes(b"\0" * 64)
+  with pytest.raises(ValueError):
+    EmbeddingStore.open(str(path))
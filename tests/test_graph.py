@@ -0,0 +1,175 @@
+import networkx as nx
+import pytest
+
+import iawmr.deep_code.network as network
+from iawmr.deep_code.compact import CompactProject
+from iawmr.deep_code.parsing.state import ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+from helpers import parse_project, push_everything
+
+
+TRY_EXCEPT = """\
+try:
+  import numpy as np
+except ImportError:
+  np = None
+finally:
+  pass
+
+
+def load(path):
+  try:
+    return np.load(path)
+  except (OSError, ValueError) as error:
+    raise RuntimeError(path) from error
+"""
+
+
+def check_node_rows(strategy: ParsingStrategy, options: ParsingOptions = ParsingOptions()) -> None:
+  parsed = parse_project({"m.py": TRY_EXCEPT}, strategy, options)
+  graph = network.build_graph(parsed)
+  # The nodes the graph had when it was a networkx graph: one per node added, nothing in between.
+  nodes = [node.project_unique_path for module in parsed.modules() for node, _ in module.all_nodes()]
+  assert graph.ids.node_count == len(nodes)
+  assert [graph.ids.label(id) for id in range(graph.ids.node_count)] == nodes
+  # No empty rows: every node has an edge, to its parent's field group at least.
+  assert (graph.offsets[1:graph.ids.node_count + 1] > graph.offsets[:graph.ids.node_count]).all()
+
+
+def test_graph_has_a_row_per_node_only():
+  check_node_rows(ParsingStrategy.create())
+  # The handler isn't a node (only statements are), but its path is there for the statements in it.
+  parsed = parse_project({"m.py": TRY_EXCEPT}, ParsingStrategy.create())
+  module = next(parsed.modules())
+  paths = [module.path.table.path(id) for id in range(len(module.path.table))]
+  labels = network.build_graph(parsed).ids
+  assert "m.body[0].handlers[0]" in paths
+  assert "m.body[0].handlers[0]" not in [labels.label(id) for id in range(labels.node_count)]
+
+
+def test_graph_has_a_row_per_node_only_when_pushing_everything():
+  check_node_rows(push_everything())
+
+
+def test_graph_has_a_row_per_node_only_with_lazy_bodies():
+  check_node_rows(ParsingStrategy.create(), ParsingOptions(lazy_bodies=True))
+
+
+PROPERTY = """\
+class Point:
+  @property
+  def x(self):
+    return self._x
+
+  @x.setter
+  def x(self, value):
+    self._x = value
+
+  def moved(self):
+    return self.x
+"""
+
+
+def test_nodes_sharing_a_path_get_a_row_each():
+  parsed = parse_project({"m.py": PROPERTY}, ParsingStrategy.create())
+  graph = network.build_graph(parsed)
+  nodes = [node for module in parsed.modules() for node, _ in module.all_nodes()]
+  labels = [graph.ids.label(id) for id in range(graph.ids.node_count)]
+  assert graph.ids.node_count == len(nodes)
+  assert labels.count("m.Point.x") == 1
+  assert labels.count("m.Point.x#2") == 1
+  assert labels.count("m.Point.x.body[0]#2") == 1
+  # Each node finds its own row.
+  assert sorted(graph.ids.node(node) for node in nodes) == list(range(len(nodes)))
+
+
+def networkx_graph(project) -> nx.Graph:
+  """The graph network.py built with networkx, before GraphBuilder."""
+  graph = nx.Graph()
+  for module in project.modules():
+    for node, _ in module.all_nodes():
+      graph.add_node(node.project_unique_path, **node.node_attributes())
+  for module in project.modules():
+    for node, _ in module.all_nodes():
+      for reference in node.references:
+        if reference.target:
+          graph.add_edge(node.project_unique_path, reference.target.project_unique_path, edge_type=reference.reference_type, resolution="resolved")
+          continue
+        key = f"unresolved::{reference.fully_qualified_name}"
+        graph.add_node(key)
+        graph.add_edge(node.project_unique_path, key, edge_type=reference.reference_type, resolution="unresolved")
+
+  def add_child_list(parent, values):
+    previous = None
+    for child in values:
+      graph.add_edge(parent, child.project_unique_path, edge_type="is_child")
+      if previous is not None:
+        graph.add_edge(previous.project_unique_path, child.project_unique_path, edge_type="child_follows")
+      previous = child
+
+  for module in project.modules():
+    for node, _ in module.all_nodes():
+      previous = None
+      for index, (field_name, values) in enumerate(node.children.value_fields.items()):
+        group = f"{node.project_unique_path}::{field_name}::{index}"
+        graph.add_node(group, field_name=field_name)
+        graph.add_edge(node.project_unique_path, group, edge_type="field")
+        if previous is not None:
+          graph.add_edge(previous, group, edge_type="group_follows")
+        add_child_list(group, values)
+        previous = group
+      previous_outer = None
+      for outer_index, (field_name, outer_values) in enumerate(node.children.list_fields.items()):
+        outer = f"{node.project_unique_path}::{field_name}::{outer_index}"
+        graph.add_node(outer, field_name=field_name)
+        graph.add_edge(node.project_unique_path, outer, edge_type="outer-field")
+        if previous_outer is not None:
+          graph.add_edge(previous_outer, outer, edge_type="group_follows")
+        previous_inner = None
+        for inner_index, inner_values in enumerate(outer_values):
+          group = f"{outer}::{inner_index}"
+          graph.add_node(group, field_name=field_name)
+          graph.add_edge(outer, group, edge_type="inner-field")
+          if previous_inner is not None:
+            graph.add_edge(previous_inner, group, edge_type="group_follows")
+          add_child_list(group, inner_values)
+          previous_inner = group
+        previous_outer = outer
+  return graph
+
+
+GRAPH_SOURCES = {
+  "pkg/util.py": "import os\n\ndef helper(path):\n  return os.path.basename(path)\n",
+  # No lambdas: pushing everything, they share their parent's path, which the networkx graph couldn't take.
+  "pkg/main.py": TRY_EXCEPT + "\nfrom pkg.util import helper\n\nclass Loader:\n  def run(self, paths, key=str):\n    return [helper(key(path)) for path in paths]\n\nLoader().run(['x'])\nmissing.call()\n",
+}
+
+
+def labeled(graph) -> nx.Graph:
+  return nx.relabel_nodes(graph.to_networkx(), {id: graph.ids.label(id) for id in range(graph.node_count)})
+
+
+@pytest.mark.parametrize("strategy", [ParsingStrategy.create, push_everything])
+def test_graph_matches_the_networkx_one(strategy):
+  parsed = parse_project(GRAPH_SOURCES, strategy())
+  expected = networkx_graph(parsed)
+  graph = network.build_graph(parsed)
+  actual = labeled(graph)
+  assert dict(actual.nodes(data=True)) == dict(expected.nodes(data=True))
+  assert {frozenset((u, v)): d for u, v, d in actual.edges(data=True)} == {frozenset((u, v)): d for u, v, d in expected.edges(data=True)}
+  assert graph.edge_count == expected.number_of_edges()
+  # Rows are sorted by target, and have each edge from both ends
+  for node in range(len(graph.ids)):
+    neighbors = graph.neighbors(node)
+    assert (neighbors[1:] > neighbors[:-1]).all()
+    assert {graph.ids.label(neighbor) for neighbor in neighbors.tolist()} == set(expected.adj[graph.ids.label(node)])
+
+
+def test_compact_project_builds_the_same_graph():
+  parsed = parse_project(GRAPH_SOURCES)
+  graph = network.build_graph(parsed)
+  compact = network.build_graph(CompactProject.from_project(parsed))
+  for name in ["offsets", "targets", "edge_types", "resolutions", "node_types", "ast_types", "field_names"]:
+    assert (getattr(compact, name) == getattr(graph, name)).all(), name
+  assert [compact.ids.label(id) for id in range(len(compact.ids))] == [graph.ids.label(id) for id in range(len(graph.ids))]
@@ -0,0 +1,100 @@
+import json
+import os
+import pickle
+
+import pytest
+
+from iawmr.deep_code import model
+from iawmr.deep_code.parsing.parsing import DeferredBody, Parsing
+from iawmr.deep_code.parsing.state import ParsingEngine, ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+
+SOURCE = """\
+import os
+
+class Loader:
+  def __init__(self, key=lambda item: item[0]):
+    self.key = key
+
+  @staticmethod
+  def load(path, parse=lambda text: text.split()):
+    def read():
+      with open(path) as f:
+        return f.read()
+    words = parse(read())
+    return sorted(words, key=lambda word: (len(word), word))
+
+  @property
+  def name(self):
+    class Named:
+      def __repr__(self):
+        return f"{os.path.basename(self.path)} ✓ {(lambda é: é.title())('déjà')}"
+    return Named()
+
+
+def main(paths=[]):
+  return [Loader.load(path) for path in paths if (lambda p: p.endswith(".txt"))(path)]
+"""
+
+
+def parse(**options) -> model.Module:
+  _, module = Parsing.parse_source("m.py", SOURCE, ParsingStrategy.create(), options=ParsingOptions(**options))
+  return module
+
+
+def deferred_functions(module: model.Module):
+  return [node for node in module.all_children(expand=False) if isinstance(node, model.Function) and node.deferred_body is not None]
+
+
+@pytest.mark.parametrize("engine", list(ParsingEngine))
+@pytest.mark.parametrize("freeze_scopes", [False, True])
+def test_expanded_lazy_bodies_match_an_eager_parse(engine, freeze_scopes):
+  eager = parse(engine=engine, freeze_scopes=freeze_scopes)
+  lazy = parse(engine=engine, freeze_scopes=freeze_scopes, lazy_bodies=True)
+  assert deferred_functions(lazy)
+  lazy.expand_all()
+  assert [scope.id for scope in lazy.scopes] == list(range(len(lazy.scopes)))
+  assert lazy.model_dump_json() == eager.model_dump_json()
+
+
+@pytest.mark.parametrize("engine", list(ParsingEngine))
+def test_lazy_bodies_expanded_out_of_order_match_an_eager_parse(engine):
+  eager = parse(engine=engine)
+  lazy = parse(engine=engine, lazy_bodies=True)
+  while True:
+    pending = deferred_functions(lazy)
+    if not pending:
+      break
+    for function in reversed(pending):
+      function.expand()
+  assert lazy.model_dump_json() == eager.model_dump_json()
+
+
+def test_deferred_bodies_only_keep_their_location():
+  lazy = parse(lazy_bodies=True)
+  pending = deferred_functions(lazy)
+  assert all(isinstance(function.deferred_body, DeferredBody) for function in pending)
+  # One source (and scope table) for the module, not a copy of the parse per body.
+  bodies = pending[0].deferred_body.bodies
+  assert all(function.deferred_body.bodies is bodies for function in pending)
+  assert bodies.table is lazy.scopes
+  load = next(function for function in pending if function.name == "load")
+  assert load.deferred_body.location == (8, 2, 13, 60)
+
+
+@pytest.mark.parametrize("engine", list(ParsingEngine))
+def test_pickled_lazy_bodies_expand_like_an_eager_parse(engine):
+  eager = parse(engine=engine)
+  lazy = pickle.loads(pickle.dumps(parse(engine=engine, lazy_bodies=True)))
+  assert deferred_functions(lazy)[0].deferred_body.bodies.table is lazy.scopes
+  lazy.expand_all()
+  assert lazy.model_dump_json() == eager.model_dump_json()
+
+
+def test_json_has_the_deferred_bodies(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  eager = parse()
+  Parsing.parse_source("m.py", SOURCE, ParsingStrategy.create(), write_jsons=True, options=ParsingOptions(lazy_bodies=True))
+  with open(os.path.join("output.dir", "m.py.json"), encoding="utf-8") as f:
+    assert json.load(f) == json.loads(eager.model_dump_json())
@@ -0,0 +1,102 @@
+import json
+import os
+
+from iawmr.deep_code import model
+from iawmr.deep_code.library import LibraryIndex, LibraryIndexer, LibraryIndexStore, SymbolKind
+
+from helpers import parse_project, write_sources
+
+
+LIBRARY = {
+  "lib/__init__.py": "from lib._impl import Thing, make as build\nfrom lib.extra import *\nimport lib.helpers\n",
+  "lib/_impl.py": (
+    "try:\n  import json as encoder\nexcept ImportError:\n  encoder = None\n\n"
+    "class Thing:\n  def method(self):\n    def hidden():\n      pass\n\n"
+    "def make():\n  import secret\n  return Thing()\n"
+  ),
+  "lib/extra.py": "def shout(text):\n  return text.upper()\n",
+  "lib/helpers.py": "from ._impl import Thing as Alias\n",
+  "lib/broken.py": "print 'python 2'\n",
+}
+
+
+def write_venv(root: str) -> str:
+  site_packages = os.path.join(root, "lib", "python3.11", "site-packages")
+  write_sources(site_packages, LIBRARY)
+  record = "".join(f"{path},,\n" for path in LIBRARY) + "lib-0.1.dist-info/METADATA,,\n"
+  write_sources(site_packages, {
+    "lib-0.1.dist-info/METADATA": "Metadata-Version: 2.1\nName: lib\nVersion: 0.1\n",
+    "lib-0.1.dist-info/RECORD": record,
+  })
+  return site_packages
+
+
+def test_index_has_the_signatures_only(tmp_path):
+  write_venv(str(tmp_path / "venv"))
+  libraries = LibraryIndexStore(str(tmp_path / "indexes")).index_venv(str(tmp_path / "venv"))
+  [index] = libraries.indexes
+  assert (index.distribution, index.version) == ("lib", "0.1")
+  assert index.symbols["lib"] == SymbolKind.Module.value
+  assert index.symbols["lib._impl.Thing"] == SymbolKind.Class.value
+  assert index.symbols["lib._impl.Thing.method"] == SymbolKind.Function.value
+  assert index.symbols["lib.extra.shout"] == SymbolKind.Function.value
+  # Nothing from inside the bodies, and nothing from files that don't parse
+  assert "lib._impl.Thing.method.hidden" not in index.symbols
+  assert "lib._impl.make.secret" not in index.aliases
+  assert "lib.broken" not in index.symbols
+  assert index.aliases["lib._impl.encoder"] == "json"
+  assert index.aliases["lib.build"] == "lib._impl.make"
+  assert index.aliases["lib.helpers.Alias"] == "lib._impl.Thing"
+  assert index.star_imports["lib"] == ["lib.extra"]
+
+  assert libraries.resolve("lib.Thing.method") == "lib._impl.Thing.method"
+  assert libraries.resolve("lib.build") == "lib._impl.make"
+  assert libraries.resolve("lib.shout") == "lib.extra.shout"
+  assert libraries.resolve("lib.helpers.Alias") == "lib._impl.Thing"
+  assert libraries.resolve("lib.missing") is None
+
+
+def test_store_round_trip(tmp_path, monkeypatch):
+  site_packages = write_venv(str(tmp_path / "venv"))
+  store = LibraryIndexStore(str(tmp_path / "indexes"))
+  [first] = store.index_venv(str(tmp_path / "venv")).indexes
+  assert store.load("lib", "0.1") == first
+
+  # The second time, it all comes from the store
+  def index_distribution(distribution, site_packages):
+    raise AssertionError("indexed again")
+  monkeypatch.setattr(LibraryIndexer, "index_distribution", index_distribution)
+  [second] = LibraryIndexStore(str(tmp_path / "indexes")).index_venv(str(tmp_path / "venv")).indexes
+  assert second == first
+  monkeypatch.undo()
+
+  # Old or unreadable index files are indexed again
+  path = store.path("lib", "0.1")
+  with open(path) as f:
+    stale = json.load(f)
+  stale["format_version"] = LibraryIndex.FORMAT_VERSION - 1
+  with open(path, "w") as f:
+    json.dump(stale, f)
+  assert store.load("lib", "0.1") is None
+  with open(path, "w") as f:
+    f.write("{")
+  assert store.load("lib", "0.1") is None
+  assert store.index_venv(site_packages).indexes == [first]
+  assert store.load("lib", "0.1") == first
+
+
+def test_references_resolve_into_the_libraries(tmp_path):
+  write_venv(str(tmp_path / "venv"))
+  libraries = LibraryIndexStore(str(tmp_path / "indexes")).index_venv(str(tmp_path / "venv"))
+  parsed = parse_project({"app.py": "import lib\nlib.Thing().method()\nlib.nothing()\n"}, resolve=False)
+  parsed.libraries = libraries
+  parsed.resolve_references()
+  references = {
+    reference.fully_qualified_name: reference
+    for module in parsed.modules()
+    for node in module.all_children()
+    for reference in node.references
+  }
+  assert references["lib.Thing"].external_target == "lib._impl.Thing"
+  assert references["lib.Thing"].resolution == model.ResolutionKind.Library.value
+  assert references["lib.nothing"].external_target is None
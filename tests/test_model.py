@@ -0,0 +1,50 @@
+import pytest
+
+from iawmr.deep_code import model
+from iawmr.deep_code.parsing.state import ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+from helpers import parse_project, push_everything
+
+
+SOURCES = {
+  "pkg/util.py": "import os\n\ndef helper(path, *args, key=lambda p: p, **kwargs):\n  return key(os.path.basename(path))\n",
+  "pkg/main.py": "from pkg.util import helper\n\nclass Runner:\n  async def run(self, paths):\n    return [helper(path) for path in paths]\n",
+}
+
+
+def resolved(reference: model.CodeReference):
+  return reference.fully_qualified_name, None if reference.target is None else str(reference.target.path), reference.resolution
+
+
+@pytest.mark.parametrize("strategy", [ParsingStrategy.create, push_everything])
+def test_trusted_nodes_match_validated_ones(strategy):
+  trusted = parse_project(SOURCES, strategy=strategy(), options=ParsingOptions())
+  validated = parse_project(SOURCES, strategy=strategy(), options=ParsingOptions(validate_nodes=True))
+  for trusted_module, validated_module in zip(trusted.modules(), validated.modules()):
+    assert trusted_module.model_dump_json() == validated_module.model_dump_json()
+    pairs = list(zip(trusted_module.all_children(), validated_module.all_children()))
+    assert len(pairs) == sum(1 for _ in validated_module.all_children())
+    for trusted_node, validated_node in pairs:
+      assert type(trusted_node) is type(validated_node)
+      assert list(trusted_node.__dict__) == list(validated_node.__dict__)
+      assert trusted_node.model_fields_set == validated_node.model_fields_set
+      assert str(trusted_node.path) == str(validated_node.path)
+      assert [resolved(reference) for reference in trusted_node.references] == [resolved(reference) for reference in validated_node.references]
+
+
+def test_construct_trusted_matches_the_constructor():
+  values = dict(local_name="helper", fully_qualified_name="pkg.util.helper", target=None, external_target=None, reference_type="calls", resolution=model.ResolutionKind.Exact.value)
+  trusted = model.CodeReference.construct_trusted(**values)
+  validated = model.CodeReference(**values)
+  assert trusted == validated
+  assert trusted.model_dump_json() == validated.model_dump_json()
+  assert trusted.model_copy(update={"target": None}) == validated
+
+
+def test_construct_trusted_falls_back_for_private_attributes():
+  # ParsingStrategy keeps its compiled table in a private attribute, which model_construct sets up.
+  strategy = ParsingStrategy.create()
+  trusted = ParsingStrategy.construct_trusted(rules=strategy.rules)
+  assert trusted.fingerprint() == strategy.fingerprint()
+  assert trusted.compile() is trusted.compile()
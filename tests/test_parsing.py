@@ -0,0 +1,107 @@
+import glob
+import os
+
+import pytest
+
+import iawmr
+import iawmr.deep_code.project as project
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.state import ParsingEngine, ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+from helpers import push_everything, write_sources
+
+
+SOURCES = {
+  "pkg/__init__.py": "",
+  "pkg/util.py": "import os\n\ndef helper(path):\n  return os.path.basename(path)\n",
+  "pkg/models.py": "class Model:\n  def __init__(self, name):\n    self.name = name\n\n  def key(self):\n    return lambda: self.name\n",
+  "pkg/main.py": "from pkg.util import helper\nfrom pkg.models import Model\n\ndef run(paths):\n  return [Model(helper(path)).key() for path in paths]\n",
+  "pkg/sub/__init__.py": "",
+  "pkg/sub/deep.py": "import pkg.main\n\nclass Deep(pkg.models.Model):\n  pass\n\npkg.main.run([])\n",
+}
+
+
+def parse(root, **kwargs) -> project.SourceDirectory:
+  return Parsing.parse_source_directory(
+    directory_type=project.SourceDirectoryType.Application,
+    root_path=str(root),
+    parsing_strategy=ParsingStrategy.create(),
+    ignores=[],
+    **kwargs,
+  )
+
+
+def dumps(directory: project.SourceDirectory):
+  return [(module_path, module.model_dump_json()) for module_path, module in directory.modules.items()]
+
+
+@pytest.mark.parametrize("lazy_bodies", [False, True])
+def test_jobs_parse_like_a_serial_parse(tmp_path, lazy_bodies):
+  write_sources(str(tmp_path), SOURCES)
+  options = ParsingOptions(lazy_bodies=lazy_bodies)
+  serial = parse(tmp_path, options=options)
+  parallel = parse(tmp_path, options=options, jobs=2)
+  assert len(serial.modules) == len(SOURCES)
+  if lazy_bodies:
+    for directory in (serial, parallel):
+      for module in directory.modules.values():
+        module.expand_all()
+  assert dumps(parallel) == dumps(serial)
+
+
+def test_jobs_write_the_same_jsons(tmp_path, monkeypatch):
+  write_sources(str(tmp_path / "src"), SOURCES)
+  written = {}
+  for jobs in (1, 2):
+    output = tmp_path / f"jobs{jobs}"
+    os.makedirs(output)
+    monkeypatch.chdir(output)
+    parse(tmp_path / "src", write_jsons=True, jobs=jobs)
+    written[jobs] = {}
+    for directory, _, file_names in os.walk(output):
+      for file_name in file_names:
+        path = os.path.join(directory, file_name)
+        with open(path) as f:
+          written[jobs][os.path.relpath(path, output)] = f.read()
+  assert len(written[1]) == len(SOURCES)
+  assert written[2] == written[1]
+
+
+def package_sources():
+  # The parsing code itself: every kind of statement, nested functions and lambdas, comprehensions...
+  root = os.path.dirname(os.path.dirname(iawmr.__file__))
+  for path in sorted(glob.glob(os.path.join(root, "iawmr", "deep_code", "parsing", "*.py"))):
+    with open(path) as f:
+      yield os.path.relpath(path, root), f.read()
+
+
+@pytest.mark.parametrize("strategy", [ParsingStrategy.create, push_everything])
+@pytest.mark.parametrize("lazy_bodies", [False, True])
+def test_iterative_engine_parses_like_the_recursive_one(strategy, lazy_bodies):
+  strategy = strategy()
+  compared = 0
+  for relative_path, source in package_sources():
+    modules = []
+    for engine in ParsingEngine:
+      _, module = Parsing.parse_source(relative_path, source, strategy, options=ParsingOptions(engine=engine, lazy_bodies=lazy_bodies))
+      module.expand_all()
+      modules.append(module.model_dump_json())
+    assert modules[0] == modules[1], relative_path
+    compared += 1
+  assert compared >= 5
+
+
+def test_iterative_engine_has_no_recursion_limit():
+  # Deeper than the recursive engine can go
+  source = "x = " + "-" * 500 + "1\n"
+  with pytest.raises(RecursionError):
+    Parsing.parse_source("deep.py", source, push_everything(), options=ParsingOptions(engine=ParsingEngine.Recursive))
+  _, module = Parsing.parse_source("deep.py", source, push_everything(), options=ParsingOptions(engine=ParsingEngine.Iterative))
+  # Down the chain of UnaryOps, without recursing either
+  depth = 0
+  node = module.children.list_fields["body"][0][0].children.value_fields["value"][0]
+  while node.ast_type == "UnaryOp":
+    depth += 1
+    node = node.children.value_fields["operand"][0]
+  assert depth == 500
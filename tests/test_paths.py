@@ -0,0 +1,71 @@
+import pickle
+import random
+
+from iawmr.deep_code import model
+from iawmr.deep_code.parsing.state import NodePathStack
+
+from helpers import parse_project
+
+
+def test_same_path_same_id():
+  table = model.PathTable()
+  module = table.child(model.PathTable.ROOT, "pkg.mod")
+  method = table.child(table.child(module, "Thing"), "method")
+  assert table.child(table.child(module, "Thing"), "method") == method
+  assert table.path(method) == "pkg.mod.Thing.method"
+  assert table.segment(method) == "method"
+  assert table.path(table.parent(method)) == "pkg.mod.Thing"
+  # Segments are interned across the table
+  table.child(module, "method")
+  assert table.segment_names.count("method") == 1
+  assert len(table) == 4
+
+
+def test_trimmed_and_loaded_tables_keep_their_ids():
+  table = model.PathTable()
+  ids = [table.child(model.PathTable.ROOT, "a")]
+  for segment in ["b", "c", "b", "d"]:
+    ids.append(table.child(ids[-1], segment))
+  table.trim()
+  assert table.child(ids[1], "c") == ids[2]
+  loaded = model.PathTable.from_columns(table.parents, table.segments, table.segment_names)
+  assert [loaded.path(id) for id in ids] == [table.path(id) for id in ids]
+  assert loaded.child(ids[3], "d") == ids[4]
+  assert loaded.child(ids[4], "e") == len(ids)
+
+
+def test_node_path_stack_matches_joining_the_segments():
+  # What create_id used to do: join the segments, the nameless ones (None) left out
+  rng = random.Random(11)
+  stack = NodePathStack(model.PathTable())
+  for _ in range(2000):
+    if stack.elements and rng.random() < 0.45:
+      stack.pop()
+    else:
+      stack.push(rng.choice(["a", "b", "body[0]", "args", None]))
+    if stack.elements and stack.elements[0] is not None and rng.random() < 0.5:
+      assert stack.paths.path(stack.path_id()) == ".".join(s for s in stack.elements if s is not None)
+
+
+SOURCES = {
+  "pkg/paths.py": "import sys\n\nif sys.platform == 'win32':\n  def home():\n    return 'C:/'\nelse:\n  def home():\n    return '/'\n\nclass Thing:\n  def method(self, key=lambda item: item):\n    return [key(x) for x in self.items]\n",
+}
+
+
+def test_parsed_paths():
+  [module] = parse_project(SOURCES).modules()
+  nodes = list(module.all_children())
+  assert all(node.path.table is module.path.table for node in nodes)
+  assert all(node.project_unique_path == str(node.path) for node in nodes)
+  homes = [node for node in nodes if isinstance(node, model.Function) and node.name == "home"]
+  # Defined twice, one path
+  assert len(homes) == 2 and homes[0].path == homes[1].path
+  assert homes[0].project_unique_path == "pkg.paths.body[1].home"
+  for node in nodes:
+    parent = module.path.table.parent(node.path.id)
+    if parent != model.PathTable.ROOT:
+      assert node.project_unique_path.startswith(module.path.table.path(parent) + ".")
+  # Pickled (the parse cache, --jobs) with the table they share
+  loaded = pickle.loads(pickle.dumps(module))
+  assert [node.project_unique_path for node in loaded.all_children()] == [node.project_unique_path for node in nodes]
+  assert all(node.path.table is loaded.path.table for node in loaded.all_children())
@@ -0,0 +1,57 @@
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+
+from helpers import parse_project
+
+
+SOURCES = {
+  "pkg/util.py": "import os\n\ndef helper(path):\n  return os.path.basename(path)\n\nclass Tool:\n  def run(self):\n    pass\n",
+  "pkg/main.py": "from pkg.util import helper, Tool\nimport pkg.util\nimport pkg.extra\n\nhelper('x')\nTool().run()\npkg.util.gone()\npkg.extra.thing()\n",
+  "pkg/other.py": "import pkg.main\nfrom pkg.util import Tool\n\ndef go():\n  return pkg.main.helper('y'), Tool\n",
+}
+
+# Each step replaces (or adds) one module
+EDITS = [
+  # Something main calls goes away, and something it calls shows up
+  ("pkg/util.py", "import os\n\ndef gone():\n  pass\n\nclass Tool:\n  def run(self):\n    pass\n"),
+  # A new module that was imported all along
+  ("pkg/extra.py", "def thing():\n  pass\n"),
+  # main's own references change
+  ("pkg/main.py", "from pkg.util import gone\nimport pkg.extra\n\ngone()\npkg.extra.thing()\npkg.extra.missing()\n"),
+  # Everything comes back
+  ("pkg/util.py", SOURCES["pkg/util.py"]),
+  ("pkg/main.py", SOURCES["pkg/main.py"]),
+]
+
+
+def resolutions(project):
+  return sorted(
+    (node.project_unique_path, reference.fully_qualified_name, str(reference.resolution),
+     None if reference.target is None else reference.target.project_unique_path, str(reference.external_target))
+    for module in project.modules()
+    for node, _ in module.all_nodes()
+    for reference in node.references
+  )
+
+
+def test_replace_module_matches_resolving_everything_again():
+  sources = dict(SOURCES)
+  incremental = parse_project(sources)
+  total = len(resolutions(incremental))
+  for relative_path, source in EDITS:
+    sources[relative_path] = source
+    module_path, module = Parsing.parse_source(relative_path, source, ParsingStrategy.create())
+    count = incremental.replace_module(module_path, module)
+    assert 0 < count < total
+    expected = parse_project(sources)
+    assert resolutions(incremental) == resolutions(expected)
+    assert incremental.unresolved_references == expected.unresolved_references
+
+
+def test_replace_module_before_resolving():
+  project = parse_project(SOURCES, resolve=False)
+  relative_path, source = EDITS[0]
+  module_path, module = Parsing.parse_source(relative_path, source, ParsingStrategy.create())
+  assert project.replace_module(module_path, module) == 0
+  project.resolve_references()
+  assert resolutions(project) == resolutions(parse_project({**SOURCES, relative_path: source}))
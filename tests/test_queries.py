@@ -0,0 +1,80 @@
+import random
+from collections import deque
+
+from iawmr.deep_code.queries import CallGraph, Traversal
+
+from helpers import parse_project
+
+
+SOURCES = {
+  "pkg/util.py": "import os\n\ndef base(path):\n  return os.path.basename(path)\n\ndef stem(path):\n  return base(path).split('.')[0]\n",
+  "pkg/shapes.py": "from pkg.util import stem\n\nclass Shape:\n  def area(self):\n    return 0\n\ndef describe(path):\n  shape = Shape()\n  return stem(path)\n",
+  "pkg/main.py": "import pkg.shapes\nfrom pkg.shapes import describe\nfrom pkg.util import base\n\ndef run(path):\n  base(path)\n  return describe(path)\n",
+}
+
+
+def brute_force_closure(graph: CallGraph, name: str, depth, reverse: bool):
+  """Breadth first over the callees / callers lists, the way the graph answers one step."""
+  found = {name: 0}
+  pending = deque([name])
+  while pending:
+    current = pending.popleft()
+    if depth is not None and found[current] >= depth:
+      continue
+    for neighbor in (graph.callers(current) if reverse else graph.callees(current)):
+      if neighbor not in found:
+        found[neighbor] = found[current] + 1
+        pending.append(neighbor)
+  return found
+
+
+def test_closures_match_a_brute_force_search():
+  graph = parse_project(SOURCES).call_graph()
+  assert graph.callers("pkg.shapes.describe") == ["pkg.main", "pkg.main.run"]
+  assert graph.callers("pkg.shapes.describe", kinds=["calls"]) == ["pkg.main.run"]
+  assert graph.reachable("pkg.main.run") == {
+    "pkg.main.run": 0, "pkg.util.base": 1, "pkg.shapes.describe": 1, "pkg.util.stem": 2,
+  }
+  assert graph.reachable("pkg.main", kinds=["calls"]) == {"pkg.main": 0}
+  assert graph.reachable("pkg.util.stem", depth=1, reverse=True) == {"pkg.util.stem": 0, "pkg.shapes": 1, "pkg.shapes.describe": 1}
+  for name in graph.names:
+    for depth in [None, 0, 1, 2]:
+      for reverse in [False, True]:
+        expected = brute_force_closure(graph, name, depth, reverse)
+        for traversal in Traversal:
+          assert graph.reachable(name, depth=depth, reverse=reverse, traversal=traversal) == expected
+          # Again, from the cache.
+          assert graph.reachable(name, depth=depth, reverse=reverse, traversal=traversal) == expected
+
+
+def test_depth_first_finds_the_shortest_distance_on_random_graphs():
+  rng = random.Random(0)
+  for _ in range(20):
+    sources = {f"pkg/m{index}.py": "" for index in range(8)}
+    for index in range(8):
+      calls = rng.sample(range(8), 3)
+      sources[f"pkg/m{index}.py"] = "".join(f"import pkg.m{call}\n" for call in calls)
+    graph = parse_project(sources).call_graph()
+    for name in graph.names:
+      expected = brute_force_closure(graph, name, 2, False)
+      assert graph.reachable(name, depth=2, traversal=Traversal.DepthFirst) == expected
+
+
+def test_importers():
+  graph = parse_project(SOURCES).call_graph()
+  assert graph.importers("pkg.util") == ["pkg.main", "pkg.shapes"]
+  assert graph.importers("pkg.shapes") == ["pkg.main"]
+  assert graph.importers("pkg.main") == []
+  assert graph.import_fan_in("pkg.util") == 2
+
+
+def test_importers_of_a_module_sharing_a_name_with_a_class():
+  # pkg.a.b is both a class in pkg/a.py and the module pkg/a/b.py: the module's definitions aren't
+  # the ones numbered after it.
+  graph = parse_project({
+    "pkg/a.py": "class b:\n  pass\n\ndef f():\n  pass\n",
+    "pkg/a/b.py": "X = 1\n",
+    "pkg/c.py": "from pkg.a import f\n",
+  }).call_graph()
+  assert graph.importers("pkg.a") == ["pkg.c"]
+  assert graph.importers("pkg.a.b") == []
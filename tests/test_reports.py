@@ -0,0 +1,40 @@
+import json
+import os
+
+import pytest
+
+from iawmr.deep_code.reports import ReportFormat, ReportSink
+
+from helpers import parse_project
+
+
+SOURCES = {
+  "pkg/util.py": "def helper():\n  pass\n",
+  "pkg/main.py": "import pkg.util\nimport missing\npkg.util.helper()\nmissing.thing()\n",
+}
+
+
+def test_no_report():
+  assert ReportSink.create(ReportFormat.Nothing) is None
+
+
+@pytest.mark.parametrize("report_format", [ReportFormat.Text, ReportFormat.Jsonl])
+def test_default_report_path_is_created(tmp_path, monkeypatch, report_format):
+  # A clean tree: nothing has made output.dir yet (no json was written).
+  monkeypatch.chdir(tmp_path)
+  parsed = parse_project(SOURCES, resolve=False)
+  parsed.resolve_references(report=ReportSink.create(report_format))
+  path = os.path.join("output.dir", "summary" + (".txt" if report_format == ReportFormat.Text else ".jsonl"))
+  with open(path) as f:
+    report = f.read()
+  assert "missing.thing" in report
+  if report_format == ReportFormat.Jsonl:
+    lines = [json.loads(line) for line in report.splitlines()]
+    assert {"kind": "unresolved", "name": "missing.thing"} in lines
+    assert lines[-1]["kind"] == "stats"
+
+
+def test_report_path_in_a_new_directory(tmp_path):
+  path = str(tmp_path / "reports" / "nested" / "summary.txt")
+  parse_project(SOURCES, resolve=False).resolve_references(report=ReportSink.create(ReportFormat.Text, path))
+  assert os.path.exists(path)
@@ -0,0 +1,77 @@
+import json
+
+import iawmr.deep_code.project as project
+from iawmr.deep_code.compact import CompactProject
+from iawmr.deep_code.reports import ReportFormat, ReportSink
+from iawmr.deep_code.scheduling import ImportGraph
+
+from helpers import parse_project
+
+
+# Listed importers first, so the module order is the wrong one: app -> (ui <-> widgets) -> core.
+SOURCES = {
+  "app/main.py": "from app.ui import window\nimport app.core\n\nwindow()\n",
+  "app/ui.py": "from app.widgets import button\nfrom app.core import log\n\ndef window():\n  button()\n",
+  "app/widgets.py": "import app.ui\nfrom app.core import log\n\ndef button():\n  log()\n",
+  "app/core.py": "import os\n\ndef log():\n  pass\n",
+  "app/__init__.py": "",
+}
+
+
+def check_imports_first(graph: ImportGraph, order):
+  done = set()
+  for name in order:
+    index = graph.ids[name]
+    cycle = set(graph.components[graph.component_of[index]])
+    for imported in graph.imports[index]:
+      assert imported in cycle or graph.names[imported] in done, (name, graph.names[imported])
+    done.add(name)
+  assert sorted(done) == sorted(graph.names)
+
+
+def test_waves():
+  graph = parse_project(SOURCES).import_graph()
+  assert [sorted(cycle) for cycle in graph.cycles()] == [["app.ui", "app.widgets"]]
+  waves = [sorted(graph.names[member] for component in wave for member in graph.components[component]) for wave in graph.waves]
+  assert waves == [["app.__init__", "app.core"], ["app.ui", "app.widgets"], ["app.main"]]
+  assert graph.dependents("app.core") == {"app.core", "app.ui", "app.widgets", "app.main"}
+
+
+def test_process_modules_follows_the_import_waves():
+  parsed = parse_project(SOURCES)
+  order = []
+  results = parsed.process_modules(lambda module: order.append(module.fully_qualified_name) or len(order))
+  check_imports_first(parsed.import_graph(), order)
+  assert results == {name: index + 1 for index, name in enumerate(order)}
+  # The same with a pool (a component at a time).
+  assert parsed.process_modules(lambda module: module.fully_qualified_name, jobs=2) == {name: name for name in order}
+
+
+def report_nodes(parsed, tmp_path):
+  path = str(tmp_path / "summary.jsonl")
+  parsed.resolve_references(report=ReportSink.create(ReportFormat.Jsonl, path))
+  with open(path) as f:
+    lines = [json.loads(line) for line in f]
+  return [line["path"] for line in lines if line["kind"] == "node"]
+
+
+def test_references_are_bound_in_import_waves(tmp_path):
+  parsed = parse_project(SOURCES, resolve=False)
+  nodes = report_nodes(parsed, tmp_path)
+  graph = parsed.import_graph()
+  wave_of = {graph.names[member]: index for index, wave in enumerate(graph.waves) for component in wave for member in graph.components[component]}
+  waves = [wave_of[".".join(path.split(".")[:2])] for path in nodes]
+  assert waves == sorted(waves)
+  assert waves[0] < waves[-1]
+  # In whatever order, they're bound the same.
+  in_module_order = parse_project(SOURCES, resolve=False)
+  unresolved = project.resolve_references(list(in_module_order.modules()), libraries=None)
+  assert unresolved == parsed.unresolved_references
+  targets = lambda p: [
+    (reference.fully_qualified_name, reference.resolution, reference.target and reference.target.project_unique_path)
+    for module in p.modules() for node, _ in module.all_nodes() for reference in node.references
+  ]
+  assert targets(parsed) == targets(in_module_order)
+  # The compact project binds them in the same order.
+  compact = CompactProject.from_modules(parse_project(SOURCES, resolve=False).modules())
+  assert report_nodes(compact, tmp_path) == nodes
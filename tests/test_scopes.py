@@ -0,0 +1,198 @@
+import json
+import pickle
+import random
+from typing import Dict, List, Optional
+
+import pytest
+
+from iawmr.deep_code import model
+from iawmr.deep_code.model import Scope
+from iawmr.deep_code.parsing.state import ParsingOptions
+
+from helpers import parse_project, push_everything
+
+
+def parent_chain_resolve(scope: Scope, name: str) -> Optional[str]:
+  """How Scope.resolve worked before the caches: rename through every alias on the way up."""
+  located = False
+  current: Optional[Scope] = scope
+  while current is not None:
+    if name in current.aliases:
+      name = current.aliases[name]
+      located = True
+    current = current.parent
+  return name if located else None
+
+
+NAMES = ["a", "b", "c", "d", "os", "os.path", "np", "numpy"]
+
+
+def random_tree(rng: random.Random, count: int = 40) -> List[Scope]:
+  scopes = [Scope(name="module", aliases={})]
+  for index in range(1, count):
+    scopes.append(Scope(id=index, name=f"scope {index}", parent=rng.choice(scopes), aliases={}))
+  for _ in range(count * 2):
+    rng.choice(scopes).add_alias(rng.choice(NAMES), rng.choice(NAMES))
+  return scopes
+
+
+def test_resolve_matches_the_parent_chain_walk():
+  rng = random.Random(0)
+  for _ in range(20):
+    scopes = random_tree(rng)
+    for scope in rng.sample(scopes, len(scopes)):
+      for name in NAMES + ["missing"]:
+        assert scope.resolve(name) == parent_chain_resolve(scope, name)
+
+
+def test_resolve_matches_the_parent_chain_walk_as_aliases_get_added():
+  rng = random.Random(1)
+  scopes = random_tree(rng, count=20)
+  for _ in range(200):
+    scope = rng.choice(scopes)
+    name = rng.choice(NAMES)
+    assert scope.resolve(name) == parent_chain_resolve(scope, name)
+    rng.choice(scopes).add_alias(rng.choice(NAMES), rng.choice(NAMES))
+
+
+def test_alias_added_on_an_ancestor_invalidates_the_cache():
+  module = Scope(name="module", aliases={})
+  function = Scope(name="function", parent=module, aliases={})
+  inner = Scope(name="inner", parent=function, aliases={})
+  assert inner.resolve("np") is None
+  module.add_alias("np", "numpy")
+  assert inner.resolve("np") == "numpy"
+  # Renamed further up, after being cached.
+  function.add_alias("array", "np.array")
+  assert inner.resolve("array") == "np.array"
+  module.add_alias("np", "jax.numpy")
+  assert inner.resolve("np") == "jax.numpy"
+  assert inner.resolve("array") == "np.array"
+
+
+def test_alias_added_on_a_sibling_does_not_change_the_result():
+  module = Scope(name="module", aliases={})
+  left = Scope(name="left", parent=module, aliases={})
+  right = Scope(name="right", parent=module, aliases={})
+  assert left.resolve("os") is None
+  right.add_alias("os", "os")
+  assert left.resolve("os") is None
+  assert right.resolve("os") == "os"
+
+
+def test_frozen_scope_resolves_like_before_freezing():
+  rng = random.Random(2)
+  scopes = random_tree(rng)
+  expected = {(scope.id, name): parent_chain_resolve(scope, name) for scope in scopes for name in NAMES + ["missing"]}
+  for scope in scopes:
+    scope.freeze()
+  for scope in scopes:
+    assert scope.frozen
+    for name in NAMES + ["missing"]:
+      assert scope.resolve(name) == expected[(scope.id, name)]
+
+
+def test_frozen_scope_does_not_walk_up_the_parents():
+  module = Scope(name="module", aliases={})
+  function = Scope(name="function", parent=module, aliases={})
+  module.add_alias("pd", "pandas")
+  function.freeze()
+  # Anything outside of resolved is None now, without asking the parents.
+  module.aliases["sneaky"] = "not.seen"
+  assert function.resolve("pd") == "pandas"
+  assert function.resolve("sneaky") is None
+
+
+def test_alias_added_after_freeze_thaws_and_refreezes():
+  module = Scope(name="module", aliases={})
+  function = Scope(name="function", parent=module, aliases={})
+  module.add_alias("np", "numpy")
+  function.freeze()
+  module.add_alias("pd", "pandas")
+  function.add_alias("np", "jax.numpy")
+  assert function.resolve("pd") == "pandas"
+  assert function.resolve("np") == "jax.numpy"
+  assert function.frozen
+  # A scope made after its parent was frozen (a lazy body) still sees through it.
+  body = Scope(name="body", parent=function, aliases={})
+  assert body.resolve("pd") == "pandas"
+  assert body.resolve("np") == "jax.numpy"
+  assert body.resolve("missing") is None
+
+
+def test_alias_only_thaws_the_scope_and_its_descendants():
+  module = Scope(name="module", aliases={})
+  left = Scope(name="left", parent=module, aliases={})
+  inner = Scope(name="inner", parent=left, aliases={})
+  right = Scope(name="right", parent=module, aliases={})
+  module.add_alias("np", "numpy")
+  for scope in [module, left, inner, right]:
+    scope.freeze()
+  left.add_alias("pd", "pandas")
+  assert [scope.stale for scope in [module, left, inner, right]] == [False, True, True, False]
+  assert right.resolved == {"np": "numpy"}
+  assert inner.resolve("pd") == "pandas"
+  assert right.resolve("pd") is None
+  assert inner.frozen and not inner.stale
+
+
+SOURCES = {
+  "pkg/mod.py": (
+    "import os\nimport numpy as np\n\n"
+    "class Thing:\n  from os import path\n\n  def method(self, key=lambda item: np.sort(item)):\n"
+    "    import json as encoder\n    return [encoder.dumps(x) for x in (key(y) for y in self.items)]\n\n"
+    "def main():\n  return Thing().method()\n"
+  ),
+}
+
+
+def json_resolve(table: List[Dict], scope_id: int, name: str) -> Optional[str]:
+  """Scope.resolve, on the exported table: rename through the aliases going up the parent ids."""
+  located = False
+  while scope_id is not None:
+    scope = table[scope_id]
+    if name in scope["aliases"]:
+      name = scope["aliases"][name]
+      located = True
+    scope_id = scope["parent_id"]
+  return name if located else None
+
+
+def scoped_nodes(module: model.Module):
+  return [node for node in module.all_children() if isinstance(node, model.ScopedNode)]
+
+
+@pytest.mark.parametrize("lazy_bodies", [False, True])
+def test_module_scope_table(lazy_bodies):
+  [module] = parse_project(SOURCES, strategy=push_everything(), options=ParsingOptions(lazy_bodies=lazy_bodies)).modules()
+  module.expand_all()
+  # Each scope once, at its id
+  assert [scope.id for scope in module.scopes] == list(range(len(module.scopes)))
+  assert len({id(scope) for scope in module.scopes}) == len(module.scopes)
+  used = {id(node.scope) for node in scoped_nodes(module)}
+  used.update(id(scope.parent) for scope in module.scopes if scope.parent is not None)
+  assert used == {id(scope) for scope in module.scopes}
+  for node in scoped_nodes(module):
+    assert module.scopes[node.scope.id] is node.scope
+
+
+def test_json_refers_to_the_scope_table():
+  [module] = parse_project(SOURCES, strategy=push_everything()).modules()
+  exported = json.loads(module.model_dump_json())
+  table = exported["scopes"]
+  assert len(table) == len(module.scopes) > 3
+  assert [scope["id"] for scope in table] == list(range(len(table)))
+  assert [scope["parent_id"] for scope in table] == [None if scope.parent is None else scope.parent.id for scope in module.scopes]
+  assert exported["scope_id"] == module.scope.id
+  names = ["os", "np", "path", "encoder", "np.sort", "Thing", "missing"]
+  for scope in module.scopes:
+    for name in names:
+      assert json_resolve(table, scope.id, name) == scope.resolve(name)
+
+
+def test_pickled_modules_keep_sharing_their_scopes():
+  [module] = parse_project(SOURCES).modules()
+  loaded = pickle.loads(pickle.dumps(module))
+  assert [scope.model_dump() for scope in loaded.scopes] == [scope.model_dump() for scope in module.scopes]
+  for node in scoped_nodes(loaded):
+    assert loaded.scopes[node.scope.id] is node.scope
@@ -0,0 +1,66 @@
+import ast
+import inspect
+
+import pytest
+
+import iawmr.deep_code.parsing.parsing as parsing
+from iawmr.deep_code.parsing.strategy import DecisionTable, ParsingStrategy, PushCheckResultType, PushRule, PushRuleType
+
+from helpers import push_everything
+
+
+def by_class_name() -> ParsingStrategy:
+  return ParsingStrategy(rules=[
+    PushRule(rule_type=PushRuleType.IsClassName, result_type=PushCheckResultType.Prune, values={"Constant", "JoinedStr"}),
+    PushRule(rule_type=PushRuleType.IsInstance, result_type=PushCheckResultType.Push, values={"ast.FunctionDef", "ast.ClassDef", "ast.mod"}),
+    PushRule(rule_type=PushRuleType.IsInstance, result_type=PushCheckResultType.Descend, values={"ast.stmt", "ast.expr"}),
+  ])
+
+
+STRATEGIES = [ParsingStrategy.create, push_everything, by_class_name]
+
+
+def walked_nodes():
+  # Some real code, to see plenty of ast classes
+  return list(ast.walk(ast.parse(inspect.getsource(parsing))))
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_decision_table_decides_like_the_rules(strategy):
+  strategy = strategy()
+  table = strategy.compile()
+  assert table.decisions is not None
+  decided = 0
+  for node in walked_nodes():
+    try:
+      expected = strategy.decide_by_rules(node)
+    except Exception:
+      with pytest.raises(Exception):
+        table.decide(node)
+      continue
+    assert table.decide(node) == expected
+    assert table.should_push(node) == strategy.should_push(node) == expected[0]
+    assert table.should_descend_into(node) == strategy.should_descend_into(node) == expected[1]
+    decided += 1
+  assert decided > 1000
+
+
+def test_decision_table_handles_classes_made_after_it():
+  strategy = by_class_name()
+  table = strategy.compile()
+
+  class Later(ast.FunctionDef):
+    pass
+
+  node = Later(name="later", body=[], decorator_list=[])
+  assert Later not in table.decisions
+  assert table.decide(node) == strategy.decide_by_rules(node) == (True, True)
+  assert Later in table.decisions
+
+
+def test_compile_is_cached_on_the_strategy():
+  strategy = ParsingStrategy.create()
+  assert strategy.compile() is strategy.compile()
+  assert isinstance(strategy.compile(), DecisionTable)
+  # The table isn't one of the model's fields
+  assert "_table" not in ParsingStrategy.model_fields
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import iawmr.deep_code.project as project
+from iawmr.deep_code.parsing.parsing import Parsing
+from iawmr.deep_code.parsing.state import ParsingOptions
+from iawmr.deep_code.parsing.strategy import ParsingStrategy
+from iawmr.deep_code.validation import TreeValidationError, TreeValidator, ViolationType
+
+
+TWICE = """\
+import sys
+
+if sys.platform == "win32":
+  def home():
+    return "C:/"
+else:
+  def home():
+    return "/"
+"""
+
+
+def write_sources(root: str) -> None:
+  os.makedirs(os.path.join(root, "pkg"))
+  with open(os.path.join(root, "pkg", "paths.py"), "w") as f:
+    f.write(TWICE)
+  with open(os.path.join(root, "pkg", "other.py"), "w") as f:
+    f.write("def home():\n  pass\n")
+
+
+def parse(root: str, options: ParsingOptions) -> project.SourceDirectory:
+  return Parsing.parse_source_directory(
+    directory_type=project.SourceDirectoryType.Application,
+    root_path=root,
+    parsing_strategy=ParsingStrategy.create(),
+    ignores=[],
+    options=options,
+  )
+
+
+def test_duplicate_paths_are_found():
+  _, module = Parsing.parse_source("m.py", TWICE, ParsingStrategy.create())
+  violations = TreeValidator.validate([module])
+  assert [violation.violation_type for violation in violations] == [ViolationType.DuplicatePath.value] * 2
+  assert {violation.project_unique_path for violation in violations} == {"m.body[1].home", "m.body[1].home.body[0]"}
+  assert TreeValidator.validate([module], unique_paths=False) == []
+
+
+def test_parse_source_directory_warns_about_duplicate_paths(tmp_path):
+  write_sources(str(tmp_path))
+  with pytest.warns(UserWarning, match=r"pkg\.paths\.body\[1\]\.home"):
+    directory = parse(str(tmp_path), ParsingOptions())
+  assert sorted(directory.modules) == ["pkg.other", "pkg.paths"]
+
+
+def test_parse_source_directory_raises_with_unique_paths(tmp_path):
+  write_sources(str(tmp_path))
+  with pytest.raises(TreeValidationError):
+    parse(str(tmp_path), ParsingOptions(unique_paths=True))
+
+
+def test_parse_source_directory_skips_the_checks_without_validate_tree(tmp_path):
+  write_sources(str(tmp_path))
+  directory = parse(str(tmp_path), ParsingOptions(unique_paths=True, validate_tree=False))
+  assert sorted(directory.modules) == ["pkg.other", "pkg.paths"]
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from iawmr.deep_code.parsing.walker import IgnorePatterns, walk_source_files
+
+from helpers import write_sources
+
+
+SOURCES = {
+  "main.py": "",
+  "notes.txt": "",
+  "pkg/__init__.py": "",
+  "pkg/big.py": "x = 1\n" * 100,
+  "pkg/stubs.pyi": "",
+  "pkg/venv/inside.py": "",
+  "pkg/gen/made.py": "",
+  "pkg/sub/gen/made.py": "",
+  "pkg/sub/deep/leaf.py": "",
+  "build/out.py": "",
+  "docs/conf.py": "",
+  "docs/api/conf.py": "",
+  "venv/lib/site.py": "",
+  "tests/test_a.py": "",
+  "tests/data_1.py": "",
+}
+
+
+def walk(root, ignores, **kwargs):
+  return [os.path.relpath(path, root).replace(os.sep, "/") for path in walk_source_files(root, IgnorePatterns(ignores), **kwargs)]
+
+
+def os_walk(root):
+  # What find_source_files did before the walker
+  file_paths = []
+  for directory, _, files in os.walk(root):
+    for filename in files:
+      if filename.endswith(".py"):
+        file_paths.append(os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, "/"))
+  return file_paths
+
+
+@pytest.fixture
+def root(tmp_path):
+  write_sources(str(tmp_path / "root"), SOURCES)
+  return str(tmp_path / "root")
+
+
+def test_same_files_in_the_same_order_as_os_walk(root):
+  os.symlink(os.path.join(root, "pkg", "sub"), os.path.join(root, "linked_directory"))
+  os.symlink(os.path.join(root, "main.py"), os.path.join(root, "pkg", "linked_file.py"))
+  found = walk(root, [])
+  assert found == os_walk(root)
+  # Symlinked files are walked, symlinked directories aren't
+  assert "pkg/linked_file.py" in found
+  assert not any(path.startswith("linked_directory/") for path in found)
+
+
+@pytest.mark.parametrize("pattern,ignored", [
+  ("venv", {"pkg/venv/inside.py", "venv/lib/site.py"}),
+  ("/venv", {"venv/lib/site.py"}),
+  ("/build", {"build/out.py"}),
+  ("docs/*.py", {"docs/conf.py"}),
+  ("docs/**/*.py", {"docs/conf.py", "docs/api/conf.py"}),
+  ("**/gen/", {"pkg/gen/made.py", "pkg/sub/gen/made.py"}),
+  ("pkg/*/gen", {"pkg/sub/gen/made.py"}),
+  ("test_*.py", {"tests/test_a.py"}),
+  ("data_[0-9].py", {"tests/data_1.py"}),
+  ("big.py/", set()),
+  ("# venv", set()),
+])
+def test_ignore_patterns(root, pattern, ignored):
+  everything = set(walk(root, []))
+  assert everything - set(walk(root, [pattern])) == ignored
+
+
+def test_ignored_directories_are_never_entered(root, monkeypatch):
+  entered = []
+  scandir = os.scandir
+  def recording_scandir(path):
+    entered.append(os.path.relpath(path, root).replace(os.sep, "/"))
+    return scandir(path)
+  monkeypatch.setattr(os, "scandir", recording_scandir)
+  walk(root, ["venv", "/docs", "**/gen/"])
+  assert set(entered) == {".", "pkg", "pkg/sub", "pkg/sub/deep", "build", "tests"}
+
+
+def test_max_file_size(root):
+  os.symlink(os.path.join(root, "missing.py"), os.path.join(root, "dangling.py"))
+  found = walk(root, [], max_file_size=100)
+  assert "pkg/big.py" not in found
+  assert "dangling.py" not in found
+  assert set(found) == set(walk(root, [])) - {"pkg/big.py", "dangling.py"}
+
+
+def test_negated_patterns_are_rejected():
+  with pytest.raises(ValueError):
+    IgnorePatterns(["venv", "!venv/keep.py"])
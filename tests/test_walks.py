@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+import iawmr.deep_code.network as network
+from iawmr.deep_code.walks import RandomWalker, RandomWalks, WalkCorpus, WalkOptions, WalkSentences
+
+from helpers import parse_project
+
+
+SOURCES = {
+  "pkg/util.py": "import os\n\ndef helper(path):\n  return os.path.basename(path)\n",
+  "pkg/main.py": "from pkg.util import helper\n\nclass Loader:\n  def run(self, paths):\n    return [helper(path) for path in paths]\n\nLoader().run(['x'])\n",
+}
+
+
+@pytest.fixture(scope="module")
+def graph():
+  return network.build_graph(parse_project(SOURCES))
+
+
+def csr(edges, node_count):
+  """A walker over an undirected graph given as edges, rows sorted by target (like CodeGraph's)."""
+  rows = [set() for _ in range(node_count)]
+  for a, b in edges:
+    rows[a].add(b)
+    rows[b].add(a)
+  offsets = np.zeros(node_count + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(row) for row in rows])
+  targets = np.array([target for row in rows for target in sorted(row)], dtype=np.int32)
+  return RandomWalker(offsets=offsets, targets=targets)
+
+
+@pytest.mark.parametrize("p,q", [(1.0, 1.0), (0.5, 2.0), (4.0, 0.25)])
+def test_walks_are_deterministic_per_seed(graph, p, q):
+  options = WalkOptions(walk_length=12, num_walks=3, p=p, q=q, seed=5, batch_size=64)
+  walks = RandomWalks.generate(graph, options)
+  assert walks.shape == (3 * graph.node_count, 12)
+  assert (RandomWalks.generate(graph, options) == walks).all()
+  # Not on the number of processes
+  assert (RandomWalks.generate(graph, options.model_copy(update={"jobs": 2})) == walks).all()
+  assert not (RandomWalks.generate(graph, options.model_copy(update={"seed": 6})) == walks).all()
+
+
+def test_walks_follow_the_edges(graph):
+  walks = RandomWalks.generate(graph, WalkOptions(walk_length=10, num_walks=2, p=0.5, q=2.0))
+  # Every node starts num_walks of them
+  assert (np.bincount(walks[:, 0], minlength=graph.node_count) == 2).all()
+  for walk in walks:
+    steps = walk[walk >= 0]
+    # Padding only after the walk stops
+    assert (walk[len(steps):] == -1).all()
+    for a, b in zip(steps[:-1].tolist(), steps[1:].tolist()):
+      assert b in graph.neighbors(a)
+
+
+def test_walks_stop_at_nodes_without_edges():
+  walker = csr([(0, 1)], node_count=3)
+  walks = walker.walk(np.array([0, 2], dtype=np.int32), walk_length=4, p=1.0, q=1.0, rng=np.random.default_rng(0))
+  assert walks[0].tolist() == [0, 1, 0, 1]
+  assert walks[1].tolist() == [2, -1, -1, -1]
+
+
+def test_biased_steps_have_node2vec_probabilities():
+  # From 0 to 1, then: back to 0 (weight 1/p), to 2 (a neighbor of 0 too, weight 1) or to 3 and 4 (weight 1/q)
+  walker = csr([(0, 1), (0, 2), (1, 2), (1, 3), (1, 4)], node_count=5)
+  p, q = 0.5, 4.0
+  weights = {0: 1 / p, 2: 1.0, 3: 1 / q, 4: 1 / q}
+  total = sum(weights.values())
+  count = 40000
+  rng = np.random.default_rng(3)
+  walks = walker.walk(np.zeros(count, dtype=np.int32), walk_length=3, p=p, q=q, rng=rng)
+  after = walks[walks[:, 1] == 1, 2]
+  assert len(after) > count / 3
+  frequencies = np.bincount(after, minlength=5) / len(after)
+  for node, weight in weights.items():
+    assert frequencies[node] == pytest.approx(weight / total, abs=0.015)
+  assert frequencies[1] == 0
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_corpus_round_trip(graph, tmp_path, compress):
+  options = WalkOptions(walk_length=9, num_walks=3, batch_size=50)
+  walks = RandomWalks.generate(graph, options)
+  corpus = WalkCorpus.write(str(tmp_path / "walks.walks"), RandomWalks.chunks(graph, options), options.walk_length, compress=compress)
+  assert len(corpus) == len(walks)
+  chunks = list(corpus.chunks())
+  assert [len(chunk) for chunk in chunks] == [len(chunk) for chunk in RandomWalks.chunks(graph, options)]
+  assert (np.concatenate(chunks) == walks).all()
+  # Word2Vec goes over it once per epoch
+  assert list(corpus) == list(WalkSentences(walks))
+  assert list(corpus) == list(WalkCorpus(corpus.path))
+
+
+def test_corpus_rejects_other_files(tmp_path):
+  path = tmp_path / "other.walks"
+  path.write_bytes(b"\0" * 64)
+  with pytest.raises(ValueError):
+    WalkCorpus(str(path))
+
+
+def test_walks_over_budget_stop_early(graph):
+  options = WalkOptions(walk_length=8, num_walks=2, batch_size=10, max_bytes=4 * 8 * 25)
+  with pytest.warns(UserWarning):
+    walks = RandomWalks.generate(graph, options)
+  assert len(walks) == 25
+  # The same starts, and the same walks for the batches that are whole
+  unlimited = RandomWalks.generate(graph, options.model_copy(update={"max_bytes": None}))
+  assert (walks[:, 0] == unlimited[:25, 0]).all()
+  assert (walks[:20] == unlimited[:20]).all()
+
+
+def test_embeddings_from_the_corpus_cover_the_same_nodes(graph, tmp_path):
+  options = WalkOptions(walk_length=8, num_walks=2)
+  in_memory = network.fit_node2vec(graph, options, dimensions=4, epochs=1, store_path=str(tmp_path / "memory.embeddings"))
+  streamed = network.fit_node2vec(
+    graph, options, dimensions=4, epochs=1,
+    corpus_path=str(tmp_path / "walks.walks"), compress_corpus=True, store_path=str(tmp_path / "streamed.embeddings"),
+  )
+  assert sorted(streamed.ids.tolist()) == sorted(in_memory.ids.tolist()) == list(range(graph.node_count))
+  assert streamed.dimensions == 4